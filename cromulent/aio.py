@@ -0,0 +1,80 @@
+# asyncio variants of the factory's output methods, for use from an event loop.
+# Serialization, os.makedirs and the file write are all blocking, so each call
+# (or batch of calls) is run in an executor -- by default the loop's own thread
+# pool -- and the loop thread only waits on the result. Threads share the GIL,
+# so this keeps the loop responsive rather than making serialization faster;
+# use factory.write_many for that.
+# The calls share the factory, so its settings must not be changed while any
+# are running. What changes during a call is kept per thread (the cache_json
+# key, and the serializer and full names that toRDF uses with PyLD), and
+# write_counts are updated under a lock.
+# These are normally reached through factory.toStringAsync, toFileAsync and
+# write_many_async, which keep this module out of the import of model.
+
+import asyncio
+from functools import partial
+
+from cromulent.model import WriteResult, ConfigurationError, _batches
+
+async def toString(factory, what, compact=True, collapse=0, done=None, executor=None):
+	loop = asyncio.get_running_loop()
+	return await loop.run_in_executor(executor, partial(factory.toString, what,
+		compact=compact, collapse=collapse, done=done))
+
+async def toFile(factory, what, executor=None, **kw):
+	# One executor call for the whole of toFile, rather than one per step
+	loop = asyncio.get_running_loop()
+	return await loop.run_in_executor(executor, partial(factory.toFile, what, **kw))
+
+async def _aiter(iterable):
+	for x in iterable:
+		yield x
+
+async def _abatches(aiterable, size):
+	batch = []
+	async for x in aiterable:
+		batch.append(x)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+async def write_many(factory, resources, concurrency=8, batch_size=10, executor=None, **kw):
+	"""Write resources (an iterable or async iterable) with toFile.
+
+	Resources are written batch_size at a time in executor, with at most
+	concurrency batches in flight; the rest of resources is not consumed
+	until one finishes. Returns a WriteResult, as for write_many.
+	"""
+	if concurrency < 1:
+		raise ConfigurationError("concurrency must be at least 1")
+	loop = asyncio.get_running_loop()
+	limit = asyncio.Semaphore(concurrency)
+	totals = {"written": 0, "skipped": 0}
+	errors = []
+	tasks = set()
+
+	async def run(batch):
+		try:
+			(n, errs, skipped, _) = await loop.run_in_executor(executor, factory._write_batch, batch, kw)
+		except Exception as e:
+			(n, errs, skipped) = (0, [(w.id, "%s: %s" % (e.__class__.__name__, e)) for w in batch], 0)
+		finally:
+			limit.release()
+		totals["written"] += n
+		totals["skipped"] += skipped
+		errors.extend(errs)
+
+	if hasattr(resources, '__aiter__'):
+		batches = _abatches(resources, batch_size)
+	else:
+		batches = _aiter(_batches(resources, batch_size))
+	async for batch in batches:
+		await limit.acquire()
+		task = asyncio.ensure_future(run(batch))
+		tasks.add(task)
+		task.add_done_callback(tasks.discard)
+	if tasks:
+		await asyncio.gather(*tasks)
+	return WriteResult(totals["written"], errors, totals["skipped"])
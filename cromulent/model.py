@@ -9,14 +9,54 @@ import inspect
 import uuid
 import datetime
 import json
+import pickle
+import itertools
+import hashlib
+import errno
+import threading
 from json import JSONEncoder
+from json.encoder import encode_basestring
 from collections import OrderedDict
 from collections import namedtuple
-from pyld import jsonld
-from rdflib import ConjunctiveGraph
+from contextlib import contextmanager
 
 KEY_ORDER_DEFAULT = 10000
 LINKED_ART_CONTEXT_URI = "https://linked.art/ns/v1/linked-art.json"
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+# Compact storage has to be chosen before the classes are built, so it
+# is configured from the environment rather than on the factory
+COMPACT_STORAGE = os.environ.get("CROMULENT_COMPACT_STORAGE", "").lower() in ["1", "true", "yes"]
+# The properties set on (nearly) every resource get a slot, as do those most
+# often set on the classes with the most instances, the rest go into a flat
+# (name, value, name, value ...) tuple in _values. A class with more than one
+# parent can only have slots from its first, as it's built under that one
+COMPACT_SLOTS = ('id', '_label', 'classified_as', '_values')
+COMPACT_CLASS_SLOTS = {
+	"LinguisticObject": ('content', 'language'),
+	"Identifier": ('content',),
+	"Dimension": ('value', 'unit'),
+	"MonetaryAmount": ('currency',),
+	"TimeSpan": ('begin_of_the_begin', 'end_of_the_end'),
+	"Activity": ('timespan', 'carried_out_by', 'took_place_at'),
+	"HumanMadeObject": ('identified_by', 'referred_to_by', 'dimension', 'produced_by', 'member_of'),
+	"Person": ('identified_by', 'referred_to_by'),
+	"Group": ('identified_by', 'referred_to_by')
+}
+_class_slots = {}
+
+def _compact_slots(clss):
+	"""The names of the slots of instances of clss, other than _values"""
+	try:
+		return _class_slots[clss]
+	except KeyError:
+		pass
+	names = []
+	for c in reversed(clss.__mro__):
+		for n in c.__dict__.get('__slots__', ()):
+			if n != '_values' and not n in names:
+				names.append(n)
+	return _class_slots.setdefault(clss, tuple(names))
 
 # 2.5 and 2.6 are very out of date. Assume 2.7 or better
 
@@ -29,7 +69,50 @@ except:
 	FILE_STREAM_CLASS = io.TextIOBase
 
 
-pyld_proc = jsonld.JsonLdProcessor()
+# pyld and rdflib are slow to import and only needed for RDF output,
+# so they are imported on first use
+_pyld_proc = None
+
+def get_pyld_processor():
+	global _pyld_proc
+	if _pyld_proc is None:
+		from pyld import jsonld
+		_pyld_proc = jsonld.JsonLdProcessor()
+	return _pyld_proc
+
+def __getattr__(name):
+	# Keep model.pyld_proc working for existing code
+	if name == "pyld_proc":
+		return get_pyld_processor()
+	raise AttributeError("module '%s' has no attribute '%s'" % (__name__, name))
+
+# orjson is an optional, faster, JSON backend
+_orjson = False
+
+def get_orjson():
+	"""Return the orjson module, or None if it is not installed"""
+	global _orjson
+	if _orjson is False:
+		try:
+			import orjson as _orjson
+		except ImportError:
+			_orjson = None
+	return _orjson
+
+def _orjson_floats(js):
+	"""Is there a float in js that orjson writes differently to json?"""
+	stack = [js]
+	while stack:
+		v = stack.pop()
+		if isinstance(v, float):
+			if v != v or v in (float('inf'), float('-inf')) or 'e' in repr(v):
+				return True
+		elif isinstance(v, dict):
+			stack.extend(v.values())
+		elif isinstance(v, (list, tuple)):
+			stack.extend(v)
+	return False
+
 min_context = {
 	"crm": "http://www.cidoc-crm.org/cidoc-crm/",
     "sci": "http://www.ics.forth.gr/isl/CRMsci/",
@@ -49,6 +132,16 @@ min_context = {
 re_bnodes = re.compile("^_:b([0-9]+) ", re.M)
 re_bnodeo = re.compile("> _:b([0-9]+) <", re.M)
 re_quad = re.compile(" <[^<]+?> .$", re.M)
+re_double = re.compile(r'(\d)0*E\+?(-)?0*(\d)')
+# orjson output that might differ from json's: NaN and Infinity as null, exponents
+# without a + or 0, and floats from 1e-5 to 1e-4 as decimals rather than exponents
+re_orjson_diff = re.compile(rb'null|[0-9]e|0\.0000')
+# ints too long for orjson, which reads them as floats
+re_long_int = re.compile('[0-9]{20}')
+re_long_int_b = re.compile(b'[0-9]{20}')
+XSD_BOOLEAN = "http://www.w3.org/2001/XMLSchema#boolean"
+XSD_INTEGER = "http://www.w3.org/2001/XMLSchema#integer"
+XSD_DOUBLE = "http://www.w3.org/2001/XMLSchema#double"
 
 PropInfo = namedtuple("PropInfo", [
 	'property', # the name of the property, eg 'identified_by'
@@ -100,6 +193,693 @@ class CromJsonEncoder(JSONEncoder):
 		else:
 			return JSONEncoder.default(self, o)			
 
+class _StreamRef(object):
+	"""Placeholder for a child resource whose serialization is deferred until
+	it is written out by toStream()"""
+
+	__slots__ = ('parent', 'resource', 'value', 'resolved')
+
+	def __init__(self, parent, resource):
+		self.parent = id(parent)
+		self.resource = resource
+		self.value = None
+		self.resolved = False
+
+	def resolve(self, done, top, fast=False, defer=False):
+		# Same bookkeeping as the recursive serializers do before recursing
+		v = self.resource
+		if done[id(v)] == self.parent:
+			del done[id(v)]
+		if fast:
+			self.value = v._toJSON_fast(done=done, top=top, defer=defer)
+		else:
+			self.value = v._toJSON(done=done, top=top, defer=defer)
+		self.resolved = True
+		return self.value
+
+# Stamps recording when a resource was last changed, for factory.cache_json
+_json_stamps = itertools.count(1)
+
+class _CachedJSON(object):
+	"""A resource's serialized JSON, and what it depends on.
+
+	nodes are (resource, stamp) for every resource that appears in the
+	value, full the ids it serialized completely, refs the ids it only
+	referenced because they were already done, and marked the ids it
+	added to done at linked art boundaries
+	"""
+
+	__slots__ = ('key', 'value', 'nodes', 'full', 'refs', 'marked')
+
+	def __init__(self, key, what, full):
+		self.key = key
+		self.value = None
+		self.nodes = [(what, what._json_stamp)]
+		self.full = [id(what)] if full else []
+		self.refs = []
+		self.marked = []
+
+	def mark(self, what):
+		self.marked.append(id(what))
+		self.nodes.append((what, what._json_stamp))
+
+	def add_child(self, what, value):
+		if not isinstance(what, BaseResource):
+			# External references don't depend on anything
+			return
+		entry = what._json_cache
+		if entry is not None and entry.value is value:
+			# Serialized here, either now or from the cache
+			self.nodes.extend(entry.nodes)
+			self.full.extend(entry.full)
+			self.refs.extend(entry.refs)
+			self.marked.extend(entry.marked)
+		else:
+			self.refs.append(id(what))
+			self.nodes.append((what, what._json_stamp))
+
+	def finish(self, what, value):
+		self.value = value
+		# Only references to resources done outside of this one matter
+		inside = set(self.full)
+		inside.update(self.marked)
+		self.refs = [r for r in self.refs if r not in inside]
+		what._store('_json_cache', self)
+
+	def reuse(self, done):
+		"""Return the value if it would be serialized the same way now, and
+		update done as serializing it would"""
+		for (what, stamp) in self.nodes:
+			if what._json_stamp != stamp:
+				return None
+		for i in self.full:
+			if i in done:
+				return None
+		for i in self.refs:
+			if i not in done:
+				return None
+		for i in self.full:
+			done[i] = 1
+		for i in self.marked:
+			done[i] = 1
+		return self.value
+
+class _EmitPlan(dict):
+	"""Per-class plan for the compiled serializer, mapping each property
+	name to (sort order, encoded output key), or None if it is not written"""
+
+	def __init__(self, clss, factory):
+		dict.__init__(self)
+		self.clss = clss
+		self.factory = factory
+		# type is the same for every instance of the class, unless the
+		# class has its own (eg multiple_instantiation), so look it up each time
+		if clss.type is BaseResource.type:
+			self.type = ""
+			for c in clss._classhier:
+				if c._type:
+					self.type = encode_basestring(c.__name__)
+					break
+		else:
+			self.type = None
+
+	def __missing__(self, k):
+		fac = self.factory
+		if k[0] == "_" and not k in fac.underscore_properties:
+			entry = None
+		else:
+			nk = self.clss._property_name_map.get(k, k)
+			if nk in ['@context', 'id', 'type', '_label']:
+				# already written before the properties
+				entry = None
+			else:
+				entry = (fac.key_order_hash.get(k, fac.key_order_default), encode_basestring(nk), nk)
+		self[k] = entry
+		return entry
+
+class _CompiledWriter(object):
+	"""Write JSON text for a resource using the per-class plans.
+
+	Follows the same traversal as _toJSON_fast, but writes the text directly
+	rather than building dicts for json.dumps
+	"""
+
+	def __init__(self, factory, compact=True, done=None):
+		factory._check_plans()
+		self.factory = factory
+		self.done = {} if done is None else done
+		self.out = []
+		if compact:
+			self.key_sep = ":"
+			self.newlines = [""]
+			self.indent = ""
+		else:
+			self.key_sep = ": "
+			self.newlines = ["\n"]
+			self.indent = " " * factory.json_indent
+
+	def newline(self, level):
+		nls = self.newlines
+		while len(nls) <= level:
+			nls.append(nls[-1] + self.indent)
+		return nls[level]
+
+	def value(self, v, level):
+		out = self.out
+		t = type(v)
+		if t is str:
+			out.append(encode_basestring(v))
+		elif t is int:
+			out.append(str(v))
+		elif t is list:
+			if not v:
+				out.append("[]")
+				return
+			nl = self.newline(level+1)
+			sep = "[" + nl
+			for ni in v:
+				out.append(sep)
+				sep = "," + nl
+				self.value(ni, level+1)
+			out.append(self.newline(level) + "]")
+		elif isinstance(v, dict):
+			if not v:
+				out.append("{}")
+				return
+			nl = self.newline(level+1)
+			sep = "{" + nl
+			for (k, ni) in v.items():
+				out.append(sep + encode_basestring(k) + self.key_sep)
+				sep = "," + nl
+				self.value(ni, level+1)
+			out.append(self.newline(level) + "}")
+		elif isinstance(v, datetime.datetime):
+			out.append('"%s"' % v.strftime("%Y-%m-%dT%H:%M:%SZ"))
+		else:
+			out.append(json.dumps(v, ensure_ascii=False))
+
+	def resource(self, what, top, level=0):
+		fac = self.factory
+		done = self.done
+		out = self.out
+		if not isinstance(what, BaseResource):
+			self.value(what._toJSON(done=done, top=top), level)
+			return
+		if not fac.id_type_label and id(what) in done:
+			self.value(what.id, level)
+			return
+
+		plans = fac._emit_plans
+		try:
+			plan = plans[what.__class__]
+		except KeyError:
+			plan = plans.setdefault(what.__class__, _EmitPlan(what.__class__, fac))
+		nl = self.newline(level+1)
+		key_sep = self.key_sep
+		sep = "{" + nl
+
+		if top is what and id(what) not in done and fac.context_uri:
+			out.append(sep + '"@context"' + key_sep)
+			sep = "," + nl
+			self.value(fac.context_uri, level+1)
+		if what.id:
+			out.append(sep + '"id"' + key_sep + encode_basestring(what.id))
+			sep = "," + nl
+		if plan.type:
+			out.append(sep + '"type"' + key_sep + plan.type)
+			sep = "," + nl
+		elif plan.type is None:
+			typ = what.type
+			if typ:
+				out.append(sep + '"type"' + key_sep)
+				sep = "," + nl
+				self.value(typ, level+1)
+		try:
+			lbl = what._label
+		except AttributeError:
+			pass
+		else:
+			out.append(sep + '"_label"' + key_sep)
+			sep = "," + nl
+			self.value(lbl, level+1)
+
+		if (fac.id_type_label and id(what) in done) or (top is not what and not what._embed):
+			out.append(self.newline(level) + "}" if sep[0] == "," else "{}")
+			return
+		done[id(what)] = 1
+
+		d = what._get_props()
+		del d['id']
+		kvs = []
+		for (k, v) in d.items():
+			entry = plan[k]
+			if entry is not None and v:
+				kvs.append((entry, v))
+		if fac.order_json:
+			kvs.sort(key=lambda x: x[0][0])
+
+		# See _toJSON_fast for why children are marked before recursing
+		boundaries = fac.linked_art_boundaries
+		myid = id(what)
+		tbd = []
+		for (entry, v) in kvs:
+			if isinstance(v, ExternalResource):
+				if boundaries and not what._linked_art_boundary_okay(top, entry[2], v):
+					done[id(v)] = 1
+				else:
+					tbd.append(id(v))
+			elif type(v) is list:
+				for ni in v:
+					if isinstance(ni, ExternalResource):
+						if boundaries and not what._linked_art_boundary_okay(top, entry[2], ni):
+							done[id(ni)] = 1
+						else:
+							tbd.append(id(ni))
+		for t in tbd:
+			if not t in done:
+				done[t] = myid
+
+		drop = fac.multiple_instances_per_property == "drop"
+		for (entry, v) in kvs:
+			out.append(sep + entry[1] + key_sep)
+			sep = "," + nl
+			if isinstance(v, ExternalResource):
+				if done[id(v)] == myid:
+					del done[id(v)]
+				self.resource(v, top, level+1)
+			elif type(v) is list:
+				lnl = self.newline(level+2)
+				lsep = "[" + lnl
+				uniq = set()
+				for ni in v:
+					if drop:
+						if id(ni) in uniq:
+							continue
+						else:
+							uniq.add(id(ni))
+					out.append(lsep)
+					lsep = "," + lnl
+					if isinstance(ni, ExternalResource):
+						if done[id(ni)] == myid:
+							del done[id(ni)]
+						self.resource(ni, top, level+2)
+					else:
+						self.value(ni, level+2)
+				out.append(nl + "]")
+			else:
+				self.value(v, level+1)
+		out.append(self.newline(level) + "}" if sep[0] == "," else "{}")
+
+class _RDFWriter(object):
+	"""Write N-Quads lines for a resource without going through JSON-LD.
+
+	Follows the same traversal as _toJSON_fast, so the same resources are
+	described fully or only by their id, type and label as in the JSON.
+	Blank nodes are numbered in the order they are reached.
+	Subclasses can make other kinds of terms by overriding the make_ methods
+	and triple()
+	"""
+
+	plan_key = "nquads"
+
+	def __init__(self, factory, bnode_prefix="", done=None):
+		factory._check_plans()
+		self.factory = factory
+		self.done = {} if done is None else done
+		self.bnode_pattern = "b%s_%%d" % bnode_prefix if bnode_prefix else "b%d"
+		self.bnodes = {}
+		self.bnode_count = 0
+		self.described = set()
+		self.graph = ""
+		self.out = []
+		# Prefixes from the context can also be used in ids and class names
+		self.prefixes = dict(factory.prefixes)
+		self.prefixes.update((k, v) for (k, v) in min_context.items() if v[0] != "@")
+		self.iris = {}
+		self.plans = factory._rdf_plans.setdefault(self.plan_key, {})
+
+	def make_iri(self, iri):
+		return "<%s>" % iri
+
+	def make_bnode(self, label):
+		return "_:" + label
+
+	def make_literal(self, value, datatype=None):
+		value = '"%s"' % value.replace('\\', '\\\\').replace('\t', '\\t').replace(
+			'\n', '\\n').replace('\r', '\\r').replace('"', '\\"')
+		if datatype:
+			return "%s^^<%s>" % (value, datatype)
+		return value
+
+	def iri(self, curie):
+		try:
+			return self.iris[curie]
+		except KeyError:
+			pfx, sep, rest = curie.partition(":")
+			if sep and not rest.startswith("//") and pfx in self.prefixes:
+				term = self.make_iri(self.prefixes[pfx] + rest)
+			else:
+				term = self.make_iri(curie)
+			self.iris[curie] = term
+			return term
+
+	def node(self, what):
+		ident = what._full_id or what.id
+		if ident:
+			return self.iri(ident)
+		try:
+			return self.bnodes[id(what)]
+		except KeyError:
+			term = self.make_bnode(self.bnode_pattern % self.bnode_count)
+			self.bnode_count += 1
+			self.bnodes[id(what)] = term
+			return term
+
+	def reset(self):
+		"""Start on a new record, carrying on the blank node numbering"""
+		# bnodes is by id() so can't outlive the resources
+		self.done = {}
+		self.bnodes = {}
+		self.described = set()
+		self.out = []
+
+	def literal(self, v):
+		if type(v) is bool:
+			return self.make_literal("true" if v else "false", XSD_BOOLEAN)
+		elif isinstance(v, (int, float)):
+			# As JSON-LD 1.1 converts numbers: integral values below 1e21
+			# are xsd:integer, anything else xsd:double
+			if abs(v) < 1e21 and (isinstance(v, int) or v.is_integer()):
+				return self.make_literal("%d" % v, XSD_INTEGER)
+			return self.make_literal(re_double.sub(r'\1E\2\3', '%1.15E' % v), XSD_DOUBLE)
+		elif isinstance(v, datetime.datetime):
+			v = v.strftime("%Y-%m-%dT%H:%M:%SZ")
+		elif not isinstance(v, str):
+			v = str(v)
+		return self.make_literal(v)
+
+	def predicate(self, clss, k):
+		plans = self.plans
+		try:
+			return plans[(clss, k)]
+		except KeyError:
+			nk = clss._property_name_map.get(k, k)
+			if nk == "_label" or (k[0] == "_" and not nk in self.factory.underscore_properties):
+				# _label is written by describe()
+				term = None
+			else:
+				pred = clss._predicate_table.get(nk, None)
+				term = self.iri(pred) if pred and pred[0] != "@" else None
+			plans[(clss, k)] = term
+			return term
+
+	def triple(self, s, p, o):
+		self.out.append("%s %s %s%s .\n" % (s, p, o, self.graph))
+
+	def describe(self, what, subj):
+		# rdf:type and rdfs:label are written for every mention of a
+		# resource, but only need to be in the graph once
+		if id(what) in self.described:
+			return
+		self.described.add(id(what))
+		typ = None
+		for c in what._classhier:
+			if c._type:
+				typ = c._type
+				break
+		if typ:
+			rdftype = self.iri("rdf:type")
+			for t in (typ if type(typ) is list else [typ]):
+				self.triple(subj, rdftype, self.iri(t))
+		try:
+			lbl = what._label
+		except AttributeError:
+			return
+		if lbl:
+			rdfslabel = self.iri("rdfs:label")
+			for l in (lbl if type(lbl) is list else [lbl]):
+				self.triple(subj, rdfslabel, self.literal(l))
+
+	def quads(self, what, graph=True):
+		"""Add the lines for what and return them; graph=False for N-Triples"""
+		if graph and what.id:
+			self.graph = " " + self.node(what)
+		else:
+			self.graph = ""
+		self.resource(what, what)
+		return self.out
+
+	def resource(self, what, top):
+		if not isinstance(what, BaseResource):
+			# An external reference, just the URI
+			return self.node(what)
+		fac = self.factory
+		done = self.done
+		subj = self.node(what)
+		if not fac.id_type_label and id(what) in done:
+			return subj
+		self.describe(what, subj)
+		if (fac.id_type_label and id(what) in done) or (top is not what and not what._embed):
+			return subj
+		done[id(what)] = 1
+
+		d = what._get_props()
+		del d['id']
+		kvs = list(d.items())
+		if fac.order_json:
+			KOH = fac.key_order_hash
+			kodflt = fac.key_order_default
+			kvs.sort(key=lambda x: KOH.setdefault(x[0], kodflt))
+
+		# See _toJSON_fast for why children are marked before recursing
+		boundaries = fac.linked_art_boundaries
+		myid = id(what)
+		tbd = []
+		for (k, v) in kvs:
+			if k[0] == "_" and not k in fac.underscore_properties:
+				continue
+			k = what._property_name_map.get(k, k)
+			if isinstance(v, ExternalResource):
+				if boundaries and not what._linked_art_boundary_okay(top, k, v):
+					done[id(v)] = 1
+				else:
+					tbd.append(id(v))
+			elif type(v) is list:
+				for ni in v:
+					if isinstance(ni, ExternalResource):
+						if boundaries and not what._linked_art_boundary_okay(top, k, ni):
+							done[id(ni)] = 1
+						else:
+							tbd.append(id(ni))
+		for t in tbd:
+			if not t in done:
+				done[t] = myid
+
+		drop = fac.multiple_instances_per_property == "drop"
+		clss = what.__class__
+		for (k, v) in kvs:
+			if not v or (k[0] == "_" and not k in fac.underscore_properties):
+				continue
+			# Values of properties without a predicate are still walked,
+			# as in the JSON, but don't produce triples
+			pred = self.predicate(clss, k)
+			if isinstance(v, ExternalResource):
+				if done[id(v)] == myid:
+					del done[id(v)]
+				obj = self.resource(v, top)
+				if pred:
+					self.triple(subj, pred, obj)
+			elif type(v) is list:
+				uniq = set()
+				for ni in v:
+					if drop:
+						if id(ni) in uniq:
+							continue
+						else:
+							uniq.add(id(ni))
+					if isinstance(ni, ExternalResource):
+						if done[id(ni)] == myid:
+							del done[id(ni)]
+						obj = self.resource(ni, top)
+					else:
+						obj = self.literal(ni)
+					if pred:
+						self.triple(subj, pred, obj)
+			elif pred:
+				self.triple(subj, pred, self.literal(v))
+		return subj
+
+class _GraphWriter(_RDFWriter):
+	"""Add the triples for a resource straight into an rdflib graph.
+
+	If the graph is context aware (a Dataset or ConjunctiveGraph), they go
+	into the named graph of the top resource, as with N-Quads
+	"""
+
+	plan_key = "rdflib"
+
+	def __init__(self, factory, graph, bnode_prefix="", done=None):
+		from rdflib import URIRef, BNode, Literal
+		_RDFWriter.__init__(self, factory, bnode_prefix, done)
+		self.rdf_graph = graph
+		self.bnode_prefix = bnode_prefix
+		self.URIRef = URIRef
+		self.BNode = BNode
+		self.Literal = Literal
+		self.datatypes = {}
+
+	def make_iri(self, iri):
+		return self.URIRef(iri)
+
+	def make_bnode(self, label):
+		# Without a prefix, rdflib's own ids are unique across records
+		return self.BNode(label) if self.bnode_prefix else self.BNode()
+
+	def make_literal(self, value, datatype=None):
+		if datatype:
+			try:
+				datatype = self.datatypes[datatype]
+			except KeyError:
+				datatype = self.datatypes.setdefault(datatype, self.URIRef(datatype))
+		return self.Literal(value, datatype=datatype)
+
+	def triple(self, s, p, o):
+		self.out.append((s, p, o, self.graph))
+
+	def add(self, what):
+		"""Add the triples for what to the graph"""
+		g = self.rdf_graph
+		if not g.context_aware:
+			self.graph = g
+		elif what.id:
+			self.graph = g.get_context(self.node(what))
+		else:
+			self.graph = g.default_context
+		self.resource(what, what)
+		g.addN(self.out)
+		self.out = []
+
+WriteResult = namedtuple("WriteResult", [
+	'written', # the number of resources written
+	'errors', # a list of (id, error message) for those that weren't
+	'skipped' # the number not written as they were unchanged
+])
+
+class WriteManifest(object):
+	"""The hash of the content of each file written by toFile, so that
+	skip_unchanged can tell if a file would be the same without reading
+	it. Saved as lines of hash, tab, filename."""
+
+	def __init__(self, filename=""):
+		self.filename = filename
+		self.hashes = {}
+		if filename and os.path.exists(filename):
+			self.load(filename)
+
+	def __len__(self):
+		return len(self.hashes)
+
+	def __contains__(self, filename):
+		return filename in self.hashes
+
+	def get(self, filename):
+		return self.hashes.get(filename)
+
+	def set(self, filename, digest):
+		self.hashes[filename] = digest
+
+	def load(self, filename):
+		with codecs.open(filename, 'r', 'utf-8') as fh:
+			for l in fh:
+				(digest, fn) = l.rstrip('\n').split('\t', 1)
+				self.hashes[fn] = digest
+
+	def save(self, filename=""):
+		"""Write the manifest, via a temporary file and rename"""
+		filename = filename or self.filename
+		if not filename:
+			raise ConfigurationError("The manifest needs a filename to be saved to")
+		tmp = "%s.%s.tmp" % (filename, os.getpid())
+		with codecs.open(tmp, 'w', 'utf-8') as fh:
+			for (fn, digest) in sorted(self.hashes.items()):
+				fh.write("%s\t%s\n" % (digest, fn))
+		getattr(os, 'replace', os.rename)(tmp, filename)
+
+def _batches(iterable, size):
+	batch = []
+	for x in iterable:
+		batch.append(x)
+		if len(batch) >= size:
+			yield batch
+			batch = []
+	if batch:
+		yield batch
+
+# Directory handles can only be used if files can be opened and renamed
+# relative to them
+DIR_FD_WRITES = hasattr(os, 'supports_dir_fd') and os.open in os.supports_dir_fd \
+	and os.rename in os.supports_dir_fd
+_tmp_counter = itertools.count()
+
+class _DirHandles(object):
+	"""Open handles to output directories for factory.bulk_output, so that
+	files are opened relative to their directory rather than by path.
+	Each thread has its own least recently used set of at most size
+	handles, so one can't be closed while another thread is using it."""
+
+	def __init__(self, size):
+		self.size = size
+		self.local = threading.local()
+		self.lock = threading.Lock()
+		self.caches = []
+
+	def get(self, path):
+		try:
+			fds = self.local.fds
+		except AttributeError:
+			fds = self.local.fds = OrderedDict()
+			with self.lock:
+				self.caches.append(fds)
+		fd = fds.pop(path, None)
+		if fd is None:
+			fd = os.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+			while len(fds) >= self.size:
+				os.close(fds.popitem(last=False)[1])
+		fds[path] = fd
+		return fd
+
+	def forget(self, path):
+		fd = getattr(self.local, 'fds', {}).pop(path, None)
+		if fd is not None:
+			os.close(fd)
+
+	def close(self):
+		with self.lock:
+			for fds in self.caches:
+				while fds:
+					os.close(fds.popitem()[1])
+			self.caches = []
+
+class _Serializing(threading.local):
+	"""The state of the serialization in progress in this thread, so that
+	threads sharing a factory don't see each other's"""
+	json_cache_key = None
+	# Overrides factory.full_names for this call, eg for toRDF with PyLD
+	full_names = None
+
+# write_counts are updated by toFile from many threads with the aio functions
+_write_counts_lock = threading.Lock()
+
+def _worker_init(state, setup):
+	# Runs in each worker process of write_many and Reader.read_dir, to
+	# give it the parent's factory settings after running setup
+	if setup is not None:
+		setup()
+	factory.__dict__.update(pickle.loads(state).__dict__)
+
+def _write_many_batch(batch, kw):
+	return factory._write_batch(batch, kw)
+
 class CromulentFactory(object):
 
 	def __init__(self, base_url="", base_dir="", lang="", full_names=False, 
@@ -139,7 +919,7 @@ class CromulentFactory(object):
 			# Leave this as a map for future extensions
 			context_filemap = {
 				LINKED_ART_CONTEXT_URI: 
-					os.path.join(os.path.dirname(__file__), 'data', 'linked-art.json')
+					os.path.join(DATA_DIR, 'linked-art.json')
 			}
 			context_filemap.update(context_file)
 			self.load_context(context, context_filemap)
@@ -150,8 +930,14 @@ class CromulentFactory(object):
 
 		# if sorting is unimportant, use fast. If sorting is important, and python >= 3.6, use fast.
 		# fast is approximately half the time for serializing
-		self.json_serializer = "normal" # "normal" or "fast"
+		self.json_serializer = "normal" # "normal", "fast" or "compiled"
 		self.json_indent = 2
+		self.json_backend = "json" # "json", "orjson" or "auto" to use orjson if installed
+		self.rdf_serializer = "pyld" # "pyld" or "native"
+		self.cache_json = False # Reuse the JSON of resources that haven't changed
+		self._json_cache_epoch = 0
+		# the cache key of the toJSON in progress, which is per thread
+		self._serializing = _Serializing()
 		self.order_json = True
 		self.key_order_hash = {"@context": 0, "id": 1, "type": 2, 
 			"_label": 5, "value": 6}
@@ -165,6 +951,23 @@ class CromulentFactory(object):
 		self._auto_id_segments = {}
 		self._auto_id_int = -1
 		self._all_classes = {}
+		# per-class plans for the compiled serializer, built on first use
+		self._emit_plans = {}
+		# and predicate IRIs for the native RDF serializer
+		self._rdf_plans = {}
+		# and property tables for the Reader's trusted mode
+		self._read_plans = {}
+		# the settings the plans were built with, see _check_plans
+		self._plans_for = None
+		self.atomic_writes = False # toFile writes a temporary file and renames it
+		self.skip_unchanged = False # toFile doesn't rewrite files that would be the same
+		self.write_manifest = None # a WriteManifest of the hashes of the files written
+		# totals of files written and skipped by toFile in this process
+		self.write_counts = {"written": 0, "skipped": 0}
+		# output directories known to exist, so they aren't made again
+		self._known_dirs = set()
+		# open directory handles while in bulk_output()
+		self._dir_handles = None
 
 	def load_context(self, context, context_filemap):
 		if not context or not context_filemap:
@@ -216,6 +1019,13 @@ class CromulentFactory(object):
 	def __getstate__(self):
 		# Make a copy of current object state
 		d = self.__dict__.copy()
+		d['_emit_plans'] = {}
+		d['_rdf_plans'] = {}
+		d['_read_plans'] = {}
+		d['_plans_for'] = None
+		d['_known_dirs'] = set()
+		d['_dir_handles'] = None
+		del d['_serializing']
 		# try to flush the stream
 		try:
 			self.log_stream.flush()
@@ -237,6 +1047,7 @@ class CromulentFactory(object):
 	def __setstate__(self, state):
 		# State is __dict__ with a reified log_stream as above
 		self.__dict__.update(state)
+		self._serializing = _Serializing()
 		if self.log_stream:
 			if self.log_stream[1] == "stream":
 				if self.log_stream[0] == "sys.stdout":
@@ -319,100 +1130,338 @@ class CromulentFactory(object):
 		return self.base_url + seg + str(slug)	
 
 	def find_serializable(self, what):
+		"""Return the resources reachable from what that cross a linked art
+		boundary, and so should be serialized as their own documents"""
+		return list(self.iter_serializable(what))
+
+	def iter_serializable(self, what):
+		"""Yield the same resources as find_serializable, as they are found.
 
+		Each resource is walked only once, and is only yielded once (by
+		identity) however many times it is referenced, so the cost is linear
+		in the size of the graph, and cycles are fine
+		"""
 		if not self.linked_art_boundaries:
 			raise ConfigurationError("Factory doesn't have any boundaries to distinguish between entities")
+		return self._walk_serializable(what, set())
 
-		found = []
-		props = what.list_my_props()
-		for p in props:
-			if p in ['id', 'type', '_label', 'content', 'value', 'begin_of_the_begin', 'end_of_the_end']:
-				continue
-			val = getattr(what, p)
-			if isinstance(val, ExternalResource):
-				val = [val]
-			if type(val) is list:
-				for v in val:
-					if isinstance(v, ExternalResource):
-						if not v in found and v.id and not v._linked_art_boundary_okay(what, p, v) and set(v.list_my_props()).difference(set(["_label", "id"])):
-							found.append(v)
-						downstream = self.find_serializable(v)
-						for d in downstream:
-							if not d in found:
-								found.append(d)
-		return found
+	def split_records(self, what):
+		"""Split a graph into linked art documents.
+
+		Yields (resource, JSON) for what and then for each resource from
+		iter_serializable(what), with each serialized once with toJSON
+		"""
+		if not self.linked_art_boundaries:
+			raise ConfigurationError("Factory doesn't have any boundaries to distinguish between entities")
+		yield (what, self.toJSON(what))
+		for v in self._walk_serializable(what, set([id(what)])):
+			yield (v, self.toJSON(v))
+
+	def _walk_serializable(self, what, found):
+		skip = set(['id', 'type', '_label', 'content', 'value', 'begin_of_the_begin', 'end_of_the_end'])
+		uprops = self.underscore_properties
+
+		def edges(node):
+			for (p, val) in node._get_props().items():
+				if p in skip or (p[0] == "_" and not p in uprops):
+					continue
+				if isinstance(val, BaseResource):
+					yield (p, val)
+				elif type(val) is list:
+					for v in val:
+						if isinstance(v, BaseResource):
+							yield (p, v)
+
+		def has_data(v):
+			for k in v._get_props():
+				if not k in ['_label', 'id'] and (k[0] != "_" or k in uprops):
+					return True
+			return False
+
+		# Depth first, with an explicit stack rather than recursion, so
+		# resources are found in the same order as before
+		walked = set([id(what)])
+		stack = [(what, edges(what))]
+		while stack:
+			(node, todo) = stack[-1]
+			for (p, v) in todo:
+				if not id(v) in found and v.id and not v._linked_art_boundary_okay(node, p, v) \
+						and has_data(v):
+					found.add(id(v))
+					yield v
+				if not id(v) in walked:
+					walked.add(id(v))
+					stack.append((v, edges(v)))
+					break
+			else:
+				stack.pop()
 
 	def toJSON(self, what, done=None):
 		""" Serialize what, making sure of no infinite loops """
+		return self._toJSON_with(what, done, self.json_serializer, self.full_names)
+
+	def _toJSON_with(self, what, done, serializer, full_names):
+		# toJSON, with the serializer and full_names for this call only,
+		# without changing them on the factory for other threads
 		if not done:
 			done = {}
-		if self.json_serializer == "fast":
-			out = what._toJSON_fast(top=what, done=done)
-		else:
-			out = what._toJSON(top=what, done=done)
+		state = self._serializing
+		outer = (state.json_cache_key, state.full_names)
+		state.json_cache_key = None
+		state.full_names = full_names
+		if self.cache_json:
+			# Everything that can change the JSON of a resource below the top
+			state.json_cache_key = (self._json_cache_epoch, serializer, full_names,
+				self.id_type_label, self.elasticsearch_compatible, self.order_json,
+				self.pipe_scoped_contexts, self.allow_highlight, self.allow_elide,
+				self.multiple_instances_per_property, tuple(self.underscore_properties),
+				self.linked_art_boundaries and what.__class__)
+		try:
+			if serializer in ["fast", "compiled"]:
+				# compiled only writes text, so use fast for the dicts
+				out = what._toJSON_fast(top=what, done=done)
+			else:
+				out = what._toJSON(top=what, done=done)
+		finally:
+			(state.json_cache_key, state.full_names) = outer
 		return out
 
-	def _collapse_json(self, text, collapse):
+	def clear_json_cache(self):
+		"""Stop reusing any JSON cached on resources with cache_json.
+
+		Needed if resources were changed while cache_json was off, or if any
+		of the ordering settings, such as key_order_hash, are changed
+		"""
+		self._json_cache_epoch += 1
+
+	def _collapsed_string(self, js, collapse):
+		"""Indented JSON, with any object or array that fits in collapse
+		characters (after one indent) written on a single line."""
+		one_line = (',', ': ')
+		widths = {}
+
+		def width(v):
+			# The length of v on one line, kept for each container
+			if isinstance(v, dict):
+				w = 1 + len(v)
+				for (k, val) in v.items():
+					w += len(encode_basestring(k)) + 2 + width(val)
+			elif type(v) is list:
+				w = 1 + len(v)
+				for val in v:
+					w += width(val)
+			else:
+				return len(json.dumps(v, ensure_ascii=False))
+			if not v:
+				w = 2
+			widths[id(v)] = w
+			return w
+		width(js)
+
 		js_indent = self.json_indent
-		lines = text.splitlines()
-		out = [lines[0]]
-		while lines:
-			l = lines.pop(0)
-			indent = len(re.split('\S', l, 1)[0])
-			if indent and l.rstrip()[-1] in ['[', '{']:
-				curr = indent
-				temp = []
-				stemp = []
-				while lines and curr <= indent:
-					if temp and curr == indent:
-						break
-					temp.append(l[curr:])
-					stemp.append(l.strip())
-					l = lines.pop(0)
-					indent = len(re.split('\S', l, 1)[0])					
-				temp.append(l[curr:])
-				stemp.append(l.lstrip())
-
-				short = " " * curr + ''.join(stemp)
-				if len(short) < collapse:
-					out.append(short)
-				else:
-					ntext = '\n'.join(temp)
-					nout = self._collapse_json(ntext, collapse)					
-					for no in nout:
-						out.append(" " * curr + no)
-			elif indent:
-				out.append(l)
-		out.append(l)
-		return out
+		out = []
+		def emit(v, level, pfx, comma):
+			ind = " " * (js_indent * level)
+			if isinstance(v, dict):
+				items = [(encode_basestring(k) + ": ", val) for (k, val) in v.items()]
+				opn, cls = "{", "}"
+			elif type(v) is list:
+				items = [("", val) for val in v]
+				opn, cls = "[", "]"
+			else:
+				out.append(ind + pfx + json.dumps(v, ensure_ascii=False) + comma)
+				return
+			if not v or (level and js_indent + len(pfx) + widths[id(v)] + len(comma) < collapse):
+				out.append(ind + pfx + json.dumps(v, separators=one_line, ensure_ascii=False) + comma)
+			else:
+				out.append(ind + pfx + opn)
+				last = len(items) - 1
+				for (n, (kpfx, val)) in enumerate(items):
+					emit(val, level+1, kpfx, "" if n == last else ",")
+				out.append(ind + cls + comma)
+		emit(js, 0, "", "")
+		return '\n'.join(out)
 
 	def collapse_json(self, text, collapse):
-		return '\n'.join(self._collapse_json(text, collapse))
+		"""Collapse indented JSON text, as toString(compact=False, collapse=n)"""
+		js = json.loads(text, object_pairs_hook=OrderedDict)
+		return self._collapsed_string(js, collapse)
+
+	def _get_json_backend(self):
+		if self.json_backend == "json":
+			return None
+		oj = get_orjson()
+		if oj is None and self.json_backend == "orjson":
+			raise ConfigurationError("json_backend is 'orjson' but orjson is not installed")
+		return oj
+
+	def json_dumps(self, js, compact=True):
+		"""Encode JSON with the configured backend, as json.dumps would."""
+		oj = self._get_json_backend()
+		# orjson can only indent by 2
+		if oj is not None and (compact or self.json_indent == 2):
+			# json refuses datetimes and dataclasses, so orjson should too
+			opts = oj.OPT_PASSTHROUGH_DATETIME | oj.OPT_PASSTHROUGH_DATACLASS
+			if not compact:
+				opts |= oj.OPT_INDENT_2
+			try:
+				out = oj.dumps(js, option=opts)
+				if not re_orjson_diff.search(out) or not _orjson_floats(js):
+					return out.decode('utf-8')
+			except TypeError:
+				# Things orjson won't do, like int keys or huge ints
+				pass
+		if compact:
+			return json.dumps(js, separators=(',',':'), ensure_ascii=False)
+		else:
+			return json.dumps(js, indent=self.json_indent, ensure_ascii=False)
+
+	def json_loads(self, data):
+		"""Decode JSON with the configured backend, as json.loads would."""
+		oj = self._get_json_backend()
+		if oj is not None:
+			long_int = re_long_int if isinstance(data, str) else re_long_int_b
+			if not long_int.search(data):
+				try:
+					return oj.loads(data)
+				except ValueError:
+					# json also reads NaN, Infinity, lone surrogates and so on
+					pass
+		if isinstance(data, memoryview):
+			# eg a record in a mapped Bundle, which orjson reads without a copy
+			data = data.tobytes()
+		return json.loads(data)
 
 	def _buildString(self, js, compact=True, collapse=0):
 		"""Build string from JSON."""
 		try:
-			if compact:
-				out = json.dumps(js, separators=(',',':'), ensure_ascii=False)
+			if collapse and not compact:
+				out = self._collapsed_string(js, collapse)
 			else:
-				out = json.dumps(js, indent=self.json_indent, ensure_ascii=False)
+				out = self.json_dumps(js, compact)
 		except:
 			out = ""
 			self.maybe_warn("Can't decode %r" % js)
 			raise
-		if collapse:
-			out = self.collapse_json(out, collapse)
 		return out 		
 
 	def toString(self, what, compact=True, collapse=0, done=None):
 		"""Return JSON setialization as string."""
 		if not done:
 			done = {}
+		if self.json_serializer == "compiled" and not collapse:
+			return self._compiledString(what, compact, done)
 		js = self.toJSON(what, done=done)
 		return self._buildString(js, compact, collapse)
 
+	def _compiledString(self, what, compact=True, done=None):
+		"""Build string directly from the resource with the compiled serializer."""
+		writer = _CompiledWriter(self, compact, done)
+		writer.resource(what, what)
+		return ''.join(writer.out)
+
+	def reset_compiled_plans(self):
+		"""Discard the compiled serializer's per-class plans, and those of
+		trusted Readers.
+
+		Needed after changing a class's _property_name_map, if the compiled
+		serializer has already been used. Changes to key_order_hash,
+		key_order_default and underscore_properties are noticed without it
+		"""
+		self._emit_plans = {}
+		self._rdf_plans = {}
+		self._read_plans = {}
+		self._plans_for = (dict(self.key_order_hash), self.key_order_default,
+			list(self.underscore_properties))
+
+	def _check_plans(self):
+		# The plans include the key order and underscore_properties, which
+		# can be changed in place, so compare them with copies
+		if self._plans_for != (self.key_order_hash, self.key_order_default, self.underscore_properties):
+			self.reset_compiled_plans()
+
+	def toStream(self, what, stream, compact=True, done=None, flush_every=4096):
+		"""Write the JSON serialization to a writable text stream.
+
+		Produces the same output as toString(), but each resource is only
+		serialized when it is reached, so the whole tree is never in memory.
+		Output is written to the stream after every flush_every pieces.
+		"""
+		if not done:
+			done = {}
+		fast = self.json_serializer in ["fast", "compiled"]
+		if compact:
+			key_sep = ":"
+			indent = ""
+			newlines = [""]
+		else:
+			key_sep = ": "
+			indent = " " * self.json_indent
+			newlines = ["\n"]
+
+		buf = []
+		write = buf.append
+		# encoded keys, by (key, level, first)
+		keys = {}
+
+		def newline(level):
+			while len(newlines) <= level:
+				newlines.append(newlines[-1] + indent)
+			return newlines[level]
+
+		def emit(v, level):
+			if type(v) is _StreamRef:
+				if not v.resolved:
+					v.resolve(done, what, fast, True)
+				# Let go of the child once written
+				val = v.value
+				v.value = None
+				emit(val, level)
+			elif isinstance(v, dict):
+				if not v:
+					write("{}")
+					return
+				first = True
+				for (k, val) in v.items():
+					try:
+						write(keys[(k, level, first)])
+					except KeyError:
+						pfx = "{" if first else ","
+						keys[(k, level, first)] = pfx + newline(level+1) + encode_basestring(k) + key_sep
+						write(keys[(k, level, first)])
+					first = False
+					emit(val, level+1)
+				write(newline(level) + "}")
+				if len(buf) >= flush_every:
+					stream.write(''.join(buf))
+					del buf[:]
+			elif type(v) is list:
+				if not v:
+					write("[]")
+					return
+				sep = "[" + newline(level+1)
+				item_sep = "," + newline(level+1)
+				for val in v:
+					write(sep)
+					sep = item_sep
+					emit(val, level+1)
+				write(newline(level) + "]")
+			elif type(v) is str:
+				write(encode_basestring(v))
+			else:
+				write(json.dumps(v, ensure_ascii=False))
+
+		if fast:
+			js = what._toJSON_fast(top=what, done=done, defer=True)
+		else:
+			js = what._toJSON(top=what, done=done, defer=True)
+		emit(js, 0)
+		if buf:
+			stream.write(''.join(buf))
+
 
 	def toHtml(self, what, done=None):
+		# Always stdlib, as the markup is added per token from iterencode
 		enc = JSONEncoder(indent=self.json_indent, ensure_ascii=False)
 		js = self.toJSON(what, done=done)
 		res = ['<pre><span>']
@@ -467,22 +1516,23 @@ class CromulentFactory(object):
 		# Format can be:  xml, pretty-xml, turtle, n3, nt, trix, trig, nquads
 		# ttl = turtle; nq, n-quads == nquads
 
+		if self.rdf_serializer == "native":
+			if format in ['nt', 'ntriples', 'n-triples', 'application/ntriples']:
+				return self._nativeRDF(what, bnode_prefix=bnode_prefix, graph=False)
+			elif format in ['nq', 'nquads', 'n-quads', 'application/nquads']:
+				return self._nativeRDF(what, bnode_prefix=bnode_prefix)
+			# Build the graph for rdflib directly, rather than parsing quads
+			return self._graphSerialize(self.toGraph(what, bnode_prefix=bnode_prefix), format)
+
 		# Need to ensure we generate the full form of predicates
 		# otherwise context processing takes AGES
-		# So set serializer to normal, and full_names to True
-		srlz = self.json_serializer
-		fn = self.full_names
-		self.json_serializer = "normal"
-		self.full_names = True
-		js  = self.toJSON(what)
-		# And put them back
-		self.json_serializer = srlz
-		self.full_names = fn
+		# So use the normal serializer, and full_names, for this call only
+		js = self._toJSON_with(what, None, "normal", True)
 
 		# Substitute in a minimal context that defines only prefixes
 		js['@context'] = min_context
 		src = {'@id': js['@id'], '@graph':js}
-		data = pyld_proc.to_rdf(src, options={"format": "application/nquads"})
+		data = get_pyld_processor().to_rdf(src, options={"format": "application/nquads"})
 
 		# Here replace all the bnodes with a unique id
 		# This works so long as PyLD continues with incrementing integer bnode ids
@@ -496,26 +1546,123 @@ class CromulentFactory(object):
 			data = re_quad.subn(" .", data)[0]
 			return data
 		else:
-			# Need to pass over to rdflib
-			g = ConjunctiveGraph()
-			for (k,v) in min_context.items():
-				if v[0] != "@":
-					g.bind(k, v)
-			g.parse(data=data, format="nquads")
-			out = g.serialize(format=format)
-			if type(out) == bytes:
-				return out.decode('utf-8')
+			return self._rdflibSerialize(data, format)
+
+	def _nativeRDF(self, what, bnode_prefix="", graph=True):
+		"""N-Quads (or N-Triples with graph=False) straight from the resources.
+
+		Gives the same graph as going through JSON-LD and PyLD, with the
+		lines sorted and de-duplicated in the same way
+		"""
+		writer = _RDFWriter(self, bnode_prefix)
+		lines = writer.quads(what, graph=graph)
+		return ''.join(sorted(set(lines)))
+
+	def toRDFStream(self, resources, stream, format="nq", graph="id", bnode_prefix=""):
+		"""Write N-Quads or N-Triples for many resources to a writable text stream.
+
+		graph is "id" to put each resource in the named graph of its id,
+		"default" for the default graph, or a function which is given the
+		resource and returns the URI of its graph, or None for the default.
+		Blank nodes are numbered across all of the resources, so can't
+		collide. Returns the number of resources written
+		"""
+		if format in ['nt', 'ntriples', 'n-triples', 'application/ntriples']:
+			graph = "default"
+		elif not format in ['nq', 'nquads', 'n-quads', 'application/nquads']:
+			raise ConfigurationError("Only N-Quads and N-Triples can be streamed, not '%s'" % format)
+		elif not (graph in ["id", "default"] or callable(graph)):
+			raise ConfigurationError("Unknown named graph policy: %r" % graph)
+
+		writer = _RDFWriter(self, bnode_prefix)
+		count = 0
+		for what in resources:
+			writer.reset()
+			if graph == "default":
+				writer.graph = ""
+			elif graph == "id":
+				writer.graph = " " + writer.node(what) if what.id else ""
 			else:
-				return out
+				uri = graph(what)
+				writer.graph = " " + writer.iri(uri) if uri else ""
+			writer.resource(what, what)
+			# Sorted and de-duplicated per record, as for toRDF
+			stream.write(''.join(sorted(set(writer.out))))
+			count += 1
+		return count
+
+	def toRDFFile(self, resources, filename, format="nq", graph="id", bnode_prefix="", compress=None):
+		"""Write N-Quads or N-Triples for many resources to one file.
+
+		compress can be "gzip", and defaults to it if filename ends in .gz.
+		See toRDFStream for the other parameters
+		"""
+		if compress is None and filename.endswith(".gz"):
+			compress = "gzip"
+		if compress == "gzip":
+			import gzip
+			fh = gzip.open(filename, 'wt', encoding='utf-8')
+		elif not compress:
+			fh = open(filename, 'w', encoding='utf-8')
+		else:
+			raise ConfigurationError("Unknown compression: %r" % compress)
+		try:
+			return self.toRDFStream(resources, fh, format=format, graph=graph, bnode_prefix=bnode_prefix)
+		finally:
+			fh.close()
+
+	def toGraph(self, what, graph=None, bnode_prefix=""):
+		"""Add the RDF for a resource to an rdflib graph, and return the graph.
+
+		Without a graph, a new ConjunctiveGraph is made with the prefixes
+		from min_context bound. Passing the same graph (which can use any
+		rdflib store) for each record collects them together. Blank nodes
+		are rdflib's own, unless bnode_prefix is given
+		"""
+		if graph is None:
+			graph = self._rdflibGraph()
+		writer = _GraphWriter(self, graph, bnode_prefix)
+		writer.add(what)
+		return graph
+
+	def _rdflibGraph(self):
+		from rdflib import ConjunctiveGraph
+		g = ConjunctiveGraph()
+		for (k,v) in min_context.items():
+			if v[0] != "@":
+				g.bind(k, v)
+		return g
+
+	def _rdflibSerialize(self, data, format):
+		# Need to pass over to rdflib
+		g = self._rdflibGraph()
+		g.parse(data=data, format="nquads")
+		return self._graphSerialize(g, format)
+
+	def _graphSerialize(self, g, format):
+		out = g.serialize(format=format)
+		if type(out) == bytes:
+			return out.decode('utf-8')
+		else:
+			return out
 
 	def get_filename(self, whatid, extension=""):
 
-		mdb = self.base_url
-		if not whatid.startswith(mdb):
-			raise ConfigurationError("The id of that object is not the base URI (factory.base_url) in the Factory")
+		dirs = self.get_file_path(whatid, extension)
 		mdd = self.base_dir
 		if not mdd:
 			raise ConfigurationError("Directory (factory.base_dir) on Factory must be set to generate a file name")
+		if len(dirs) > 1:
+			self._make_dir(os.path.join(mdd, *dirs[:-1]))
+		filename = os.path.join(mdd, *dirs)		
+		return filename
+
+	def get_file_path(self, whatid, extension=""):
+		"""The directories and file name, under base_dir, for whatid"""
+
+		mdb = self.base_url
+		if not whatid.startswith(mdb):
+			raise ConfigurationError("The id of that object is not the base URI (factory.base_url) in the Factory")
 		fp = whatid[len(mdb):]	
 
 		# This will always be /, as it's from the URI
@@ -528,36 +1675,32 @@ class CromulentFactory(object):
 				if len(fn) > 2*d+1:
 					dirs.append(fn[2*d:2*d+2])
 
-		if len(dirs):
-			mydir = os.path.join(mdd, *dirs)		
-			try:
-				os.makedirs(mydir)
-			except OSError:
-				pass
-
 		# Allow passing in an override
 		if extension:
 			fn = fn + extension
 		elif self.filename_extension:
 			fn = fn + self.filename_extension
 		dirs.append(fn)
-		filename = os.path.join(mdd, *dirs)		
-		return filename
+		return dirs
 
 	def toFile(self, what, compact=True, filename="", done=None, format=None, bnode_prefix="", extension=""):
 		"""Write to local file.
 
 		Creates directories as necessary based on URI, if filename is not supplied
 		"""
+		(filename, out) = self._file_output(what, compact, filename, done, format, bnode_prefix, extension)
+		self._save(filename, out)
+		return out
 
+	def _file_output(self, what, compact=True, filename="", done=None, format=None, bnode_prefix="", extension=""):
+		# The filename and serialization for toFile
 		if not done:
 			done = {}
 
 		if not format:
 			if not filename:
 				filename = self.get_filename(what.id, extension=extension)
-			js = self.toJSON(what, done=done)
-			out = self._buildString(js, compact)
+			out = self.toString(what, compact, done=done)
 		else:
 			if not filename:
 				if extension:
@@ -568,19 +1711,263 @@ class CromulentFactory(object):
 					ext = format
 				filename = self.get_filename(what.id, extension=ext)
 			out = self.toRDF(what, format=format, bnode_prefix=bnode_prefix)
+		return (filename, out)
+
+	def _save(self, filename, out):
+		# Write out to filename, unless skip_unchanged and it would be the same.
+		# Returns True if it was written
+		manifest = self.write_manifest
+		if manifest is None and not self.skip_unchanged:
+			self._write_file(filename, out)
+			self._count("written")
+			return True
+
+		data = out if isinstance(out, bytes) else out.encode('utf-8')
+		digest = None
+		if manifest is not None:
+			digest = hashlib.sha1(data).hexdigest()
+		if self.skip_unchanged and self._unchanged(filename, data, digest):
+			if digest is not None and not filename in manifest:
+				manifest.set(filename, digest)
+			self._count("skipped")
+			return False
+		self._write_file(filename, out)
+		if digest is not None:
+			manifest.set(filename, digest)
+		self._count("written")
+		return True
+
+	def _unchanged(self, filename, data, digest):
+		# Compare with the manifest if the file is in it, else with the file
+		if digest is not None:
+			known = self.write_manifest.get(filename)
+			if known is not None:
+				return known == digest and os.path.exists(filename)
+		try:
+			if os.path.getsize(filename) != len(data):
+				return False
+			with open(filename, 'rb') as fh:
+				return fh.read() == data
+		except (IOError, OSError):
+			return False
+
+	def _count(self, which):
+		with _write_counts_lock:
+			self.write_counts[which] += 1
+
+	def reset_write_counts(self):
+		self.write_counts = {"written": 0, "skipped": 0}
+
+	def _make_dir(self, mydir):
+		if mydir in self._known_dirs:
+			return
+		try:
+			os.makedirs(mydir)
+		except OSError:
+			pass
+		self._known_dirs.add(mydir)
+
+	def clear_dir_cache(self):
+		"""Forget which output directories exist, eg if they were removed"""
+		self._known_dirs = set()
+
+	@contextmanager
+	def bulk_output(self, max_handles=256):
+		"""Keep up to max_handles output directories open (per thread) while
+		writing many files, and open the files relative to them."""
+		if self._dir_handles is not None or not DIR_FD_WRITES:
+			yield self
+			return
+		self._dir_handles = _DirHandles(max_handles)
+		try:
+			yield self
+		finally:
+			(handles, self._dir_handles) = (self._dir_handles, None)
+			handles.close()
 
-		fh = open(filename, 'w')
+	def _write_file(self, filename, out):
 		try:
-			fh.write(out)
+			self._write_out(filename, out)
+		except (IOError, OSError) as e:
+			mydir = os.path.dirname(filename)
+			if e.errno != errno.ENOENT or not mydir in self._known_dirs:
+				raise
+			# A directory we made has since been removed
+			self._known_dirs.discard(mydir)
+			if self._dir_handles is not None:
+				self._dir_handles.forget(mydir)
+			self._make_dir(mydir)
+			self._write_out(filename, out)
+
+	def _write_out(self, filename, out):
+		handles = self._dir_handles
+		if handles is None and not self.atomic_writes:
+			fh = open(filename, 'w')
+			try:
+				fh.write(out)
+			except:
+				# Could be 2.x unicode issue
+				fh.write(out.encode('utf-8'))
+			fh.close()
+			return
+
+		if not isinstance(out, bytes):
+			out = out.encode('utf-8')
+		kw = {}
+		(mydir, name) = os.path.split(filename)
+		if handles is not None:
+			kw['dir_fd'] = handles.get(mydir or os.curdir)
+		else:
+			name = filename
+		flags = os.O_WRONLY | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+		if not self.atomic_writes:
+			with os.fdopen(os.open(name, flags | os.O_TRUNC, 0o666, **kw), 'wb') as fh:
+				fh.write(out)
+			return
+
+		# Write to a temporary file in the same directory and rename it over
+		# the target, so readers see either the old file or the new one
+		(tdir, tname) = os.path.split(name)
+		tmp = os.path.join(tdir, ".%s.%s-%s.tmp" % (tname, os.getpid(), next(_tmp_counter)))
+		rkw = {}
+		if kw:
+			rkw = {'src_dir_fd': kw['dir_fd'], 'dst_dir_fd': kw['dir_fd']}
+		fd = os.open(tmp, flags | os.O_EXCL, 0o666, **kw)
+		try:
+			with os.fdopen(fd, 'wb') as fh:
+				fh.write(out)
+			getattr(os, 'replace', os.rename)(tmp, name, **rkw)
 		except:
-			# Could be 2.x unicode issue
-			fh.write(out.encode('utf-8'))
-		fh.close()
-		return out
+			os.unlink(tmp, **kw)
+			raise
+
+	def write_many(self, resources, workers=None, batch_size=50, max_pending=None, setup=None, **kw):
+		"""Write many resources to files with toFile, using a pool of processes.
+
+		resources can be any iterable, and is only read as fast as the
+		workers keep up: at most max_pending batches of batch_size are
+		waiting at once (default twice the number of workers). Each worker
+		gets a copy of this factory's settings, and setup is called first
+		if given, eg to add the linked art boundary check in processes that
+		aren't forked. Other keyword arguments are passed to toFile.
+		With no workers, writes in this process. Returns a WriteResult of
+		the number written, (id, message) for each that failed and the
+		number skipped as unchanged. The hashes of the files written by the
+		workers are added to this factory's write_manifest
+		"""
+		if not workers or workers < 2:
+			return WriteResult(*self._write_batch(resources, kw)[:3])
+
+		from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+		if max_pending is None:
+			max_pending = workers * 2
+		totals = {"written": 0, "skipped": 0}
+		errors = []
+		pending = {}
+
+		def collect(futures):
+			for f in futures:
+				ids = pending.pop(f)
+				try:
+					(n, errs, skipped, hashes) = f.result()
+				except Exception as e:
+					# Couldn't be sent or the worker died
+					errs = [(i, "%s: %s" % (e.__class__.__name__, e)) for i in ids]
+					(n, skipped, hashes) = (0, 0, [])
+				totals["written"] += n
+				totals["skipped"] += skipped
+				errors.extend(errs)
+				for (fn, digest) in hashes:
+					self.write_manifest.set(fn, digest)
+
+		with ProcessPoolExecutor(workers, initializer=_worker_init,
+				initargs=(pickle.dumps(self), setup)) as pool:
+			for batch in _batches(resources, batch_size):
+				if len(pending) >= max_pending:
+					(finished, _) = wait(pending, return_when=FIRST_COMPLETED)
+					collect(finished)
+				pending[pool.submit(_write_many_batch, batch, kw)] = [w.id for w in batch]
+			collect(list(pending))
+		return WriteResult(totals["written"], errors, totals["skipped"])
+
+	def _write_batch(self, batch, kw):
+		"""toFile each resource in batch, returning (written, errors, skipped,
+		[(filename, hash)] of the files written if there's a manifest)"""
+		written = 0
+		skipped = 0
+		errors = []
+		hashes = []
+		manifest = self.write_manifest
+		for what in batch:
+			try:
+				(filename, out) = self._file_output(what, **kw)
+				if self._save(filename, out):
+					written += 1
+				else:
+					skipped += 1
+				if manifest is not None:
+					hashes.append((filename, manifest.get(filename)))
+			except Exception as e:
+				errors.append((what.id, "%s: %s" % (e.__class__.__name__, e)))
+		return (written, errors, skipped, hashes)
+
+	def toStringAsync(self, what, compact=True, collapse=0, done=None, executor=None):
+		"""Coroutine for toString, run in executor (default: the loop's)"""
+		from cromulent import aio
+		return aio.toString(self, what, compact=compact, collapse=collapse, done=done, executor=executor)
+
+	def toSink(self, resources, filename, format=None, index=None, compact=True, block_size=None):
+		"""Write resources into one JSON Lines, tar or zip file, instead of
+		a file per resource. The format is from the extension of filename if
+		not given: jsonl, jsonl.gz, jsonl.xz, tar or zip. index is the name
+		of an index file to write too, or True for filename + ".idx", to be
+		read with cromulent.sinks.SinkIndex. Returns the number written
+		"""
+		from cromulent import sinks
+		return sinks.write(self, resources, filename, format=format, index=index,
+			compact=compact, block_size=block_size or sinks.BLOCK_SIZE)
+
+	def toBundle(self, resources, filename):
+		"""Append resources to the bundle filename (and its index, filename
+		+ ".idx"), creating it if needed. Records are read back by id with
+		cromulent.sinks.Bundle, and a record appended again with the same id
+		replaces the earlier one. Returns the number written
+		"""
+		from cromulent import sinks
+		return sinks.write(self, resources, filename, format="jsonl", index=True, append=True)
+
+	def toBulk(self, resources, index="", action="index", max_count=500, max_bytes=5242880):
+		"""Yield Elasticsearch or OpenSearch _bulk request bodies for resources,
+		as UTF-8 NDJSON of an action line and the JSON of each, with at most
+		max_count records or max_bytes bytes (unless one record is bigger).
+		action is "index" or "create", and index the _index if not in the URL
+		"""
+		from cromulent import sinks
+		return sinks.bulk_chunks(self, resources, index=index, action=action,
+			max_count=max_count, max_bytes=max_bytes)
+
+	def toBulkFiles(self, resources, filename, index="", action="index", max_count=500, max_bytes=5242880):
+		"""Write the toBulk request bodies to files, named filename % the
+		chunk number, eg "bulk-%05d.ndjson". Returns the file names
+		"""
+		from cromulent import sinks
+		return sinks.bulk_files(self, resources, filename, index=index, action=action,
+			max_count=max_count, max_bytes=max_bytes)
+
+	def toFileAsync(self, what, executor=None, **kw):
+		"""Coroutine for toFile, serializing and writing in executor"""
+		from cromulent import aio
+		return aio.toFile(self, what, executor=executor, **kw)
+
+	def write_many_async(self, resources, concurrency=8, batch_size=10, executor=None, **kw):
+		"""Coroutine to write many resources with toFile, without blocking the
+		event loop. See cromulent.aio.write_many"""
+		from cromulent import aio
+		return aio.write_many(self, resources, concurrency=concurrency,
+			batch_size=batch_size, executor=executor, **kw)
 
 	def production_mode(self, state=True):
 		if state:
-			self.cache_hierarchy()
 			self.validate_profile = False
 			self.validate_properties = False
 			self.validate_range = False
@@ -591,13 +1978,12 @@ class CromulentFactory(object):
 			self.validate_properties = True
 			self.validate_range = True
 			self.validate_multiplicity = True
-			# no way to undo the hierarchy cache
 			return False
 			
 	def cache_hierarchy(self):
 		""" For each class, walk up the hierarchy and cache the terms """
-		# This will work with the existing code, as it will find it in the first
-		# test of props on classhier[0], the loop will just terminate straight away
+		# Lookups already use the flattened _property_table built with
+		# the classes, so this is no longer needed for speed
 
 		for c in self._all_classes.values():
 			new_hash = c._all_properties.copy()
@@ -607,6 +1993,7 @@ class CromulentFactory(object):
 						if not prop in new_hash:
 							new_hash[prop] = info
 			c._all_properties = new_hash
+		rebuild_property_tables()
 
 
 class ExternalResource(object):
@@ -614,18 +2001,113 @@ class ExternalResource(object):
 	
 	_factory = None
 	_uri_segment = ""
-	id = ""
-	_full_id = ""
 	_all_properties = {}
 	_type = ""
 	_embed = True
 	_property_name_map = {}
-	_highlight = False
-	_elide = False
 
+	if COMPACT_STORAGE:
+		# No per-instance __dict__, so anything an instance might set
+		# can't also be a class attribute, or it would shadow _values
+		__slots__ = COMPACT_SLOTS
+		_compact_defaults = {"_full_id": "", "_highlight": False, "_elide": False,
+			"_json_stamp": 0, "_json_cache": None}
+
+		def __getattr__(self, which):
+			# Only called when the slots and the class don't have it
+			if which != "_values":
+				vals = self._values
+				for i in range(0, len(vals), 2):
+					if vals[i] == which:
+						return vals[i+1]
+				if which in self._compact_defaults:
+					return self._compact_defaults[which]
+			raise AttributeError("'%s' object has no attribute '%s'" % (self.__class__.__name__, which))
+
+		def _store(self, which, value):
+			"""Set the value without any checking"""
+			try:
+				slots = _class_slots[self.__class__]
+			except KeyError:
+				slots = _compact_slots(self.__class__)
+			if which in slots:
+				object.__setattr__(self, which, value)
+			else:
+				vals = self._values
+				for i in range(0, len(vals), 2):
+					if vals[i] == which:
+						vals = vals[:i+1] + (value,) + vals[i+2:]
+						break
+				else:
+					vals = vals + (which, value)
+				object.__setattr__(self, '_values', vals)
+
+		def _get_props(self):
+			"""Return a new dict of the values set on the instance"""
+			d = {}
+			for s in _compact_slots(self.__class__):
+				try:
+					d[s] = object.__getattribute__(self, s)
+				except AttributeError:
+					pass
+			vals = self._values
+			for i in range(0, len(vals), 2):
+				d[vals[i]] = vals[i+1]
+			return d
+
+		def __getstate__(self):
+			# The slots as they are, as setting them again with setattr
+			# would check them. Cached JSON isn't worth sending
+			d = {}
+			for s in _compact_slots(self.__class__) + ('_values',):
+				try:
+					d[s] = object.__getattribute__(self, s)
+				except AttributeError:
+					pass
+			vals = d.get('_values', ())
+			for i in range(0, len(vals), 2):
+				if vals[i] == '_json_cache':
+					d['_values'] = vals[:i] + vals[i+2:]
+					break
+			return d
+
+		def __setstate__(self, state):
+			for (k, v) in state.items():
+				object.__setattr__(self, k, v)
+	else:
+		id = ""
+		_full_id = ""
+		_json_stamp = 0
+		_json_cache = None
+		_highlight = False
+		_elide = False
+		_store = object.__setattr__
+
+		def _get_props(self):
+			"""Return a new dict of the values set on the instance"""
+			d = self.__dict__.copy()
+			d.pop('_factory', None)
+			return d
+
+		def __getstate__(self):
+			# Resources are pickled without the factory, and use the one in
+			# the process that loads them, eg for write_many's workers.
+			# Cached JSON isn't worth sending
+			d = self.__dict__.copy()
+			d.pop('_factory', None)
+			d.pop('_json_cache', None)
+			return d
+
+		def __setstate__(self, state):
+			self.__dict__.update(state)
+			self.__dict__['_factory'] = factory
 
 	def __init__(self, ident=None):
-		self._factory = factory
+		if COMPACT_STORAGE:
+			# the factory is shared via the class attribute
+			object.__setattr__(self, '_values', ())
+		else:
+			self._store('_factory', factory)
 		if ident is not None:
 			if self._factory._is_uri(ident):
 				self.id = ident
@@ -667,7 +2149,7 @@ class ExternalResource(object):
 			# Not auto assigning, and not submitted = blank node
 			self.id = ""
 
-	def _toJSON(self, done, top=None):
+	def _toJSON(self, done, top=None, defer=False):
 		if self._factory.elasticsearch_compatible:
 			return {'id': self.id}
 		else:
@@ -676,12 +2158,16 @@ class ExternalResource(object):
 class BaseResource(ExternalResource):
 	"""Base class for all resources with classes"""
 
+	__slots__ = ()
+
 	_integer_properties = []
 	_object_properties = []
 	_required_properties = []
 	_warn_properties = []
 	_classification = ""
 	_classhier = []
+	_property_table = {}
+	_predicate_table = {}
 
 	def __init__(self, ident=None, label="", value="", content="", **kw):
 		"""Initialize BaseObject."""
@@ -758,9 +2244,13 @@ class BaseResource(ExternalResource):
 	def __setattr__(self, which, value):
 		"""Attribute setting magic for error checking and resource/literal handling."""
 
+		if self._factory.cache_json:
+			# Any cached JSON that includes this resource is now out of date
+			self._store('_json_stamp', next(_json_stamps))
+
 		if which[0] == "_" or not value:
 			# _label goes through here, but it would below anyway, as it takes a Literal
-			object.__setattr__(self, which, value)			
+			self._store(which, value)			
 		else:
 			# Allow per-class setters
 			if hasattr(self, 'set_%s' % which):
@@ -777,38 +2267,36 @@ class BaseResource(ExternalResource):
 			if ok == 2:
 				self._set_magic_resource(which, value)
 			else:			
-				object.__setattr__(self, which, value)				
+				self._store(which, value)				
 		 
 	def _check_prop(self, which, value):
 		val_props = self._factory.validate_properties
 		val_profile = self._factory.validate_profile and getattr(self, '_validate_profile', True)
 		val_range = self._factory.validate_range
-		for c in self._classhier:
-			if which in c._all_properties:
-				pinfo = c._all_properties[which]
-
-				if val_profile:
-					okay = pinfo.profile_okay					
-					rdf = pinfo.predicate
-					if not okay:
-						raise ProfileError("Property '%s' / '%s' is configured to not be used" % (which, rdf), self)
-					elif okay == 2:
-						self._factory.maybe_warn("Property '%s' / '%s' is configured to warn on use" % (which, rdf))
-
-				if val_range:
-					rng = pinfo.range
-					if rng is str:					
-						return 1
-					elif type(value) is BaseResource:
-						# Allow direct instances of base resource anywhere
-						# this is an override for external URIs
-						return 2
-					elif isinstance(value, rng):
-						return 2
-					else:
-						raise DataError("Can't set '%s' on resource of type '%s' to '%r'" % (which, self._type, value), self)
-				# Found it, but not validating range and either okay or not validating profile
-				return 1
+		pinfo = self._property_table.get(which, None)
+		if pinfo is not None:
+			if val_profile:
+				okay = pinfo.profile_okay					
+				rdf = pinfo.predicate
+				if not okay:
+					raise ProfileError("Property '%s' / '%s' is configured to not be used" % (which, rdf), self)
+				elif okay == 2:
+					self._factory.maybe_warn("Property '%s' / '%s' is configured to warn on use" % (which, rdf))
+
+			if val_range:
+				rng = pinfo.range
+				if rng is str:					
+					return 1
+				elif type(value) is BaseResource:
+					# Allow direct instances of base resource anywhere
+					# this is an override for external URIs
+					return 2
+				elif isinstance(value, rng):
+					return 2
+				else:
+					raise DataError("Can't set '%s' on resource of type '%s' to '%r'" % (which, self._type, value), self)
+			# Found it, but not validating range and either okay or not validating profile
+			return 1
 		if val_props:
 			raise DataError("Can't set unknown field '%s' on resource of type '%s'" % (which, self._type), self)
 		else:
@@ -842,24 +2330,26 @@ class BaseResource(ExternalResource):
 		allow: string/object/dict, and magically generate list thereof
 		"""
 
+		if self._factory.cache_json:
+			# Needed here too for inverses, and appending to lists
+			self._store('_json_stamp', next(_json_stamps))
+
 		if self._factory.materialize_inverses or self._factory.process_multiplicity or \
 			self._factory.validate_multiplicity:
 			inverse = None
 			multiple = 1
-			for c in self._classhier:
-				if which in c._all_properties:
-					v = c._all_properties[which]
-					multiple = v.multiple_okay
-					if v.inverse_property:
-						inverse = v.inverse_property
-					break
+			v = self._property_table.get(which, None)
+			if v is not None:
+				multiple = v.multiple_okay
+				if v.inverse_property:
+					inverse = v.inverse_property
 
 		try:
 			current = getattr(self, which)
 		except:
 			current = None
 		if not current:
-			object.__setattr__(self, which, value)
+			self._store(which, value)
 		elif type(current) is list:
 			# check value not in list
 			if self._factory.multiple_instances_per_property == "error" and isinstance(value, BaseResource) and value in current:
@@ -870,22 +2360,24 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 			if self._factory.validate_multiplicity and not multiple:
 				raise ProfileError("Cannot append to %s on %s as multiplicity is 1" % (which, self._type))
 			nvalue = [current, value]
-			object.__setattr__(self, which, nvalue)
+			self._store(which, nvalue)
 
 		if self._factory.materialize_inverses and not inversed and inverse:
 			# set the backwards ref		
 			value._set_magic_resource(inverse, self, True)
 		if self._factory.process_multiplicity and type(current) is not list and multiple:
-			object.__setattr__(self, which, [getattr(self, which)])
+			self._store(which, [getattr(self, which)])
 
 
-	def _toJSON(self, done, top=None):
+	def _toJSON(self, done, top=None, defer=False):
 		"""Serialize as JSON."""
 		# If we're already in the graph, return our URI only
 		# This should only be called from the factory!
 
-		d = self.__dict__.copy()
-		del d['_factory']
+		# With defer, child resources are left as _StreamRefs for toStream()
+		# to serialize as it reaches them
+
+		d = self._get_props()
 
 		# Can't pass in self as a param
 		if top is None:
@@ -898,6 +2390,18 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 			else:
 				return self.id
 
+		# With cache_json, reuse the JSON from last time if it still applies
+		frag = None
+		key = self._factory._serializing.json_cache_key
+		if key is not None and top is not self and not defer and \
+			not (self._factory.id_type_label and id(self) in done):
+			entry = self._json_cache
+			if entry is not None and entry.key == key:
+				value = entry.reuse(done)
+				if value is not None:
+					return value
+			frag = _CachedJSON(key, self, self._embed)
+
 		# In case of local contexts, not at the root
 		# Shouldn't ever happen, but worth testing for
 		if 'context' in d:
@@ -945,6 +2449,7 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 			kvs = list(d.items())
 
 		tbd = []
+		refs = []
 		for (k, v) in kvs:
 			# some _foo might be carried through, eg _label or _comment
 			k = self._property_name_map.get(k, k)
@@ -956,6 +2461,8 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 						not self._linked_art_boundary_okay(top, k, v):
 						# never follow, so just add to done
 						done[id(v)] = 1
+						if frag is not None:
+							frag.mark(v)
 					else:
 						tbd.append(id(v))
 				elif type(v) is list:
@@ -965,6 +2472,8 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 								not self._linked_art_boundary_okay(top, k, ni):
 								# never follow, so just add to done
 								done[id(ni)] = 1							
+								if frag is not None:
+									frag.mark(ni)
 							else:
 								tbd.append(id(ni))
 					# For completeness should check list-of-datetime here too
@@ -984,9 +2493,15 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 				k = nk
 			if v and (k[0] != "_" and not k in self._factory.underscore_properties):
 				if isinstance(v, ExternalResource):
-					if done[id(v)] == id(self):
-						del done[id(v)]
-					d[k] = v._toJSON(done=done, top=top)
+					if defer:
+						d[k] = _StreamRef(self, v)
+						refs.append(d[k])
+					else:
+						if done[id(v)] == id(self):
+							del done[id(v)]
+						d[k] = v._toJSON(done=done, top=top)
+						if frag is not None:
+							frag.add_child(v, d[k])
 				elif type(v) is list:
 					newl = []
 					uniq = set()
@@ -997,28 +2512,36 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 							else:
 								uniq.add(id(ni))
 						if isinstance(ni, ExternalResource):
-							if done[id(ni)] == id(self):
-								del done[id(ni)]
-							newl.append(ni._toJSON(done=done, top=top))
+							if defer:
+								newl.append(_StreamRef(self, ni))
+								refs.append(newl[-1])
+							else:
+								if done[id(ni)] == id(self):
+									del done[id(ni)]
+								newl.append(ni._toJSON(done=done, top=top))
+							if frag is not None:
+								frag.add_child(ni, newl[-1])
 						else:
 							# A number or string
 							newl.append(ni)
 					d[k] = newl				
 
-		if self._factory.full_names:
+		full_names = self._factory._serializing.full_names
+		if full_names is None:
+			full_names = self._factory.full_names
+		if full_names:
 			nd = {}
 			# @context gets ganked by this renaming
 			# so add it back in first.
 			if top is self:
 				nd['@context'] = self._factory.context_uri
 
+			predicates = self._predicate_table
 			for (k,v) in d.items():
-				# look up the rdf predicate in _properties
-				for c in reversed(self._classhier):
-					if k in c._all_properties:
-						nk = c._all_properties[k].predicate
-						nd[nk] = v
-						break
+				# look up the rdf predicate
+				nk = predicates.get(k, None)
+				if nk is not None:
+					nd[nk] = v
 
 			# Ensure full version uses basic @type
 			if "rdf:type" in nd:
@@ -1045,34 +2568,43 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 
 			if self._factory.pipe_scoped_contexts:
 				# XXX TODO This should be configurable not hard coded
-				if 'part' in d:
+				if 'part' in d and 'part' in self._predicate_table:
 					# Calculate which part
-					for c in reversed(self._classhier):
-						if 'part' in c._all_properties:
-							nk = c._all_properties['part'].predicate
-							d['part|%s' % nk]  = d['part']
-							del d['part']
-							break
-				if 'part_of' in d:
+					nk = self._predicate_table['part']
+					d['part|%s' % nk]  = d['part']
+					del d['part']
+				if 'part_of' in d and 'part_of' in self._predicate_table:
 					# Calculate which part
-					for c in reversed(self._classhier):
-						if 'part_of' in c._all_properties:
-							nk = c._all_properties['part_of'].predicate
-							d['part_of|%s' % nk]  = d['part_of']
-							del d['part_of']
-							break
-
-		if self._highlight and self._factory.allow_highlight:
+					nk = self._predicate_table['part_of']
+					d['part_of|%s' % nk]  = d['part_of']
+					del d['part_of']
+
+		if self._factory.allow_highlight and self._highlight:
 			d['_highlight'] = True
-		if self._elide and self._factory.allow_elide:
+		if self._factory.allow_elide and self._elide:
 			d['_elide'] = True
 
 		if self._factory.order_json:
-			return OrderedDict(sorted(d.items(), key=lambda x: KOH.get(x[0], 1000)))
-		else:
-			return d
+			d = OrderedDict(sorted(d.items(), key=lambda x: KOH.get(x[0], 1000)))
+
+		if refs:
+			# Children have to be serialized in the order they were visited
+			# to get the same done behavior. If the output order is different,
+			# (eg full_names) then do them now rather than when written
+			ordered = []
+			for v in d.values():
+				if type(v) is _StreamRef:
+					ordered.append(v)
+				elif type(v) is list:
+					ordered.extend(ni for ni in v if type(ni) is _StreamRef)
+			if ordered != refs:
+				for r in refs:
+					r.resolve(done, top)
+		if frag is not None:
+			frag.finish(self, d)
+		return d
 
-	def _toJSON_fast(self, done, top=None):
+	def _toJSON_fast(self, done, top=None, defer=False):
 		"""Serialize as JSON."""
 		# If we're already in the graph, return our URI only
 		# This should only be called from the factory!
@@ -1089,6 +2621,18 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 		if top is None:
 			top = self
 
+		# With cache_json, reuse the JSON from last time if it still applies
+		frag = None
+		key = self._factory._serializing.json_cache_key
+		if key is not None and top is not self and not defer and \
+			not (self._factory.id_type_label and id(self) in done):
+			entry = self._json_cache
+			if entry is not None and entry.key == key:
+				value = entry.reuse(done)
+				if value is not None:
+					return value
+			frag = _CachedJSON(key, self, self._embed)
+
 		# Add back context at the top, if set
 		result = {}
 		if top is self and id(self) not in done and self._factory.context_uri: 
@@ -1108,13 +2652,14 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 		# Need only minimal representation of self
 		if (self._factory.id_type_label and id(self) in done) or (top is not self and not self._embed):
 			# limit to only id, type, label
+			if frag is not None:
+				frag.finish(self, result)
 			return result
 		else:	
 			# otherwise, we're about to serialize the resource completely
 			done[id(self)] = 1			
 
-		d = self.__dict__.copy()
-		del d['_factory']
+		d = self._get_props()
 		del d['id']
 
 		# Need to do in order now to get done correctly ordered
@@ -1152,6 +2697,8 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 					not self._linked_art_boundary_okay(top, k, v):
 					# never follow, so just add to done
 					done[id(v)] = 1
+					if frag is not None:
+						frag.mark(v)
 				else:
 					tbd.append(id(v))
 			elif type(v) is list:
@@ -1161,6 +2708,8 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 							not self._linked_art_boundary_okay(top, k, ni):
 							# never follow, so just add to done
 							done[id(ni)] = 1							
+							if frag is not None:
+								frag.mark(ni)
 						else:
 							tbd.append(id(ni))
 
@@ -1176,9 +2725,15 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 			if not v:
 				pass
 			elif isinstance(v, ExternalResource):
-				if done[id(v)] == id(self):
-					del done[id(v)]
-				result[k] = v._toJSON_fast(done=done, top=top)
+				if defer:
+					# result is in visiting order, so can always be deferred
+					result[k] = _StreamRef(self, v)
+				else:
+					if done[id(v)] == id(self):
+						del done[id(v)]
+					result[k] = v._toJSON_fast(done=done, top=top)
+					if frag is not None:
+						frag.add_child(v, result[k])
 			elif type(v) is list:
 				newl = []
 				uniq = set()
@@ -1189,9 +2744,14 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 						else:
 							uniq.add(id(ni))
 					if isinstance(ni, ExternalResource):
-						if done[id(ni)] == id(self):
-							del done[id(ni)]
-						newl.append(ni._toJSON_fast(done=done, top=top))
+						if defer:
+							newl.append(_StreamRef(self, ni))
+						else:
+							if done[id(ni)] == id(self):
+								del done[id(ni)]
+							newl.append(ni._toJSON_fast(done=done, top=top))
+							if frag is not None:
+								frag.add_child(ni, newl[-1])
 					else:
 						# A number or string
 						newl.append(ni)
@@ -1200,6 +2760,8 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 				result[k] = v.strftime("%Y-%m-%dT%H:%M:%SZ")
 			else:
 				result[k] = v
+		if frag is not None:
+			frag.finish(self, result)
 		return result
 
 	def _linked_art_boundary_okay(self, top, prop, value):
@@ -1209,29 +2771,25 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 
 	def list_all_props(self, filter=None, okay=None):
 		props = []
-		for c in self._classhier:		
-			for k,v in c._all_properties.items():
-				if not k in props and \
-					(not okay or (okay and v.profile_okay)) and \
-					(filter is None or isinstance(filter, v.range) or \
-						filter is v.range):
-					props.append(k)
+		for k,v in self._property_table.items():
+			if (not okay or (okay and v.profile_okay)) and \
+				(filter is None or isinstance(filter, v.range) or \
+					filter is v.range):
+				props.append(k)
 		props.sort()
 		return props
 
 	def list_all_props_with_range(self, filter=None, okay=None):
 		props = {}
-		for c in self._classhier:		
-			for k,v in c._all_properties.items():
-				if not k in props and \
-					(not okay or (okay and v.profile_okay)) and \
-					(filter is None or isinstance(filter, v.range) or \
-						filter is v.range):
-					props[k] = v.range
+		for k,v in self._property_table.items():
+			if (not okay or (okay and v.profile_okay)) and \
+				(filter is None or isinstance(filter, v.range) or \
+					filter is v.range):
+				props[k] = v.range
 		return props
 
 	def list_my_props(self, filter=None):
-		d = self.__dict__.copy()		
+		d = self._get_props()
 		props = []
 		for (k,v) in d.items():
 			if k[0] != "_" or k in self._factory.underscore_properties:
@@ -1250,10 +2808,9 @@ change factory.multiple_instances_per_property to 'drop' or 'allow'""")
 
 	def allows_multiple(self, propName):
 		""" Does propName allow multiple values on this class """
-		for c in self._classhier:
-			if propName in c._all_properties:
-				v = c._all_properties[propName]
-				return bool(v.multiple_okay)
+		v = self._property_table.get(propName, None)
+		if v is not None:
+			return bool(v.multiple_okay)
 		raise DataError("Cannot set '%s' on '%s'" % (propName, self.__class__.__name__))
 
 	def clone(self, minimal=False):
@@ -1282,6 +2839,7 @@ def override_okay(clss, propName):
 			pinfo.inverse_property, pinfo.inverse_predicate, 
 			pinfo.multiple_okay, 1)
 		clss._all_properties[propName] = npinfo
+		rebuild_property_tables()
 	else:
 		raise DataError("%s does not have a %s property to allow" % 
 			(clss.__name__, propName))
@@ -1299,6 +2857,37 @@ BaseResource._all_properties = {
 }
 BaseResource._classhier = (BaseResource, ExternalResource)
 
+def build_property_table(clss):
+	""" Merge the properties of the class hierarchy into single lookup tables on the class """
+	# The most specific definition of a property is used for validation
+	table = {}
+	for c in clss._classhier:
+		for (k, v) in c._all_properties.items():
+			if not k in table:
+				table[k] = v
+	clss._property_table = table
+	# But the most generic one is the predicate when serializing
+	predicates = {}
+	for c in reversed(clss._classhier):
+		for (k, v) in c._all_properties.items():
+			if not k in predicates:
+				predicates[k] = v.predicate
+	clss._predicate_table = predicates
+
+def rebuild_property_tables():
+	""" Rebuild the tables for every class, after any _all_properties has changed """
+	todo = [BaseResource]
+	while todo:
+		c = todo.pop()
+		todo.extend(c.__subclasses__())
+		# Classes that don't set their own hierarchy share their parent's table
+		if '_classhier' in c.__dict__:
+			build_property_table(c)
+	# The compiled serializer's plans also depend on the hierarchy
+	factory.reset_compiled_plans()
+
+build_property_table(BaseResource)
+
 def process_tsv(fn):
 	fh = codecs.open(fn, 'r', 'utf-8')
 	lines = fh.readlines()[1:] # chomp header line
@@ -1361,7 +2950,11 @@ def build_class(crmName, parent, vocabData):
 			raise
 		return
 
-	c = type(name, (parent,), {'__doc__': data['desc']})
+	slots = ()
+	if COMPACT_STORAGE:
+		inherited = _compact_slots(parent)
+		slots = tuple(n for n in COMPACT_CLASS_SLOTS.get(name, ()) if not n in inherited)
+	c = type(name, (parent,), {'__doc__': data['desc'], '__slots__': slots})
 	globals()[name] = c
 	data['class'] = c
 	if not ":" in crmName:
@@ -1417,8 +3010,7 @@ def build_classes(fn=None, topClass=None):
 	# Default to building our core dataset
 
 	if not fn:
-		dd = os.path.join(os.path.dirname(__file__), 'data')
-		fn = os.path.join(dd, 'crm_vocab.tsv')
+		fn = os.path.join(DATA_DIR, 'crm_vocab.tsv')
 		topClass = 'E1_CRM_Entity'
 
 	vocabData = process_tsv(fn)
@@ -1472,9 +3064,15 @@ def build_classes(fn=None, topClass=None):
 			# Never had it set?
 			pass
 
+	# And flatten the properties of each hierarchy for fast lookups
+	for v in vocabData.values():
+		build_property_table(v['class'])
+
 # XXX This should be invoked rather than inline so the module can be loaded
 # and a different context used. But for now ...
 # Build the factory first, so properties can be added to key_order
-factory = CromulentFactory("http://lod.example.org/museum/", context="https://linked.art/ns/v1/linked-art.json")
+factory = CromulentFactory("http://lod.example.org/museum/", context=LINKED_ART_CONTEXT_URI)
+if COMPACT_STORAGE:
+	ExternalResource._factory = factory
 build_classes()
 # Need to then configure the boundary classes after they're created
@@ -3,12 +3,14 @@
 # can generate classes for any ontology
 
 import inspect
-from cromulent.model import Destruction, EndOfExistence, Activity, Appellation, LinguisticObject	
+from cromulent.model import Destruction, EndOfExistence, Activity, Appellation, LinguisticObject, \
+	build_property_table
 
 # DestuctionActivity class as CRM has a Destruction Event and recommends multi-classing
 # WARNING:  instantiating this class in the default profile will raise an error
 
 class DestructionActivity(Destruction, Activity):
+	__slots__ = ()
 	_uri_segment = "Activity"
 	_type = ["crm:E6_Destruction", "crm:E7_Activity"]
 
@@ -16,10 +18,12 @@ class DestructionActivity(Destruction, Activity):
 	def type(self):
 		return ["Destruction", "Activity"]
 DestructionActivity._classhier = inspect.getmro(DestructionActivity)[:-1]
+build_property_table(DestructionActivity)
 
 # And hence we make an EndOfExistence+Activity class
 # for all activities that end existences
 class EoEActivity(EndOfExistence, Activity):
+	__slots__ = ()
 	_uri_segment = "Activity"
 	_type = ["crm:64_End_of_Existence", "crm:E7_Activity"]
 	_niceType = ["EndOfExistence", "Activity"]	
@@ -29,5 +33,6 @@ class EoEActivity(EndOfExistence, Activity):
 		return ["EndOfExistence", "Activity"]
 
 EoEActivity._classhier = inspect.getmro(EoEActivity)[:-1]
+build_property_table(EoEActivity)
 
 # No need for Linguistic Appellation any more, as we have E33_E41_Linguistic_Appellation
\ No newline at end of file
@@ -1,38 +1,73 @@
+import io
+import os
+import json
+import pickle
+import codecs
+import itertools
+from collections import namedtuple
+
 from cromulent import model, vocab
-from cromulent.model import factory, DataError, OrderedDict, BaseResource
+from cromulent.model import factory, DataError, ProfileError, ConfigurationError, \
+	OrderedDict, BaseResource
 from cromulent.model import STR_TYPES
 
-import json
+_ReadEntry = namedtuple("_ReadEntry", [
+	'order', # position in factory.key_order_hash, to set values in the same order as construct
+	'range', # the class which is the range of the property, or None if it's unknown
+	'literal', # the range is str, so the last value is stored as is
+	'multiple', # can there be multiple values
+	'inverse', # the name of the inverse property, if any
+	'setattr' # must go through setattr, as the class has a setter or the property is unknown
+	])
+
+ReadResult = namedtuple("ReadResult", [
+	'filename', # the file that was read
+	'resource', # the resource read from it, or None if it couldn't be
+	'error' # None, or the error message if it couldn't be read
+	])
+
+class _ReadPlan(dict):
+	"""Per-class plan for the Reader's trusted mode, mapping each property
+	name to a _ReadEntry, or None for id and type"""
+
+	def __init__(self, clss, factory):
+		dict.__init__(self)
+		self.clss = clss
+		self.factory = factory
+
+	def __missing__(self, k):
+		if k in ['@context', 'id', 'type']:
+			entry = None
+		else:
+			order = self.factory.key_order_hash.get(k, 10000)
+			pinfo = self.clss._property_table.get(k, None)
+			if pinfo is None:
+				entry = _ReadEntry(order, None, False, True, None, True)
+			else:
+				entry = _ReadEntry(order, pinfo.range, pinfo.range is str, pinfo.multiple_okay,
+					pinfo.inverse_property, hasattr(self.clss, 'set_%s' % k))
+		self[k] = entry
+		return entry
 
 class Reader(object):
 
-	def __init__(self, validate_props=True, validate_profile=True):
+	def __init__(self, validate_props=True, validate_profile=True, trusted=False):
 		self.uri_object_map = {}
 		self.forward_refs = []
 		self.vocab_props = ['assigned_property']
-		self.vocab_classes = {}
+		# shared by all readers, and kept up to date by vocab.register_vocab_class
+		self.vocab_classes = vocab.vocab_class_index()
 		self.validate_profile = validate_profile
 		self.validate_props = validate_props
-
-		for cx in dir(vocab):
-			what = getattr(vocab, cx)
-			# crying cat face -- type as a @property returns the function, not the value
-			# when calling it on a class rather than an instance
-			try:
-				mytype = what._classhier[0].__name__
-			except AttributeError:
-				continue
-			# find classes
-			if (cx[0].isupper() and not hasattr(model, cx) and type(what) == type):
-				# class
-				self.vocab_classes[(mytype, what._classification[0].id)] = what
+		# Data we wrote ourselves doesn't need checking, see construct_trusted
+		self.trusted = trusted
 
 	def read(self, data):
 		if not data:
 			raise DataError("No data provided: %r" % data)
-		elif type(data) in STR_TYPES:
+		elif type(data) in STR_TYPES or isinstance(data, memoryview):
 			try:
-				data = json.loads(data)
+				data = factory.json_loads(data)
 			except:
 				raise DataError("Data is not valid JSON")
 		if not data:
@@ -48,6 +83,130 @@ class Reader(object):
 		except:
 			raise
 
+	def read_bundle(self, bundle, ident):
+		"""Read the record with id ident from a cromulent.sinks.Bundle,
+		decoding it straight from the mapped file"""
+		return self.read(bundle.get(ident))
+
+	def read_stream(self, source, format=None, chunk_size=65536):
+		"""Yield a resource for each record in source, a file name or an open
+		file of JSON Lines or of a JSON array of records, reading it chunk_size
+		at a time rather than all at once. format is "jsonl" or "array", or
+		found from the first character. File names ending .gz or .xz are
+		decompressed. References between records are not resolved, as each
+		is read separately."""
+		close = False
+		if type(source) in STR_TYPES:
+			source = _open_records(source)
+			close = True
+		try:
+			chunks = _text_chunks(source, chunk_size)
+			buf = ""
+			for chunk in chunks:
+				buf += chunk
+				if buf.lstrip("\ufeff \t\r\n"):
+					break
+			buf = buf.lstrip("\ufeff \t\r\n")
+			if format is None:
+				format = "array" if buf.startswith("[") else "jsonl"
+			if format == "jsonl":
+				records = _json_lines(chunks, buf)
+			elif format == "array":
+				records = _json_array(chunks, buf)
+			else:
+				raise DataError("Unknown stream format %s, use jsonl or array" % format)
+			for (n, data) in records:
+				try:
+					yield self.read(data)
+				except DataError as e:
+					raise DataError("Record %s: %s" % (n, e))
+		finally:
+			if close:
+				source.close()
+
+	def read_dir(self, base_dir="", workers=None, batch_size=50, max_pending=None,
+			ordered=True, extension=None, setup=None):
+		"""Yield a ReadResult for each file under base_dir (default
+		factory.base_dir), such as those written by toFile, whose name ends
+		with extension (default factory.filename_extension). With workers,
+		the files are read and their resources constructed in a pool of that
+		many processes, each with a copy of the factory's settings and a
+		Reader with the same options as this one, and setup called first if
+		given. At most max_pending batches of batch_size files are waiting
+		at once (default twice the number of workers). Results are in the
+		order of the files, sorted by directory and name, unless ordered is
+		False when they are yielded as soon as each batch is done. A file
+		that can't be read gives a result with the error message rather than
+		stopping the rest."""
+		base_dir = base_dir or factory.base_dir
+		if not base_dir:
+			raise ConfigurationError("Directory (factory.base_dir) on Factory must be set to read files from it")
+		if extension is None:
+			extension = factory.filename_extension
+		files = _walk_files(base_dir, extension)
+		if not workers or workers < 2:
+			for fn in files:
+				yield self._read_file(fn)
+			return
+
+		from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+		if max_pending is None:
+			max_pending = workers * 2
+		options = {"validate_props": self.validate_props,
+			"validate_profile": self.validate_profile, "trusted": self.trusted}
+		# future: (batch number, file names)
+		pending = {}
+		# batch number: results, for those done before the ones ahead of them
+		done = {}
+		batches = enumerate(model._batches(files, batch_size))
+		nxt = 0
+
+		def results(f):
+			(n, filenames) = pending.pop(f)
+			try:
+				return (n, f.result())
+			except Exception as e:
+				# Couldn't be sent back or the worker died
+				msg = "%s: %s" % (e.__class__.__name__, e)
+				return (n, [ReadResult(fn, None, msg) for fn in filenames])
+
+		with ProcessPoolExecutor(workers, initializer=model._worker_init,
+				initargs=(pickle.dumps(factory), setup)) as pool:
+			try:
+				while True:
+					if not pending or len(pending) + len(done) < max_pending:
+						try:
+							(n, batch) = next(batches)
+						except StopIteration:
+							if not pending:
+								break
+						else:
+							pending[pool.submit(_read_dir_batch, batch, options)] = (n, batch)
+							continue
+					(finished, _) = wait(pending, return_when=FIRST_COMPLETED)
+					for f in finished:
+						(n, res) = results(f)
+						if not ordered:
+							for r in res:
+								yield r
+							continue
+						done[n] = res
+						while nxt in done:
+							for r in done.pop(nxt):
+								yield r
+							nxt += 1
+			finally:
+				for f in pending:
+					f.cancel()
+
+	def _read_file(self, filename):
+		try:
+			with open(filename, 'rb') as fh:
+				data = fh.read()
+			return ReadResult(filename, self.read(data), None)
+		except Exception as e:
+			return ReadResult(filename, None, "%s: %s" % (e.__class__.__name__, e))
+
 	def process_forward_refs(self):
 		for (what, prop, uri) in self.forward_refs:
 			if uri in self.uri_object_map:
@@ -57,6 +216,87 @@ class Reader(object):
 
 	def construct(self, js):
 		# pass in json, get back object
+		if self.trusted:
+			return self.construct_trusted(js)
+		# Nested resources are constructed with an explicit stack rather than
+		# by recursion, in the same order: each is finished before it's set on
+		# its parent, and before the parent's next value is looked at. Only
+		# nested resources go on the stack, other values are set as they're met
+		uri_object_map = self.uri_object_map
+		KOH = factory.key_order_hash
+		stack = []
+		while True:
+			if js is not None:
+				(ident, clx, trash) = self._find_class(js)
+				what = clx(ident=ident)
+				what._validate_profile = self.validate_profile
+				uri_object_map[ident] = what
+				propList = what.list_all_props() if self.validate_props else None
+				# sort data by KOH to minimize chance of bad backrefs
+				itms = list(js.items())
+				itms.sort(key=lambda x: KOH.get(x[0], 10000))
+				# the item, and value within it, to carry on from
+				i = j = 0
+				js = None
+
+			while i < len(itms):
+				(prop, value) = itms[i]
+				if prop in ['id', 'type']:
+					i += 1
+					continue
+
+				if j == 0 and propList is not None and not prop in propList:
+					raise DataError("Unknown property %s on %s" % (prop, clx.__name__))
+
+				# Find the range
+				pinfo = what._property_table.get(prop, None)
+				rng = pinfo.range if pinfo is not None else None
+
+				if type(value) != list:
+					value = [value]
+				while j < len(value):
+					subvalue = value[j]
+					j += 1
+					if trash is not None and prop == 'classified_as' and subvalue == trash:
+						continue
+					if rng == str:
+						setattr(what, prop, subvalue)
+					elif type(subvalue) == dict or isinstance(subvalue, OrderedDict):
+						# construct it, then come back to set it
+						js = subvalue
+						break
+					elif type(subvalue) in STR_TYPES and prop in self.vocab_props:
+						# keep as string
+						setattr(what, prop, subvalue)
+					elif type(subvalue) in STR_TYPES:
+						# raw URI to be made into a class of type rng
+						# or back reference
+						if subvalue in uri_object_map:
+							setattr(what, prop, uri_object_map[subvalue])
+						elif rng in [model.Type, BaseResource]:
+							# Always a X, often no more info
+							setattr(what, prop, rng(ident=subvalue))
+						else:
+							self.forward_refs.append([what, prop, subvalue])
+					else:
+						# No idea!!
+						raise DataError("Value %r is not expected for %s" % (subvalue, prop))
+				if js is not None:
+					break
+				i += 1
+				j = 0
+
+			if js is not None:
+				stack.append((what, itms, i, j, prop, clx, trash, propList))
+			elif stack:
+				(parent, itms, i, j, prop, clx, trash, propList) = stack.pop()
+				setattr(parent, prop, what)
+				what = parent
+			else:
+				return what
+
+	def _find_class(self, js):
+		# (id, class, the classified_as value that the class adds itself)
 		if '@context' in js:
 			del js['@context']
 
@@ -83,11 +323,12 @@ class Reader(object):
 					clx = clx2
 					trash = c
 					break
+		return (ident, clx, trash)
 
-		what = clx(ident=ident)
-		what._validate_profile = self.validate_profile
-		self.uri_object_map[ident] = what
-
+	def _node_values(self, what, js, clx, trash):
+		# Yield (property, value, False) to set on what, with references
+		# already resolved, or (property, dict, True) for a resource to
+		# construct first
 		if self.validate_props:
 			propList = what.list_all_props()
 
@@ -102,11 +343,9 @@ class Reader(object):
 			if self.validate_props and not prop in propList:
 				raise DataError("Unknown property %s on %s" % (prop, clx.__name__))
 
-			# Climb looking for range
-			for c in what._classhier:		
-				if prop in c._all_properties:
-					rng = c._all_properties[prop].range
-					break
+			# Find the range
+			pinfo = what._property_table.get(prop, None)
+			rng = pinfo.range if pinfo is not None else None
 
 			if type(value) != list:
 				value = [value]
@@ -114,28 +353,275 @@ class Reader(object):
 				if trash is not None and prop == 'classified_as' and subvalue == trash:
 					continue
 				if rng == str:
-					setattr(what, prop, subvalue)				
+					yield (prop, subvalue, False)
 				elif type(subvalue) == dict or isinstance(subvalue, OrderedDict):
-					# recurse ...
-					val = self.construct(subvalue)
-					setattr(what, prop, val)
+					yield (prop, subvalue, True)
 				elif type(subvalue) in STR_TYPES and prop in self.vocab_props:
 					# keep as string
-					setattr(what, prop, subvalue)
+					yield (prop, subvalue, False)
 				elif type(subvalue) in STR_TYPES:
 					# raw URI to be made into a class of type rng
 					# or back reference
 					if subvalue in self.uri_object_map:
-						setattr(what, prop, self.uri_object_map[subvalue])
+						yield (prop, self.uri_object_map[subvalue], False)
 					elif rng in [model.Type, BaseResource]:
 						# Always a X, often no more info
-						setattr(what, prop, rng(ident=subvalue))
+						yield (prop, rng(ident=subvalue), False)
 					else:
 						self.forward_refs.append([what, prop, subvalue])
 				else:
 					# No idea!!
 					raise DataError("Value %r is not expected for %s" % (subvalue, prop))
 
+	def construct_trusted(self, js):
+		"""Construct resources from JSON that is known to be good, such as
+		that written by cromulent itself. Properties, ranges and the profile
+		are not checked, and values are stored directly, using per-class
+		tables built from _property_table, rather than through setattr"""
+		fac = factory
+		fac._check_plans()
+		plans = fac._read_plans
+		stack = [self._start_trusted(js, plans)]
+		while True:
+			node = stack[-1]
+			what = node[0]
+			values = node[2]
+			for (prop, entry, subvalue) in node[1]:
+				if entry.literal:
+					values[prop] = subvalue
+				elif type(subvalue) == dict or isinstance(subvalue, OrderedDict):
+					node[3] = prop
+					stack.append(self._start_trusted(subvalue, plans))
+					break
+				elif type(subvalue) in STR_TYPES:
+					if subvalue in self.uri_object_map:
+						subvalue = self.uri_object_map[subvalue]
+					elif prop in self.vocab_props:
+						setattr(what, prop, subvalue)
+						continue
+					elif entry.range in [model.Type, BaseResource]:
+						subvalue = entry.range(ident=subvalue)
+					else:
+						self.forward_refs.append([what, prop, subvalue])
+						continue
+					try:
+						values[prop].append(subvalue)
+					except KeyError:
+						values[prop] = [subvalue]
+				elif entry.range is None:
+					values[prop] = subvalue
+				else:
+					raise DataError("Value %r is not expected for %s" % (subvalue, prop))
+			else:
+				stack.pop()
+				self._finish_trusted(what, node[4], values)
+				if not stack:
+					return what
+				parent = stack[-1]
+				try:
+					parent[2][parent[3]].append(what)
+				except KeyError:
+					parent[2][parent[3]] = [what]
+
+	def _start_trusted(self, js, plans):
+		# [the new resource, its (property, entry, value)s, the values to
+		#  set on it, the property of the one being constructed, its plan]
+		(ident, clx, trash) = self._find_class(js)
+		what = self._new_trusted(clx, ident)
+		self.uri_object_map[ident] = what
+		try:
+			plan = plans[clx]
+		except KeyError:
+			plan = plans.setdefault(clx, _ReadPlan(clx, factory))
+		itms = []
+		for (prop, value) in js.items():
+			entry = plan[prop]
+			if entry is not None:
+				itms.append((entry.order, prop, entry, value))
+		# sort by KOH, as for construct
+		itms.sort(key=lambda x: x[0])
+		return [what, _trusted_values(itms, trash), {}, None, plan]
+
+	def _new_trusted(self, clx, ident):
+		# As clx(ident=ident), but without setattr or checking the class
+		# is okay to use. Only the ids that cromulent writes are handled
+		# here, anything else goes through the usual __init__
+		what = clx.__new__(clx)
+		if model.COMPACT_STORAGE:
+			object.__setattr__(what, '_values', ())
+		else:
+			what._store('_factory', factory)
+		if ident == "":
+			what._store('id', ident)
+		elif ident.startswith('http'):
+			hashed = ident.rsplit('#', 1)
+			if len(hashed) == 1:
+				(pref, rest) = ident.rsplit('/', 1)
+				pref += "/"
+			else:
+				(pref, rest) = hashed
+				pref += "#"
+			if pref in factory.prefixes_rev:
+				what._store('_full_id', ident)
+				ident = "%s:%s" % (factory.prefixes_rev[pref], rest)
+			what._store('id', ident)
+		else:
+			model.ExternalResource.__init__(what, ident)
+		what._store('_validate_profile', self.validate_profile)
+		# eg to add the classification of a vocab class
+		what._post_init()
 		return what
 
+	def _finish_trusted(self, what, plan, values):
+		# Store the values collected for what, as setattr would have left them
+		fac = what._factory
+		multiples = fac.process_multiplicity
+		current = None
+		for (prop, value) in values.items():
+			entry = plan[prop]
+			if entry.setattr or (entry.inverse and fac.materialize_inverses):
+				for v in (value if type(value) is list else [value]):
+					setattr(what, prop, v)
+				continue
+			elif entry.literal:
+				what._store(prop, value)
+				continue
+			if current is None:
+				# eg classified_as from a vocab class, or a value kept as a string
+				current = what._get_props()
+			old = current.get(prop, None)
+			if type(old) is list:
+				old.extend(value)
+				value = old
+			elif old:
+				value.insert(0, old)
+			if len(value) > 1 or (multiples and entry.multiple):
+				if len(value) > 1 and fac.validate_multiplicity and not entry.multiple:
+					raise ProfileError("Cannot append to %s on %s as multiplicity is 1" % (prop, what._type))
+				what._store(prop, value)
+			else:
+				what._store(prop, value[0])
+
+def _read_dir_batch(filenames, options):
+	# Runs in Reader.read_dir's worker processes
+	rdr = Reader(**options)
+	return [rdr._read_file(fn) for fn in filenames]
+
+def _walk_files(base_dir, extension):
+	# The files under base_dir ending extension, sorted by directory and
+	# name, but not the temporary files of atomic_writes
+	for (d, dirs, files) in os.walk(base_dir):
+		dirs.sort()
+		for fn in sorted(files):
+			if fn.endswith(extension) and not fn.startswith("."):
+				yield os.path.join(d, fn)
+
+def _trusted_values(itms, trash):
+	# Yield (property, entry, value) for each value of each property
+	for (order, prop, entry, value) in itms:
+		if type(value) != list:
+			value = [value]
+		for subvalue in value:
+			if trash is not None and prop == 'classified_as' and subvalue == trash:
+				continue
+			yield (prop, entry, subvalue)
 
+def _open_records(filename):
+	if filename.endswith(".gz"):
+		import gzip
+		return gzip.open(filename, 'rt', encoding='utf-8')
+	elif filename.endswith(".xz"):
+		import lzma
+		return lzma.open(filename, 'rt', encoding='utf-8')
+	return io.open(filename, encoding='utf-8')
+
+def _text_chunks(fh, size):
+	# Read fh as text, decoding it if it's binary
+	decoder = None
+	while True:
+		chunk = fh.read(size)
+		if not chunk:
+			break
+		if isinstance(chunk, bytes):
+			if decoder is None:
+				decoder = codecs.getincrementaldecoder('utf-8')()
+			chunk = decoder.decode(chunk)
+		if chunk:
+			yield chunk
+
+def _json_lines(chunks, buf):
+	# Yield (line number, text) of each non-blank line
+	n = 0
+	pending = []
+	for chunk in itertools.chain([buf], chunks):
+		pending.append(chunk)
+		if not "\n" in chunk:
+			continue
+		lines = "".join(pending).split("\n")
+		pending = [lines.pop()]
+		for l in lines:
+			n += 1
+			if l.strip():
+				yield (n, l)
+	last = "".join(pending)
+	if last.strip():
+		yield (n + 1, last)
+
+def _json_array(chunks, buf):
+	# Yield (number, dict) of each object in a top level array, decoding
+	# each as soon as all of it has been read
+	decoder = json.JSONDecoder()
+	pos = 0
+	n = 0
+	eof = [False]
+
+	def more(needed=1):
+		# Add at least needed more characters to the buffer, if there are any
+		got = []
+		size = 0
+		while size < needed:
+			try:
+				chunk = next(chunks)
+			except StopIteration:
+				eof[0] = True
+				break
+			got.append(chunk)
+			size += len(chunk)
+		return "".join(got)
+
+	def skip(buf, pos):
+		while True:
+			while pos < len(buf) and buf[pos] in " \t\r\n":
+				pos += 1
+			if pos < len(buf) or eof[0]:
+				return (buf, pos)
+			(buf, pos) = (more(), 0)
+
+	if not buf.startswith("["):
+		raise DataError("Stream is not a JSON array")
+	(buf, pos) = skip(buf, 1)
+	if buf[pos:pos+1] == "]":
+		return
+	while True:
+		if buf[pos:pos+1] != "{":
+			raise DataError("Record %s is not a JSON object" % (n + 1))
+		while True:
+			try:
+				(data, end) = decoder.raw_decode(buf, pos)
+				break
+			except ValueError:
+				if eof[0]:
+					raise DataError("Record %s is not valid JSON" % (n + 1))
+				# Read at least as much again, so a big record isn't
+				# decoded over and over
+				buf = buf[pos:] + more(len(buf) - pos)
+				pos = 0
+		n += 1
+		yield (n, data)
+		(buf, pos) = skip(buf[end:], 0)
+		c = buf[pos:pos+1]
+		if c == "]":
+			return
+		elif c != ",":
+			raise DataError("Expected , or ] after record %s" % n)
+		(buf, pos) = skip(buf, pos + 1)
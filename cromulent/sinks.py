@@ -0,0 +1,370 @@
+# Sinks that write many records into one file, rather than a file per record
+# as toFile does: JSON Lines (plain, gzip or xz compressed), tar and zip.
+# Each can also write an index of where every record is in the file, so that
+# one can be read by id without reading the rest. The index is a text file
+# with a header line of the format and the data file's name, then a line of
+# id, block, offset and length for each record:
+#   block is the byte offset in the data file of the record itself, or of the
+#   compressed block (gzip member or xz stream) that it is in, or for zip of
+#   the member's local header
+#   offset is where the record starts in the decompressed block, else 0
+#   length is the length of the record's JSON in bytes
+# A bundle is a JSON Lines file and its index that can be appended to, and
+# read with Bundle, which maps the file into memory to look records up.
+# Elasticsearch (and OpenSearch) _bulk request bodies, of an action line and
+# then the document for each record, are made by bulk_chunks.
+# These are normally used through factory.toSink(), factory.toBundle(),
+# factory.toBulk() and factory.toBulkFiles()
+
+import os
+import io
+import time
+import zlib
+import mmap
+import codecs
+import struct
+import tarfile
+import zipfile
+
+from cromulent.model import ConfigurationError
+
+INDEX_HEADER = "# cromulent index"
+# Uncompressed bytes per compressed block: bigger compresses better,
+# smaller is quicker to read one record from
+BLOCK_SIZE = 1 << 18
+
+class JSONLinesSink(object):
+	"""One record per line"""
+
+	format = "jsonl"
+
+	def __init__(self, factory, filename, block_size=BLOCK_SIZE, append=False):
+		self.factory = factory
+		self.fh = open(filename, 'ab' if append else 'wb')
+		self.fh.seek(0, 2)
+		self.pos = self.fh.tell()
+
+	def add(self, what, data):
+		# data is the compact JSON of what, as UTF-8
+		self.fh.write(data + b"\n")
+		entry = (self.pos, 0, len(data))
+		self.pos += len(data) + 1
+		return entry
+
+	def close(self):
+		self.fh.close()
+
+class _BlockSink(JSONLinesSink):
+	# JSON Lines compressed in blocks of about block_size bytes, each of which
+	# is a complete gzip member or xz stream, so decompression can start at
+	# any block. Readers that don't use the index see a normal file
+
+	def __init__(self, factory, filename, block_size=BLOCK_SIZE):
+		JSONLinesSink.__init__(self, factory, filename)
+		self.block_size = block_size
+		self.block = []
+		self.block_len = 0
+
+	def add(self, what, data):
+		entry = (self.pos, self.block_len, len(data))
+		self.block.append(data)
+		self.block.append(b"\n")
+		self.block_len += len(data) + 1
+		if self.block_len >= self.block_size:
+			self.flush()
+		return entry
+
+	def flush(self):
+		if self.block:
+			out = self.compress(b"".join(self.block))
+			self.fh.write(out)
+			self.pos += len(out)
+			self.block = []
+			self.block_len = 0
+
+	def close(self):
+		self.flush()
+		self.fh.close()
+
+class GzipJSONLinesSink(_BlockSink):
+
+	format = "jsonl.gz"
+
+	def compress(self, data):
+		c = zlib.compressobj(6, zlib.DEFLATED, 31)
+		return c.compress(data) + c.flush()
+
+	@staticmethod
+	def decompressor():
+		return zlib.decompressobj(31)
+
+class XzJSONLinesSink(_BlockSink):
+
+	format = "jsonl.xz"
+
+	def compress(self, data):
+		import lzma
+		return lzma.compress(data, format=lzma.FORMAT_XZ)
+
+	@staticmethod
+	def decompressor():
+		import lzma
+		return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+class TarSink(object):
+	"""A member per record, named by factory.get_file_path()"""
+
+	format = "tar"
+
+	def __init__(self, factory, filename, block_size=BLOCK_SIZE):
+		self.factory = factory
+		self.tar = tarfile.open(filename, 'w', format=tarfile.PAX_FORMAT)
+		self.mtime = int(time.time())
+
+	def add(self, what, data):
+		info = tarfile.TarInfo('/'.join(self.factory.get_file_path(what.id)))
+		info.size = len(data)
+		info.mtime = self.mtime
+		self.tar.addfile(info, io.BytesIO(data))
+		# The data is padded to a whole number of 512 byte blocks
+		return (self.tar.offset - (len(data) + 511) // 512 * 512, 0, len(data))
+
+	def close(self):
+		self.tar.close()
+
+class ZipSink(object):
+	"""A deflated member per record, named by factory.get_file_path()"""
+
+	format = "zip"
+
+	def __init__(self, factory, filename, block_size=BLOCK_SIZE):
+		self.factory = factory
+		self.zip = zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED)
+		self.date_time = time.localtime()[:6]
+
+	def add(self, what, data):
+		info = zipfile.ZipInfo('/'.join(self.factory.get_file_path(what.id)), self.date_time)
+		info.compress_type = zipfile.ZIP_DEFLATED
+		self.zip.writestr(info, data)
+		return (info.header_offset, 0, len(data))
+
+	def close(self):
+		self.zip.close()
+
+SINKS = dict((s.format, s) for s in [JSONLinesSink, GzipJSONLinesSink, XzJSONLinesSink, TarSink, ZipSink])
+
+def sink_format(filename):
+	"""The format for filename, from its extension"""
+	for fmt in sorted(SINKS, key=len, reverse=True):
+		if filename.endswith("." + fmt):
+			return fmt
+	if filename.endswith(".ndjson"):
+		return "jsonl"
+	raise ConfigurationError("Can't tell the sink format of %s, give one of %s" % (filename, ", ".join(sorted(SINKS))))
+
+def write(factory, resources, filename, format=None, index=None, compact=True, block_size=BLOCK_SIZE, append=False):
+	if not format:
+		format = sink_format(filename)
+	elif not format in SINKS:
+		raise ConfigurationError("Unknown sink format %s, use one of %s" % (format, ", ".join(sorted(SINKS))))
+	if index is True:
+		index = filename + ".idx"
+	if append:
+		if format != "jsonl":
+			raise ConfigurationError("Only jsonl can be appended to, not %s" % format)
+		sink = JSONLinesSink(factory, filename, append=True)
+	else:
+		sink = SINKS[format](factory, filename, block_size=block_size)
+	idx = None
+	count = 0
+	try:
+		if index:
+			idx = codecs.open(index, 'a' if append else 'w', 'utf-8')
+			if not append or not idx.tell():
+				idx.write("%s\t%s\t%s\n" % (INDEX_HEADER, format, os.path.basename(filename)))
+		for what in resources:
+			# Lines have to be compact
+			data = factory.toString(what, compact or format.startswith("jsonl")).encode('utf-8')
+			entry = sink.add(what, data)
+			if idx is not None:
+				idx.write("%s\t%s\t%s\t%s\n" % ((what.id or "",) + entry))
+			count += 1
+	finally:
+		sink.close()
+		if idx is not None:
+			idx.close()
+	return count
+
+def read_record(filename, format, entry):
+	"""The JSON text of the record at entry (block, offset, length) in filename"""
+	(block, offset, length) = entry
+	with open(filename, 'rb') as fh:
+		fh.seek(block)
+		if format in ("jsonl", "tar"):
+			data = fh.read(length)
+		elif format == "zip":
+			# Local header: signature, versions, flags, method, time, date,
+			# crc, sizes, and the lengths of the name and extra field
+			hdr = struct.unpack("<4s5H3L2H", fh.read(30))
+			if hdr[0] != b"PK\x03\x04":
+				raise ConfigurationError("No zip member at %s in %s" % (block, filename))
+			fh.seek(hdr[9] + hdr[10], 1)
+			if hdr[3] == zipfile.ZIP_STORED:
+				data = fh.read(length)
+			else:
+				d = zlib.decompressobj(-15)
+				data = b""
+				while len(data) < length:
+					chunk = fh.read(65536)
+					if not chunk:
+						break
+					data += d.decompress(chunk, length - len(data))
+				data = data[:length]
+		else:
+			d = SINKS[format].decompressor()
+			data = b""
+			end = offset + length
+			while len(data) < end and not d.eof:
+				chunk = fh.read(65536)
+				if not chunk:
+					break
+				data += d.decompress(chunk)
+			data = data[offset:end]
+	return data.decode('utf-8')
+
+class SinkIndex(object):
+	"""The index written with a sink, to read records from it by id"""
+
+	def __init__(self, filename, datafile=""):
+		self.entries = {}
+		with codecs.open(filename, 'r', 'utf-8') as fh:
+			header = fh.readline().rstrip("\n").split("\t")
+			if header[0] != INDEX_HEADER:
+				raise ConfigurationError("%s is not a sink index" % filename)
+			self.format = header[1]
+			self.datafile = datafile or os.path.join(os.path.dirname(filename), header[2])
+			for l in fh:
+				if not l.endswith("\n"):
+					# cut short while being appended to
+					break
+				(ident, block, offset, length) = l[:-1].split("\t")
+				self.entries[ident] = (int(block), int(offset), int(length))
+
+	def __len__(self):
+		return len(self.entries)
+
+	def __contains__(self, ident):
+		return ident in self.entries
+
+	def __iter__(self):
+		return iter(self.entries)
+
+	def get(self, ident):
+		return self.entries.get(ident)
+
+	def read(self, ident):
+		"""The JSON text of the record with id ident"""
+		return read_record(self.datafile, self.format, self.entries[ident])
+
+class Bundle(object):
+	"""Read records by id from a bundle written by factory.toBundle(), with
+	the data file mapped into memory. get() returns a memoryview of the
+	record's JSON without copying it, which has to be released (or
+	garbage collected) before close(). Records appended after the bundle
+	is opened aren't seen until it's opened again."""
+
+	def __init__(self, filename, index=""):
+		self.filename = filename
+		self.index = SinkIndex(index or filename + ".idx", filename)
+		if self.index.format != "jsonl":
+			raise ConfigurationError("%s is not a bundle" % filename)
+		self.fh = open(filename, 'rb')
+		size = os.fstat(self.fh.fileno()).st_size
+		if size:
+			self.map = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+			self.buffer = memoryview(self.map)
+		else:
+			# Empty files can't be mapped
+			self.map = None
+			self.buffer = memoryview(b"")
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.close()
+
+	def __len__(self):
+		return len(self.index)
+
+	def __contains__(self, ident):
+		return ident in self.index
+
+	def __iter__(self):
+		return iter(self.index)
+
+	def get(self, ident):
+		"""The JSON of the record with id ident, as a memoryview of UTF-8"""
+		(block, offset, length) = self.index.entries[ident]
+		if block + length > len(self.buffer):
+			raise KeyError("%s is past the end of %s" % (ident, self.filename))
+		return self.buffer[block:block + length]
+
+	def read(self, ident):
+		"""The JSON text of the record with id ident"""
+		return self.get(ident).tobytes().decode('utf-8')
+
+	def close(self):
+		self.buffer.release()
+		if self.map is not None:
+			self.map.close()
+		self.fh.close()
+
+BULK_ACTIONS = ["index", "create"]
+# Elasticsearch's default http.max_content_length is 100MB, but recommends
+# requests of a few MB
+BULK_MAX_COUNT = 500
+BULK_MAX_BYTES = 5 * 1024 * 1024
+
+def bulk_chunks(factory, resources, index="", action="index", max_count=BULK_MAX_COUNT, max_bytes=BULK_MAX_BYTES):
+	"""Yield _bulk request bodies (UTF-8 NDJSON) of no more than max_count
+	records or max_bytes bytes, unless a single record is bigger. Each
+	record's action has its id as the _id, and index as the _index if given
+	"""
+	if not action in BULK_ACTIONS:
+		raise ConfigurationError("Unknown bulk action %s, use one of %s" % (action, ", ".join(BULK_ACTIONS)))
+	if max_count < 1 or max_bytes < 1:
+		raise ConfigurationError("Bulk chunks must have room for at least one record")
+	# Checked now rather than when the chunks are first asked for
+	return _bulk_chunks(factory, resources, index, action, max_count, max_bytes)
+
+def _bulk_chunks(factory, resources, index, action, max_count, max_bytes):
+	chunk = []
+	size = 0
+	for what in resources:
+		meta = {}
+		if index:
+			meta["_index"] = index
+		if what.id:
+			meta["_id"] = what.id
+		pair = ("%s\n%s\n" % (factory.json_dumps({action: meta}), factory.toString(what))).encode('utf-8')
+		if chunk and (len(chunk) >= max_count or size + len(pair) > max_bytes):
+			yield b"".join(chunk)
+			chunk = []
+			size = 0
+		chunk.append(pair)
+		size += len(pair)
+	if chunk:
+		yield b"".join(chunk)
+
+def bulk_files(factory, resources, filename, **kw):
+	"""Write each bulk_chunks body to filename % its number, from 0"""
+	if not "%" in filename:
+		raise ConfigurationError("The bulk file name needs a %%d for the chunk number, eg bulk-%%05d.ndjson")
+	filenames = []
+	for (n, body) in enumerate(bulk_chunks(factory, resources, **kw)):
+		fn = filename % n
+		with open(fn, 'wb') as fh:
+			fh.write(body)
+		filenames.append(fn)
+	return filenames
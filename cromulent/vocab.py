@@ -12,7 +12,9 @@ from .model import Identifier, Mark, HumanMadeObject, Type, \
 	PropositionalObject, Payment, Creation, Phase, Period, \
 	Production, Event, DigitalObject, TransferOfCustody, \
 	Move, DigitalService, CRMEntity, \
-	STR_TYPES, factory, ExternalResource
+	STR_TYPES, factory, ExternalResource, COMPACT_STORAGE, \
+	rebuild_property_tables
+from . import model as _model
 
 # Add classified_as initialization hack for all resources
 def post_init(self, **kw):
@@ -30,7 +32,7 @@ def register_vocab_class(name, data):
 	label = data['label']
 	vocab = data.get('vocab', 'aat')
 
-	c = type(name, (parent,), {})
+	c = type(name, (parent,), {'__slots__': ()})
 	if id.startswith('http'):
 		t = Type(id)
 	else:
@@ -41,9 +43,49 @@ def register_vocab_class(name, data):
 	if "metatype" in data:
 		t.classified_as = instances[data['metatype']]
 	c._type = None # To avoid conflicting with parent class
+	if name in globals() and _vocab_class_index is not None:
+		# replacing a class, which might have been in the index
+		clear_vocab_class_index()
 	globals()[name] = c	
+	if _vocab_class_index is not None:
+		_index_vocab_class(name, c)
 	return c
 
+# The vocab classes by (name of the model class, classification id), for the
+# Reader to find the most specific class for a record. Built on first use,
+# and kept up to date by register_vocab_class
+_vocab_class_index = None
+_vocab_class_names = {}
+
+def _index_vocab_class(name, what):
+	# As the Reader used to: capitalised names that aren't model classes,
+	# and the last name in sorted order wins if two have the same key
+	if not name[0].isupper() or hasattr(_model, name) or type(what) != type:
+		return
+	try:
+		key = (what._classhier[0].__name__, what._classification[0].id)
+	except (AttributeError, IndexError, TypeError):
+		return
+	if name >= _vocab_class_names.get(key, ""):
+		_vocab_class_names[key] = name
+		_vocab_class_index[key] = what
+
+def vocab_class_index():
+	"""The (model class name, classification id) -> vocab class index"""
+	global _vocab_class_index
+	if _vocab_class_index is None:
+		_vocab_class_index = {}
+		_vocab_class_names.clear()
+		for (name, what) in list(globals().items()):
+			_index_vocab_class(name, what)
+	return _vocab_class_index
+
+def clear_vocab_class_index():
+	"""Rebuild the index when it's next used, eg after adding classes to
+	this module other than with register_vocab_class"""
+	global _vocab_class_index
+	_vocab_class_index = None
+
 def register_aat_class(name, data):
 	data['vocab'] = 'aat'
 	register_vocab_class(name, data)
@@ -713,7 +755,7 @@ def conceptual_only_parts():
 		elif what == "part_of":
 			return self.c_part_of
 		else:
-			object.__getattr__(self, what)
+			return super(Right, self).__getattr__(what)
 
 	Right.set_part = set_c_part
 	Right.set_part_of = set_c_part_of
@@ -721,6 +763,7 @@ def conceptual_only_parts():
 	Right._property_name_map['c_part_of'] = 'part_of'
 	Right._all_properties['part'] = PropositionalObject._all_properties['c_part']
 	Right._all_properties['part_of'] = PropositionalObject._all_properties['c_part_of']
+	rebuild_property_tables()
 	Right.__getattr__ = rights_getter
 
 
@@ -765,7 +808,7 @@ def add_attribute_assignment_check():
 			value = [*current, value]
 		elif type(value) is not list:
 			value = [value]
-		object.__setattr__(self, ass, value)
+		self._store(ass, value)
 	setattr(AttributeAssignment, "set_%s" % ass, aa_set_assigned)
 
 	def aa_set_assigned_to(self, value):
@@ -775,7 +818,7 @@ def add_attribute_assignment_check():
 			# unmap the URI to property name
 			for ar in ass_res:
 				value._check_prop(p177_res, ar)
-		object.__setattr__(self, assto, value)
+		self._store(assto, value)
 	setattr(AttributeAssignment, "set_%s" % assto, aa_set_assigned_to)
 
 	def aa_set_assigned_property_type(self, value):
@@ -784,13 +827,13 @@ def add_attribute_assignment_check():
 		if ass_res and assto_res:
 			for ar in ass_res:
 				assto_res._check_prop(value, ar)
-		object.__setattr__(self, p177, value)
+		self._store(p177, value)
 	setattr(AttributeAssignment, "set_%s" % p177, aa_set_assigned_property_type)
 
 
 	def phase_set_relationship(self, value):
 		# XXX do same checking as above
-		object.__setattr__(self, phase_rel, value)
+		self._store(phase_rel, value)
 	setattr(Phase, "set_%s" % phase_rel, phase_set_relationship)		
 
 def add_linked_art_boundary_check():
@@ -810,7 +853,24 @@ def add_linked_art_boundary_check():
 	# Activity, AttributeAssignment, InformationObject, TransferOfCustody, Move
 	# Propositional Object
 
-	ExternalResource._embed_override = None
+	if COMPACT_STORAGE:
+		ExternalResource._compact_defaults['_embed_override'] = None
+	else:
+		ExternalResource._embed_override = None
+
+	boundary_classes = set(boundary_classes)
+	embed_classes = set(embed_classes)
+	boundary_crossing_props = set([
+		"part_of", 'member_of', "specific_purpose", "caused_by",
+		"starts_before_the_end_of",
+		"ends_after_the_start_of",
+		"starts_before_the_start_of",
+		"starts_after_the_start_of",
+		"ends_before_the_start_of",
+		"starts_after_the_end_of",
+		"ends_before_the_end_of",
+		"ends_after_the_end_of",
+	])
 
 	def my_linked_art_boundary_check(self, top, rel, value):
 		# True = Embed ; False = Split
@@ -825,18 +885,6 @@ def add_linked_art_boundary_check():
 		elif isinstance(value, ProvenanceEntry):
 			return False
 
-		boundary_crossing_props = set([
-			"part_of", 'member_of', "specific_purpose", "caused_by",
-			"starts_before_the_end_of",
-			"ends_after_the_start_of",
-			"starts_before_the_start_of",
-			"starts_after_the_start_of",
-			"ends_before_the_start_of",
-			"starts_after_the_end_of",
-			"ends_before_the_end_of",
-			"ends_after_the_end_of",
-		])
-		
 		if rel in ["part", "member", "specific_purpose_of", "caused"]:
 			# Downwards, internal simple partitioning 
 			# This catches an internal part to a LinguisticObject
@@ -844,10 +892,15 @@ def add_linked_art_boundary_check():
 		elif rel in boundary_crossing_props:
 			# upwards partition refs are inclusion, and always boundary crossing
 			return False
-		elif value.type in boundary_classes:
+		typ = value.type
+		if type(typ) is list:
+			# Multiple instantiation classes, eg DestructionActivity, have
+			# a list of types, which is in neither set
+			return True
+		elif typ in boundary_classes:
 			# This catches the external text LinguisticObject
 			return False
-		elif value.type in embed_classes:
+		elif typ in embed_classes:
 			return True
 		else:
 			# Default to embedding to avoid data loss
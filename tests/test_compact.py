@@ -0,0 +1,85 @@
+import unittest
+import os
+import sys
+import subprocess
+
+# Compact storage is fixed when the model is imported, so build the same
+# graph in a fresh interpreter with and without it and compare
+
+script = """
+import pickle
+from cromulent import model, vocab, reader
+model.factory.auto_assign_id = False
+what = vocab.Painting(ident="http://example.org/1", label="Painting", art=1)
+what.identified_by = vocab.PrimaryName(content="Example")
+what.identified_by = vocab.AccessionNumber(content="1")
+h = vocab.Height(value=6)
+h.unit = vocab.instances['inches']
+what.dimension = h
+prod = model.Production()
+prod.carried_out_by = model.Person(ident="http://example.org/p", label="Artist")
+ts = model.TimeSpan()
+ts.begin_of_the_begin = "1800-01-01T00:00:00Z"
+ts._label = "1800"
+prod.timespan = ts
+what.produced_by = prod
+print(hasattr(what, '__dict__'))
+print(sorted(what.list_my_props()))
+print(model.factory.toString(what))
+print(model.factory.toString(reader.Reader(trusted=True).read(model.factory.toString(what))))
+print(model.factory.toString(pickle.loads(pickle.dumps(what))))
+model.factory.json_serializer = "fast"
+print(model.factory.toString(what))
+"""
+
+# write_many pickles the resources to send them to its workers
+write_many_script = """
+import os
+import shutil
+import tempfile
+from cromulent import model, vocab
+model.factory.auto_assign_id = False
+recs = []
+for i in range(5):
+	what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+	what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+	t = model.Type(ident="http://example.org/type/%s" % i, label="Type")
+	t.classified_as = vocab.instances['brief text']
+	what.classified_as = t
+	recs.append(what)
+tmpdir = tempfile.mkdtemp()
+try:
+	model.factory.base_dir = tmpdir
+	result = model.factory.write_many(recs, workers=2, batch_size=2)
+	print("%s %s" % (result.written, result.errors))
+	for what in recs:
+		with open(model.factory.get_filename(what.id)) as fh:
+			print(fh.read() == model.factory.toString(what))
+finally:
+	shutil.rmtree(tmpdir)
+"""
+
+def run_script(compact, script=script):
+	env = dict(os.environ)
+	env['CROMULENT_COMPACT_STORAGE'] = "1" if compact else ""
+	root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+	env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+	out = subprocess.check_output([sys.executable, '-c', script], env=env)
+	return out.decode('utf-8').splitlines()
+
+class TestCompactStorage(unittest.TestCase):
+
+	def test_same_output(self):
+		normal = run_script(False)
+		compact = run_script(True)
+		self.assertEqual(normal[0], "True")
+		self.assertEqual(compact[0], "False")
+		self.assertEqual(normal[1:], compact[1:])
+		# reading it back in trusted mode gives the same resources
+		self.assertEqual(compact[3], compact[2])
+		# and so does pickling it, eg to send it to another process
+		self.assertEqual(compact[4], compact[2])
+
+	def test_write_many(self):
+		out = run_script(True, write_many_script)
+		self.assertEqual(out, ["5 []"] + ["True"] * 5)
@@ -0,0 +1,40 @@
+import unittest
+import os
+import sys
+import subprocess
+
+# pyld and rdflib should only be imported when RDF is asked for, which
+# needs a fresh interpreter to check
+
+script = """
+import sys
+from cromulent import model, vocab
+print('pyld' in sys.modules, 'rdflib' in sys.modules)
+what = vocab.Painting(ident="http://example.org/1", label="Painting")
+model.factory.toString(what)
+print('pyld' in sys.modules, 'rdflib' in sys.modules)
+model.factory.rdf_serializer = "native"
+nq = model.factory.toRDF(what, format="nq")
+print('pyld' in sys.modules, 'rdflib' in sys.modules)
+model.factory.rdf_serializer = "pyld"
+nq = model.factory.toRDF(what, format="nq")
+print('pyld' in sys.modules, 'rdflib' in sys.modules)
+print(model.pyld_proc is model.get_pyld_processor())
+print("<http://example.org/1>" in nq)
+"""
+
+class TestLazyImport(unittest.TestCase):
+
+	def test_deferred_dependencies(self):
+		env = dict(os.environ)
+		root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+		env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+		out = subprocess.check_output([sys.executable, '-c', script], env=env)
+		lines = out.decode('utf-8').splitlines()
+		self.assertEqual(lines[0], "False False")
+		self.assertEqual(lines[1], "False False")
+		# N-Quads are written natively, so don't need pyld either
+		self.assertEqual(lines[2], "False False")
+		self.assertEqual(lines[3], "True False")
+		self.assertEqual(lines[4], "True")
+		self.assertEqual(lines[5], "True")
@@ -2,8 +2,11 @@ import unittest
 import sys
 import os
 import shutil
+import io
 import json
 import pickle
+import hashlib
+import datetime
 from collections import OrderedDict
 from cromulent import model, vocab
 from cromulent.model import override_okay
@@ -55,6 +58,13 @@ class TestFactorySetup(unittest.TestCase):
 		newfac = pickle.loads(srlz)
 		self.assertTrue(model.factory.log_stream is newfac.log_stream)
 
+	def test_pickle_resource(self):
+		p = model.Person(label="Person")
+		p.identified_by = model.Name(content="Name")
+		p2 = pickle.loads(pickle.dumps(p))
+		self.assertTrue(p2._factory is model.factory)
+		self.assertEqual(model.factory.toJSON(p2), model.factory.toJSON(p))
+
 
 
 class TestFactorySerialization(unittest.TestCase):
@@ -132,6 +142,610 @@ class TestFactorySerialization(unittest.TestCase):
 		# Tidy up
 		shutil.rmtree('tests/InformationObject')
 
+	def _stream_graph(self):
+		x = model.TransferOfCustody()
+		e = model.Activity()
+		fr = model.Group()
+		to = model.Group()
+		w = model.HumanMadeObject()
+		fr._label = "From"
+		to._label = "To é"
+		x.transferred_custody_of = w
+		x.transferred_custody_from = fr
+		x.transferred_custody_to = to
+		e.used_specific_object = w
+		e.carried_out_by = to
+		w.current_owner = fr
+		w.identified_by = model.Name(content="Object")
+		x.specific_purpose = e
+		return x
+
+	def test_toStream(self):
+		x = self._stream_graph()
+		for compact in [True, False]:
+			strm = io.StringIO()
+			model.factory.toStream(x, strm, compact=compact, flush_every=3)
+			self.assertEqual(strm.getvalue(), model.factory.toString(x, compact=compact))
+
+	def test_toStream_settings(self):
+		x = self._stream_graph()
+		try:
+			for srlz in ["normal", "fast"]:
+				model.factory.json_serializer = srlz
+				for itl in [True, False]:
+					model.factory.id_type_label = itl
+					strm = io.StringIO()
+					model.factory.toStream(x, strm)
+					self.assertEqual(strm.getvalue(), model.factory.toString(x))
+			# full_names reorders the keys, so children can't be deferred
+			model.factory.json_serializer = "normal"
+			model.factory.full_names = True
+			strm = io.StringIO()
+			model.factory.toStream(x, strm, compact=False)
+			self.assertEqual(strm.getvalue(), model.factory.toString(x, compact=False))
+		finally:
+			model.factory.json_serializer = "normal"
+			model.factory.id_type_label = True
+			model.factory.full_names = False
+
+	def test_toString_compiled(self):
+		x = self._stream_graph()
+		x.referred_to_by = model.LinguisticObject(content="Note\n")
+		x.timespan = model.TimeSpan()
+		x.timespan.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		try:
+			for itl in [True, False]:
+				model.factory.id_type_label = itl
+				for compact in [True, False]:
+					model.factory.json_serializer = "fast"
+					expect = model.factory.toString(x, compact=compact)
+					model.factory.json_serializer = "compiled"
+					outs = model.factory.toString(x, compact=compact)
+					self.assertEqual(expect, outs)
+			# toJSON still returns the dicts
+			self.assertEqual(model.factory.toJSON(x)['type'], 'TransferOfCustody')
+		finally:
+			model.factory.json_serializer = "normal"
+			model.factory.id_type_label = True
+
+	def test_compiled_plans(self):
+		model.factory.json_serializer = "compiled"
+		koh = model.factory.key_order_hash['identified_by']
+		try:
+			self.collection._comment = "Not serialized"
+			outs = model.factory.toString(self.collection)
+			self.assertTrue(model.InformationObject in model.factory._emit_plans)
+			self.assertFalse('_comment' in outs)
+			# changes to the settings in the plans are noticed
+			model.factory.underscore_properties.append("_comment")
+			self.assertTrue('"_comment":"Not serialized"' in model.factory.toString(self.collection))
+			model.factory.underscore_properties.remove("_comment")
+			self.assertFalse('_comment' in model.factory.toString(self.collection))
+			what = model.HumanMadeObject(label="Object")
+			what.identified_by = model.Name(content="Name")
+			what.referred_to_by = model.LinguisticObject(content="Note")
+			expect = model.factory.toString(what)
+			model.factory.key_order_hash['identified_by'] = 100000
+			outs = model.factory.toString(what)
+			self.assertTrue(expect.index("identified_by") < expect.index("referred_to_by"))
+			self.assertTrue(outs.index("referred_to_by") < outs.index("identified_by"))
+			model.factory.json_serializer = "normal"
+			self.assertEqual(model.factory.toString(what), outs)
+		finally:
+			if "_comment" in model.factory.underscore_properties:
+				model.factory.underscore_properties.remove("_comment")
+			model.factory.key_order_hash['identified_by'] = koh
+			model.factory.json_serializer = "normal"
+
+	@unittest.skipUnless(model.get_orjson(), "orjson is not installed")
+	def test_json_backend(self):
+		x = self._stream_graph()
+		x.referred_to_by = model.LinguisticObject(content="Note\n \x01")
+		expect = [model.factory.toString(x), model.factory.toString(x, compact=False)]
+		try:
+			for backend in ["orjson", "auto"]:
+				model.factory.json_backend = backend
+				self.assertEqual(expect, [model.factory.toString(x), model.factory.toString(x, compact=False)])
+			# orjson can only indent by 2, and falls back to json for anything it can't do
+			model.factory.json_indent = 4
+			self.assertEqual(model.factory.json_dumps({'a': [1]}, False), '{\n    "a": [\n        1\n    ]\n}')
+			self.assertEqual(model.factory.json_dumps({1: 2}), '{"1":2}')
+			self.assertEqual(model.factory.json_loads('{"a":[1,"é"]}'), {"a": [1, "é"]})
+		finally:
+			model.factory.json_backend = "json"
+			model.factory.json_indent = 2
+
+	@unittest.skipUnless(model.get_orjson(), "orjson is not installed")
+	def test_json_backend_same(self):
+		values = [{"a": [1, -0.0, 0.1, 1e16, 1.5e-7, 2**64, -2**70, None, True]},
+			# orjson writes these as decimals, with no e to notice
+			{"d": [2.5e-05, -9.99e-05, 0.0001]},
+			{"n": float('nan'), "i": [float('inf'), float('-inf')]},
+			{"s": ["é", "\u2028", "Note\n \x01", "null", "1e16", "12345678901234567890"]},
+			[], {}, "", 12345678901234567890123]
+		texts = ['{"a":123456789012345678901234567890}', '[NaN,Infinity,-Infinity]',
+			'{"a":1e400}', '"\\ud800"', b'{"a":[1,"\xc3\xa9"]}', '[1.0,0.5,-0]']
+		try:
+			for backend in ["json", "orjson"]:
+				model.factory.json_backend = backend
+				dumped = [(model.factory.json_dumps(v), model.factory.json_dumps(v, False)) for v in values]
+				loaded = [repr(model.factory.json_loads(t)) for t in texts]
+				loaded.append(repr(model.factory.json_loads(memoryview(b'[NaN]'))))
+				self.assertRaises(TypeError, model.factory.json_dumps, {"d": datetime.datetime(2020, 1, 1)})
+				self.assertRaises(ValueError, model.factory.json_loads, '{"a":')
+				if backend == "json":
+					expect = (dumped, loaded)
+			self.assertEqual(expect, (dumped, loaded))
+		finally:
+			model.factory.json_backend = "json"
+
+	def test_json_backend_missing(self):
+		orjson = model._orjson
+		model._orjson = None
+		try:
+			model.factory.json_backend = "auto"
+			self.assertEqual(model.factory.json_dumps({'a': 'é'}), '{"a":"é"}')
+			model.factory.json_backend = "orjson"
+			self.assertRaises(model.ConfigurationError, model.factory.json_dumps, {})
+		finally:
+			model._orjson = orjson
+			model.factory.json_backend = "json"
+
+	def test_cache_json(self):
+		x = self._stream_graph()
+		model.factory.cache_json = True
+		try:
+			js = model.factory.toJSON(x)
+			expect = model.factory.toString(x)
+			# not changed, so the same fragment is reused
+			js2 = model.factory.toJSON(x)
+			self.assertTrue(js['transferred_custody_of'][0] is js2['transferred_custody_of'][0])
+			self.assertEqual(model.factory.toString(x), expect)
+			# changing a descendant changes its ancestors
+			w = x.transferred_custody_of[0]
+			w.identified_by[0].content = "Changed"
+			js3 = model.factory.toJSON(x)
+			self.assertFalse(js['transferred_custody_of'][0] is js3['transferred_custody_of'][0])
+			self.assertEqual(js3['transferred_custody_of'][0]['identified_by'][0]['content'], "Changed")
+			self.assertTrue(js['transferred_custody_to'][0] is js3['transferred_custody_to'][0])
+			# Serializing from another resource gives the same as without the cache
+			e = x.specific_purpose[0]
+			outs = model.factory.toString(e)
+			model.factory.cache_json = False
+			self.assertEqual(outs, model.factory.toString(e))
+			model.factory.cache_json = True
+			# a different setting doesn't reuse
+			model.factory.json_serializer = "fast"
+			js4 = model.factory.toJSON(x)
+			self.assertFalse(js3['transferred_custody_to'][0] is js4['transferred_custody_to'][0])
+			model.factory.clear_json_cache()
+			js5 = model.factory.toJSON(x)
+			self.assertFalse(js4['transferred_custody_to'][0] is js5['transferred_custody_to'][0])
+		finally:
+			model.factory.cache_json = False
+			model.factory.json_serializer = "normal"
+
+	def test_cache_json_done(self):
+		# A cached resource that is already done elsewhere is just referenced
+		p = model.Person(label="Person")
+		p.identified_by = model.Name(content="Name")
+		a = model.Activity(label="Activity")
+		a.carried_out_by = p
+		g = model.Group(label="Group")
+		model.factory.cache_json = True
+		try:
+			js = model.factory.toJSON(a)
+			self.assertTrue('identified_by' in js['carried_out_by'][0])
+			g.member = p
+			g.carried_out = a
+			js = model.factory.toJSON(g)
+			model.factory.cache_json = False
+			self.assertEqual(js, model.factory.toJSON(g))
+		finally:
+			model.factory.cache_json = False
+
+	def test_cache_json_threads(self):
+		# The cache key of a toJSON in progress is only seen by its own thread
+		import threading
+		x = self._stream_graph()
+		seen = []
+		def other():
+			seen.append(model.factory._serializing.json_cache_key)
+			seen.append(model.factory.toString(x))
+		orig = model.BaseResource._toJSON
+		def hooked(what, *args, **kw):
+			if not seen:
+				t = threading.Thread(target=other)
+				t.start()
+				t.join()
+				seen.append(model.factory._serializing.json_cache_key)
+			return orig(what, *args, **kw)
+		model.factory.cache_json = True
+		try:
+			expect = model.factory.toString(x)
+			model.BaseResource._toJSON = hooked
+			self.assertEqual(model.factory.toString(x), expect)
+		finally:
+			model.BaseResource._toJSON = orig
+			model.factory.cache_json = False
+		self.assertEqual(seen[0], None)
+		self.assertEqual(seen[1], expect)
+		# the other thread finishing didn't clear this one's
+		self.assertNotEqual(seen[2], None)
+		self.assertEqual(model.factory._serializing.json_cache_key, None)
+
+	def _rdf_graph(self):
+		what = vocab.Painting(ident="http://example.org/object/1", label="Painting \"1\"", art=1)
+		what.identified_by = vocab.PrimaryName(ident="", content="Line 1\nLine 2")
+		h = vocab.Height(ident="", value=6.5)
+		h.unit = vocab.instances['inches']
+		what.dimension = h
+		what.dimension = vocab.Width(value=10)
+		prod = model.Production(ident="")
+		prod.carried_out_by = model.Person(label="Artist")
+		what.produced_by = prod
+		what.member_of = model.Set(label="Collection")
+		return what
+
+	def _native_rdf(self, what, **kw):
+		# toRDFStream always writes natively
+		oldrdf = model.factory.rdf_serializer
+		model.factory.rdf_serializer = "native"
+		try:
+			return model.factory.toRDF(what, **kw)
+		finally:
+			model.factory.rdf_serializer = oldrdf
+
+	def test_toRDF_native(self):
+		from rdflib import Graph
+		from rdflib.compare import isomorphic
+		what = self._rdf_graph()
+		oldrdf = model.factory.rdf_serializer
+		try:
+			model.factory.rdf_serializer = "pyld"
+			pyld_nt = model.factory.toRDF(what, format="nt")
+			model.factory.rdf_serializer = "native"
+			nt = model.factory.toRDF(what, format="nt")
+			g1 = Graph()
+			g1.parse(data=pyld_nt, format="nt")
+			g2 = Graph()
+			g2.parse(data=nt, format="nt")
+			self.assertTrue(isomorphic(g1, g2))
+			self.assertEqual(len(pyld_nt.splitlines()), len(nt.splitlines()))
+			self.assertTrue('"6.5E0"^^<http://www.w3.org/2001/XMLSchema#double>' in nt)
+			self.assertTrue('"10"^^<http://www.w3.org/2001/XMLSchema#integer>' in nt)
+
+			# Quads are in the graph of the top resource, blank nodes
+			# are numbered in the order they're reached
+			nq = model.factory.toRDF(what, format="nq")
+			for l in nq.splitlines():
+				self.assertTrue(l.endswith(" <http://example.org/object/1> ."))
+			self.assertEqual(nq, model.factory.toRDF(what, format="nq"))
+			self.assertTrue("_:b0 " in nq)
+			nq = model.factory.toRDF(what, format="nq", bnode_prefix="x")
+			self.assertTrue("_:bx_0 " in nq)
+			self.assertFalse("_:b0 " in nq)
+		finally:
+			model.factory.rdf_serializer = oldrdf
+
+	def test_toRDF_plans(self):
+		what = model.HumanMadeObject(ident="http://example.org/object/1", label="Object")
+		what._comment = "Comment"
+		comment = '<http://www.w3.org/2000/01/rdf-schema#comment> "Comment"'
+		oldrdf = model.factory.rdf_serializer
+		model.HumanMadeObject._predicate_table['_comment'] = "rdfs:comment"
+		model.factory.rdf_serializer = "native"
+		try:
+			self.assertFalse(comment in model.factory.toRDF(what, format="nt"))
+			# changes to underscore_properties are noticed, as for compiled
+			model.factory.underscore_properties.append("_comment")
+			self.assertTrue(comment in model.factory.toRDF(what, format="nt"))
+			self.assertEqual(len(model.factory.toGraph(what)), 3)
+		finally:
+			if "_comment" in model.factory.underscore_properties:
+				model.factory.underscore_properties.remove("_comment")
+			del model.HumanMadeObject._predicate_table['_comment']
+			model.factory.rdf_serializer = oldrdf
+			model.factory.reset_compiled_plans()
+
+	def test_toGraph(self):
+		from rdflib import Graph, Dataset, URIRef
+		from rdflib.compare import isomorphic
+		what = self._rdf_graph()
+		g = model.factory.toGraph(what)
+		g2 = Graph()
+		g2.parse(data=model.factory.toRDF(what, format="nt"), format="nt")
+		self.assertTrue(isomorphic(g, g2))
+		ttl = model.factory.toRDF(what, format="turtle")
+		self.assertTrue("crm:E22_Human-Made_Object" in ttl)
+
+		# Records accumulate in the graph given, each in its own named graph
+		# for a Dataset
+		other = vocab.Painting(ident="http://example.org/object/2", label="Painting 2")
+		ds = Dataset()
+		model.factory.toGraph(what, ds)
+		self.assertTrue(model.factory.toGraph(other, ds) is ds)
+		self.assertEqual(len(ds.graph(URIRef("http://example.org/object/1"))), len(g))
+		self.assertTrue(len(ds.graph(URIRef("http://example.org/object/2"))) > 0)
+		g3 = Graph()
+		model.factory.toGraph(what, g3)
+		model.factory.toGraph(other, g3)
+		self.assertEqual(len(g3), len(ds))
+
+	def test_toRDFStream(self):
+		what = self._rdf_graph()
+		other = vocab.Painting(ident="http://example.org/object/2", label="Painting 2")
+		out = io.StringIO()
+		self.assertEqual(model.factory.toRDFStream([what, other], out), 2)
+		nq = out.getvalue()
+		self.assertEqual(nq, self._native_rdf(what) + self._native_rdf(other))
+
+		# Blank nodes carry on being numbered in the next record
+		bnodes = set(l.split()[0] for l in nq.splitlines() if l.startswith("_:"))
+		out = io.StringIO()
+		model.factory.toRDFStream([what, what], out, format="nt")
+		nt = self._native_rdf(what, format="nt")
+		self.assertTrue(out.getvalue().startswith(nt))
+		lines = out.getvalue().splitlines()
+		later = set(l.split()[0] for l in lines[len(lines)//2:] if l.startswith("_:"))
+		self.assertEqual(len(later), len(bnodes))
+		self.assertFalse(later & bnodes)
+
+		out = io.StringIO()
+		model.factory.toRDFStream([what, other], out, graph=lambda x: "http://example.org/graph")
+		for l in out.getvalue().splitlines():
+			self.assertTrue(l.endswith(" <http://example.org/graph> ."))
+		self.assertRaises(model.ConfigurationError, model.factory.toRDFStream, [what], out, format="turtle")
+		self.assertRaises(model.ConfigurationError, model.factory.toRDFStream, [what], out, graph="other")
+
+	def test_toRDFFile(self):
+		import gzip
+		import tempfile
+		what = self._rdf_graph()
+		tmpdir = tempfile.mkdtemp()
+		try:
+			fn = os.path.join(tmpdir, "dump.nq.gz")
+			model.factory.toRDFFile([what], fn)
+			with gzip.open(fn, 'rt', encoding='utf-8') as fh:
+				self.assertEqual(fh.read(), self._native_rdf(what))
+			fn = os.path.join(tmpdir, "dump.nt")
+			model.factory.toRDFFile([what], fn, format="nt")
+			with open(fn, encoding='utf-8') as fh:
+				self.assertEqual(fh.read(), self._native_rdf(what, format="nt"))
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_write_many(self):
+		import tempfile
+		recs = [model.HumanMadeObject(ident="object/%s" % i, label="Object %s" % i) for i in range(7)]
+		recs[0].identified_by = model.Name(content="Object 0")
+		recs.insert(3, model.Person(ident="http://example.org/elsewhere"))
+		olddir = model.factory.base_dir
+		tmpdir = tempfile.mkdtemp()
+		try:
+			model.factory.base_dir = tmpdir
+			for workers in [None, 2]:
+				result = model.factory.write_many(iter(recs), workers=workers, batch_size=2, max_pending=1, compact=False)
+				self.assertEqual(result.written, 7)
+				self.assertEqual(len(result.errors), 1)
+				self.assertEqual(result.errors[0][0], "http://example.org/elsewhere")
+				self.assertTrue(result.errors[0][1].startswith("ConfigurationError"))
+				fn = os.path.join(tmpdir, "HumanMadeObject", "object", "0.json")
+				with open(fn) as fh:
+					self.assertEqual(fh.read(), model.factory.toString(recs[0], compact=False))
+				shutil.rmtree(os.path.join(tmpdir, "HumanMadeObject"))
+		finally:
+			model.factory.base_dir = olddir
+			shutil.rmtree(tmpdir)
+
+	def test_bulk_output(self):
+		import tempfile
+		from unittest import mock
+		recs = [model.HumanMadeObject(ident="object/ab%s" % i, label="Object %s" % i) for i in range(5)]
+		olddir = model.factory.base_dir
+		tmpdir = tempfile.mkdtemp()
+		model.factory.pair_tree_levels = 1
+		try:
+			model.factory.base_dir = tmpdir
+			model.factory.get_filename(recs[0].id)
+			with mock.patch('os.makedirs', wraps=os.makedirs) as makedirs:
+				for r in recs:
+					model.factory.get_filename(r.id)
+				self.assertEqual(makedirs.call_count, 0)
+			for atomic in [False, True]:
+				model.factory.atomic_writes = atomic
+				with model.factory.bulk_output(max_handles=1):
+					for r in recs:
+						model.factory.toFile(r, compact=False)
+					# directories removed after they were made are made again
+					shutil.rmtree(os.path.join(tmpdir, "HumanMadeObject"))
+					for r in recs:
+						model.factory.toFile(r, compact=False)
+				self.assertIsNone(model.factory._dir_handles)
+				mydir = os.path.join(tmpdir, "HumanMadeObject", "object", "ab")
+				self.assertEqual(sorted(os.listdir(mydir)), ["ab%s.json" % i for i in range(5)])
+				with open(os.path.join(mydir, "ab0.json")) as fh:
+					self.assertEqual(fh.read(), model.factory.toString(recs[0], compact=False))
+		finally:
+			model.factory.atomic_writes = False
+			model.factory.pair_tree_levels = 0
+			model.factory.base_dir = olddir
+			model.factory.clear_dir_cache()
+			shutil.rmtree(tmpdir)
+
+	def test_skip_unchanged(self):
+		import tempfile
+		recs = [model.HumanMadeObject(ident="object/%s" % i, label="Object %s" % i) for i in range(5)]
+		olddir = model.factory.base_dir
+		tmpdir = tempfile.mkdtemp()
+		try:
+			model.factory.base_dir = tmpdir
+			model.factory.skip_unchanged = True
+			model.factory.reset_write_counts()
+			for r in recs:
+				model.factory.toFile(r)
+			recs[1]._label = "Changed"
+			for r in recs:
+				model.factory.toFile(r)
+			self.assertEqual(model.factory.write_counts, {"written": 6, "skipped": 4})
+			fn = model.factory.get_filename(recs[1].id)
+			with open(fn) as fh:
+				self.assertEqual(fh.read(), model.factory.toString(recs[1]))
+
+			# The manifest is filled from the existing files, then used instead of them
+			mfn = os.path.join(tmpdir, "manifest.tsv")
+			model.factory.write_manifest = model.WriteManifest(mfn)
+			result = model.factory.write_many(recs)
+			self.assertEqual((result.written, result.skipped), (0, 5))
+			self.assertEqual(len(model.factory.write_manifest), 5)
+			model.factory.write_manifest.save()
+			model.factory.write_manifest = model.WriteManifest(mfn)
+			self.assertEqual(len(model.factory.write_manifest), 5)
+			os.remove(fn)
+			recs[2]._label = "Changed"
+			result = model.factory.write_many(recs, workers=2, batch_size=2)
+			self.assertEqual((result.written, result.skipped, result.errors), (2, 3, []))
+			self.assertTrue(os.path.exists(fn))
+			fn = model.factory.get_filename(recs[2].id)
+			self.assertEqual(model.factory.write_manifest.get(fn),
+				hashlib.sha1(model.factory.toString(recs[2]).encode('utf-8')).hexdigest())
+		finally:
+			model.factory.skip_unchanged = False
+			model.factory.write_manifest = None
+			model.factory.reset_write_counts()
+			model.factory.base_dir = olddir
+			shutil.rmtree(tmpdir)
+
+	def test_toSink(self):
+		import gzip
+		import lzma
+		import tarfile
+		import zipfile
+		import tempfile
+		from cromulent.sinks import SinkIndex
+		recs = [model.HumanMadeObject(ident="object/%s" % i, label="Object %s é" % i) for i in range(20)]
+		tmpdir = tempfile.mkdtemp()
+		try:
+			for ext in ["jsonl", "jsonl.gz", "jsonl.xz", "tar", "zip"]:
+				fn = os.path.join(tmpdir, "dump." + ext)
+				self.assertEqual(model.factory.toSink(iter(recs), fn, index=True, block_size=500), 20)
+				idx = SinkIndex(fn + ".idx")
+				self.assertEqual((idx.format, len(idx)), (ext, 20))
+				for r in [recs[0], recs[13], recs[19]]:
+					self.assertEqual(idx.read(r.id), model.factory.toString(r))
+				# and the files can be read as usual
+				if ext == "tar":
+					with tarfile.open(fn) as tf:
+						data = tf.extractfile("HumanMadeObject/object/7.json").read()
+				elif ext == "zip":
+					with zipfile.ZipFile(fn) as zf:
+						data = zf.read("HumanMadeObject/object/7.json")
+				else:
+					opener = {"jsonl": open, "jsonl.gz": gzip.open, "jsonl.xz": lzma.open}[ext]
+					with opener(fn, 'rb') as fh:
+						data = fh.read().split(b"\n")[7]
+				self.assertEqual(data.decode('utf-8'), model.factory.toString(recs[7]))
+			self.assertRaises(model.ConfigurationError, model.factory.toSink, recs, os.path.join(tmpdir, "dump.txt"))
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_toBulk(self):
+		import tempfile
+		recs = [model.HumanMadeObject(ident="object/%s" % i, label="Object %s é" % i) for i in range(7)]
+		recs.append(model.HumanMadeObject(ident=""))
+		chunks = list(model.factory.toBulk(iter(recs), index="objects", max_count=3))
+		self.assertEqual(len(chunks), 3)
+		lines = b"".join(chunks).decode('utf-8').split("\n")
+		self.assertEqual(lines[-1], "")
+		self.assertEqual(json.loads(lines[0]), {"index": {"_index": "objects", "_id": recs[0].id}})
+		self.assertEqual(lines[1], model.factory.toString(recs[0]))
+		self.assertEqual(json.loads(lines[14]), {"index": {"_index": "objects"}})
+		# a chunk always has at least one record
+		chunks = list(model.factory.toBulk(recs, action="create", max_bytes=1))
+		self.assertEqual(len(chunks), 8)
+		self.assertEqual(json.loads(chunks[0].split(b"\n")[0]), {"create": {"_id": recs[0].id}})
+		self.assertRaises(model.ConfigurationError, model.factory.toBulk, recs, action="update")
+
+		tmpdir = tempfile.mkdtemp()
+		try:
+			fns = model.factory.toBulkFiles(recs, os.path.join(tmpdir, "bulk-%03d.ndjson"), max_count=5)
+			self.assertEqual([os.path.basename(fn) for fn in fns], ["bulk-000.ndjson", "bulk-001.ndjson"])
+			with open(fns[1], 'rb') as fh:
+				self.assertEqual(fh.read().count(b"\n"), 6)
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_async_output(self):
+		import asyncio
+		import tempfile
+		recs = [model.HumanMadeObject(ident="object/%s" % i, label="Object %s" % i) for i in range(7)]
+		recs.insert(3, model.Person(ident="http://example.org/elsewhere"))
+
+		async def agen():
+			for r in recs:
+				yield r
+
+		async def run(tmpdir):
+			js = await model.factory.toStringAsync(recs[0], compact=False)
+			self.assertEqual(js, model.factory.toString(recs[0], compact=False))
+			await model.factory.toFileAsync(recs[1], compact=False)
+			fn = os.path.join(tmpdir, "HumanMadeObject", "object", "1.json")
+			with open(fn) as fh:
+				self.assertEqual(fh.read(), model.factory.toString(recs[1], compact=False))
+			for src in [recs, agen()]:
+				result = await model.factory.write_many_async(src, concurrency=2, batch_size=2)
+				self.assertEqual(result.written, 7)
+				self.assertEqual(result.errors[0][0], "http://example.org/elsewhere")
+				self.assertTrue(os.path.exists(os.path.join(tmpdir, "HumanMadeObject", "object", "6.json")))
+				shutil.rmtree(os.path.join(tmpdir, "HumanMadeObject"))
+			with self.assertRaises(model.ConfigurationError):
+				await model.factory.write_many_async(recs, concurrency=0)
+
+		olddir = model.factory.base_dir
+		tmpdir = tempfile.mkdtemp()
+		try:
+			model.factory.base_dir = tmpdir
+			asyncio.run(run(tmpdir))
+		finally:
+			model.factory.base_dir = olddir
+			shutil.rmtree(tmpdir)
+
+	def test_async_threads(self):
+		# Calls in the executor's threads don't change the factory for each other
+		import asyncio
+		import tempfile
+		recs = [model.HumanMadeObject(ident="object/%s" % i, label="Object %s" % i) for i in range(40)]
+		expect = [model.factory.toString(r) for r in recs]
+
+		async def run():
+			jobs = []
+			for r in recs:
+				jobs.append(model.factory.toStringAsync(r))
+				jobs.append(asyncio.get_running_loop().run_in_executor(None, model.factory.toRDF, r, "nt"))
+			out = await asyncio.gather(*jobs)
+			self.assertEqual(out[::2], expect)
+			return await model.factory.write_many_async(recs, concurrency=8, batch_size=1)
+
+		olddir = model.factory.base_dir
+		oldrdf = model.factory.rdf_serializer
+		tmpdir = tempfile.mkdtemp()
+		model.factory.rdf_serializer = "pyld"
+		model.factory.cache_json = True
+		try:
+			model.factory.base_dir = tmpdir
+			model.factory.reset_write_counts()
+			result = asyncio.run(run())
+			self.assertEqual(result.written, 40)
+			self.assertEqual(model.factory.write_counts["written"], 40)
+			self.assertEqual(model.factory.full_names, False)
+			self.assertEqual(model.factory.json_serializer, "normal")
+		finally:
+			model.factory.base_dir = olddir
+			model.factory.rdf_serializer = oldrdf
+			model.factory.cache_json = False
+			model.factory.reset_write_counts()
+			shutil.rmtree(tmpdir)
+
 	def test_breadth(self):
 		x = model.TransferOfCustody()
 		e = model.Activity()
@@ -197,16 +811,19 @@ class TestFactorySerialization(unittest.TestCase):
 		res2 = model.factory.toString(p, compact=False, collapse=120) # compact list of type
 		self.assertEqual(len(res1.splitlines()), 12)
 		self.assertEqual(len(res2.splitlines()), 6)
+		# The same from text
+		res3 = model.factory.collapse_json(model.factory.toString(p, compact=False), 120)
+		self.assertEqual(res2, res3)
+		self.assertEqual(res2.splitlines()[4], '  "classified_as": [{"id": "http://example.org/Type","type": "Type","_label": "Test"}]')
+		# Nothing to collapse in compact output
+		self.assertEqual(model.factory.toString(p, collapse=120), model.factory.toString(p))
 
 	def test_production_mode(self):
 
-		# model.factory.production_mode()
-		# Can't unset the cached hierarchy
-		# and it causes the test for the hierarchy to fail
-		model.factory.validate_profile = False
-		model.factory.validate_properties = False
-		model.factory.validate_range = False
-		model.factory.validate_multiplicity = False
+		model.factory.production_mode()
+		self.assertFalse(model.factory.validate_properties)
+		# No longer caches the hierarchy into _all_properties
+		self.assertEqual(model.HumanMadeObject._all_properties, {})
 
 		p = model.Person()
 		p.identified_by = model.Name(value="abc")
@@ -316,14 +933,18 @@ class TestAutoIdentifiers(unittest.TestCase):
 
 	def test_prefixes(self):
 
-		model.factory.prefixes = {'fish':'http://example.org/ns/'}
-		p3 = model.Person('fish:3')
-		self.assertEqual(p3.id, 'fish:3')
-		self.assertEqual(p3._full_id, 'http://example.org/ns/3')
+		prefixes = model.factory.prefixes
+		try:
+			model.factory.prefixes = {'fish':'http://example.org/ns/'}
+			p3 = model.Person('fish:3')
+			self.assertEqual(p3.id, 'fish:3')
+			self.assertEqual(p3._full_id, 'http://example.org/ns/3')
 
-		model.factory.prefixes = {}
-		p4 = model.Person('fish:4')
-		self.assertTrue(p4.id.startswith(model.factory.base_url))
+			model.factory.prefixes = {}
+			p4 = model.Person('fish:4')
+			self.assertTrue(p4.id.startswith(model.factory.base_url))
+		finally:
+			model.factory.prefixes = prefixes
 
 	def test_other_uris(self):
 		p1 = model.Person(ident="tag:some-info-about-person")
@@ -446,7 +1067,30 @@ class TestPropertyCache(unittest.TestCase):
 		self.assertEqual(o._all_properties, {})
 		model.factory.cache_hierarchy()
 		self.assertTrue(len(o._all_properties) > 50)
-		
+
+	def test_property_table(self):
+		o = model.HumanMadeObject()
+		self.assertTrue('identified_by' in o._property_table)
+		self.assertEqual(o._property_table['produced_by'].range, model.Production)
+		self.assertEqual(sorted(o._property_table.keys()), o.list_all_props())
+		# most generic predicate is used for serialization
+		self.assertEqual(model.Person._predicate_table['member_of'], 'la:member_of')
+		self.assertEqual(model.Person._property_table['member_of'].predicate,
+			'crm:P107i_is_current_or_former_member_of')
+
+	def test_property_table_override(self):
+		pinfo = model.Person._all_properties['parent_of']
+		model.Person._all_properties['parent_of'] = pinfo._replace(profile_okay=0)
+		model.rebuild_property_tables()
+		self.assertEqual(model.Person._property_table['parent_of'].profile_okay, 0)
+		override_okay(model.Person, 'parent_of')
+		self.assertEqual(model.Person._property_table['parent_of'].profile_okay, 1)
+
+	def test_multiple_instantiation_table(self):
+		from cromulent import multiple_instantiation as mi
+		self.assertTrue('carried_out_by' in mi.DestructionActivity._property_table)
+		self.assertTrue('destroyed' in mi.DestructionActivity._property_table)
+
 
 class TestMagicMethods(unittest.TestCase):
 
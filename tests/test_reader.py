@@ -7,7 +7,7 @@ except:
 	# 2.6
 	from ordereddict import OrderedDict
 
-from cromulent import reader
+from cromulent import reader, model
 from cromulent.model import factory, Person, DataError, BaseResource, \
 	Dimension, override_okay, AttributeAssignment
 
@@ -44,6 +44,187 @@ class TestReader(unittest.TestCase):
 		unknown2 = '{"type":"Person", "fishbat": "bob"}'
 		self.assertRaises(DataError, self.reader.read, unknown)
 
+	@unittest.skipUnless(model.get_orjson(), "orjson is not installed")
+	def test_read_orjson(self):
+		factory.json_backend = "orjson"
+		try:
+			self.assertRaises(DataError, self.reader.read, "This is not JSON")
+			levelstr = '{"type": "Person", "parent_of": {"type": "Person", "_label": "child é"}}'
+			what = self.reader.read(levelstr)
+			self.assertEqual(what.parent_of[0]._label, "child é")
+		finally:
+			factory.json_backend = "json"
+
+	def test_read_bundle(self):
+		import os
+		import shutil
+		import tempfile
+		from cromulent.sinks import Bundle
+		people = [Person(ident="person/%s" % i, label="Person %s é" % i) for i in range(5)]
+		tmpdir = tempfile.mkdtemp()
+		try:
+			fn = os.path.join(tmpdir, "people.bundle")
+			self.assertEqual(factory.toBundle(people[:3], fn), 3)
+			# Appending adds to the end, and replaces records with the same id
+			people[1]._label = "Changed"
+			self.assertEqual(factory.toBundle(people[1:], fn), 4)
+			with Bundle(fn) as bundle:
+				self.assertEqual(len(bundle), 5)
+				self.assertEqual(bundle.read(people[0].id), factory.toString(people[0]))
+				self.assertTrue(isinstance(bundle.get(people[4].id), memoryview))
+				what = self.reader.read_bundle(bundle, people[1].id)
+				self.assertTrue(isinstance(what, Person))
+				self.assertEqual(what._label, "Changed")
+				self.assertRaises(KeyError, bundle.get, "http://example.org/nothing")
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_read_stream(self):
+		import io
+		import os
+		import shutil
+		import tempfile
+		people = [Person(ident="person/%s" % i, label="Person %s é" % i) for i in range(5)]
+		people[2].parent_of = Person(label="Child")
+		docs = [factory.toString(p) for p in people]
+		lines = "\n".join(docs) + "\n\n"
+		array = ' [\n' + ",\n ".join(factory.toString(p, compact=False) for p in people) + "\n]\n"
+		for text in [lines, array]:
+			for chunk_size in [7, 65536]:
+				# a text stream, and a binary one with é split between chunks
+				for strm in [io.StringIO(text), io.BytesIO(text.encode('utf-8'))]:
+					got = list(self.reader.read_stream(strm, chunk_size=chunk_size))
+					self.assertEqual([factory.toString(p) for p in got], docs)
+		self.assertEqual(list(self.reader.read_stream(io.StringIO("[ ]"))), [])
+		self.assertEqual(list(self.reader.read_stream(io.StringIO(""))), [])
+		for bad in ['[{"type": "Person"} {"type": "Person"}]', '[{"type": "Person"', '["x"]',
+				'{"type": "Person"}\n{"type": "FishBat"}']:
+			self.assertRaises(DataError, list, self.reader.read_stream(io.StringIO(bad), chunk_size=4))
+
+		tmpdir = tempfile.mkdtemp()
+		try:
+			fn = os.path.join(tmpdir, "people.jsonl.gz")
+			factory.toSink(people, fn)
+			got = list(self.reader.read_stream(fn))
+			self.assertEqual(got[2].parent_of[0]._label, "Child")
+		finally:
+			shutil.rmtree(tmpdir)
+
+	def test_vocab_class_index(self):
+		key = ("HumanMadeObject", "http://vocab.getty.edu/aat/999999999")
+		self.assertTrue(reader.Reader().vocab_classes is self.reader.vocab_classes)
+		self.assertEqual(self.reader.vocab_classes[("HumanMadeObject", "http://vocab.getty.edu/aat/300033618")],
+			vocab.Painting)
+		try:
+			vocab.register_vocab_class("TestThingB", {"parent": model.HumanMadeObject, "id": "999999999", "label": "B"})
+			vocab.register_vocab_class("TestThingA", {"parent": model.HumanMadeObject, "id": "999999999", "label": "A"})
+			# the last in sorted order wins, whichever order they were added in
+			self.assertEqual(self.reader.vocab_classes[key], vocab.TestThingB)
+			what = self.reader.read('{"type": "HumanMadeObject", "classified_as": [{"id": "http://vocab.getty.edu/aat/999999999", "type": "Type"}]}')
+			self.assertTrue(isinstance(what, vocab.TestThingB))
+		finally:
+			del vocab.TestThingA
+			del vocab.TestThingB
+			vocab.clear_vocab_class_index()
+		self.assertFalse(key in reader.Reader().vocab_classes)
+
+	def test_read_deep(self):
+		# Deeper than the recursion limit
+		import sys
+		depth = sys.getrecursionlimit() + 500
+		js = {"id": "http://example.org/text/%s" % depth, "type": "LinguisticObject"}
+		for i in range(depth - 1, -1, -1):
+			js = {"id": "http://example.org/text/%s" % i, "type": "LinguisticObject", "part_of": [js]}
+		what = self.reader.read(js)
+		for i in range(depth):
+			what = what.part_of[0]
+		self.assertEqual(what.id, "http://example.org/text/%s" % depth)
+
+		# References to resources later in the document are resolved at the end
+		data = '{"type": "Person", "id": "http://example.org/p/1", "parent_of": [' \
+			'{"type": "Person", "id": "http://example.org/p/2", "parent_of": "http://example.org/p/3"},' \
+			'{"type": "Person", "id": "http://example.org/p/3", "parent_of": "http://example.org/p/1"}]}'
+		what = self.reader.read(data)
+		self.assertTrue(what.parent_of[0].parent_of[0] is what.parent_of[1])
+		self.assertTrue(what.parent_of[1].parent_of[0] is what)
+
+	def test_read_trusted(self):
+		trusted = reader.Reader(trusted=True)
+		what = vocab.Painting(ident="object/1", label="Painting", art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting")
+		what.identified_by = vocab.AccessionNumber(content="1")
+		h = vocab.Height(value=6)
+		h.unit = vocab.instances['inches']
+		what.dimension = h
+		prod = model.Production(ident="object/1/production")
+		prod.carried_out_by = Person(ident="person/1", label="Artist")
+		what.produced_by = prod
+		docs = [factory.toString(what),
+			'{"type": "Person", "id": "http://example.org/p/1", "parent_of": [' \
+			'{"type": "Person", "id": "http://example.org/p/2", "parent_of": "http://example.org/p/3"},' \
+			'{"type": "Person", "id": "http://example.org/p/3", "parent_of": "http://example.org/p/1"}]}',
+			'{"type": "AttributeAssignment", "assigned_property": "classified_as", ' \
+			'"technique": "http://vocab.getty.edu/aat/300054766"}']
+		for data in docs:
+			expected = factory.toString(self.reader.read(data))
+			got = trusted.read(data)
+			self.assertEqual(factory.toString(got), expected)
+		self.assertTrue(isinstance(got.technique[0], model.Type))
+		self.assertEqual(got.assigned_property, "classified_as")
+
+		got = trusted.read(docs[0])
+		self.assertTrue(isinstance(got, vocab.Painting))
+		self.assertEqual(got.id, what.id)
+		self.assertEqual(got.classified_as, what.classified_as)
+		got = trusted.read(docs[1])
+		self.assertTrue(got.parent_of[0].parent_of[0] is got.parent_of[1])
+		self.assertTrue(got.parent_of[1].parent_of[0] is got)
+
+		factory.process_multiplicity = False
+		try:
+			got = trusted.read(docs[0])
+			self.assertTrue(isinstance(got.produced_by, model.Production))
+			self.assertEqual(len(got.identified_by), 2)
+		finally:
+			factory.process_multiplicity = True
+
+	def test_read_dir(self):
+		import os
+		import shutil
+		import tempfile
+		people = [Person(ident="person/%s" % i, label="Person %s" % i) for i in range(9)]
+		olddir = factory.base_dir
+		tmpdir = tempfile.mkdtemp()
+		try:
+			factory.base_dir = tmpdir
+			factory.write_many(people)
+			with open(os.path.join(tmpdir, "Person", "bad.json"), 'w') as fh:
+				fh.write("This is not JSON")
+			# not read: temporary files and other extensions
+			for fn in [".1.json.1-0.tmp", "manifest.tsv"]:
+				with open(os.path.join(tmpdir, "Person", fn), 'w') as fh:
+					fh.write("{}")
+			expected = [factory.toString(p) for p in people]
+			for kw in [{}, {"workers": 2, "batch_size": 2, "max_pending": 1}, {"workers": 2, "ordered": False}]:
+				results = list(self.reader.read_dir(**kw))
+				self.assertEqual(len(results), 10)
+				errors = [r for r in results if r.error]
+				self.assertEqual(len(errors), 1)
+				self.assertEqual(os.path.basename(errors[0].filename), "bad.json")
+				self.assertTrue(errors[0].error.startswith("DataError"))
+				got = [factory.toString(r.resource) for r in results if r.resource is not None]
+				if kw.get("ordered", True):
+					self.assertEqual([r.filename for r in results],
+						sorted(r.filename for r in results))
+				else:
+					got.sort(key=expected.index)
+				self.assertEqual(got, expected)
+			factory.base_dir = ""
+			self.assertRaises(model.ConfigurationError, list, self.reader.read_dir())
+		finally:
+			factory.base_dir = olddir
+			shutil.rmtree(tmpdir)
+
 	def test_attrib_assign(self):
 		vocab.add_attribute_assignment_check()
 
@@ -140,3 +140,54 @@ class TestClassBuilder(unittest.TestCase):
 		self.assertTrue('content' in js['referred_to_by'][0])
 		self.assertTrue('type' in js['referred_to_by'][0]['classified_as'][0]['classified_as'][0])
 
+	def test_multiple_instantiation_boundary(self):
+		from cromulent import multiple_instantiation as mi
+		vocab.add_linked_art_boundary_check()
+		mi.DestructionActivity._okayToUse = 1
+		what = model.HumanMadeObject(label="Object")
+		what.destroyed_by = mi.DestructionActivity(label="Destruction")
+		js = factory.toJSON(what)
+		# Embedded, as the default for a class in neither list
+		self.assertEqual(js['destroyed_by']['_label'], "Destruction")
+		self.assertEqual(js['destroyed_by']['type'], ['Destruction', 'Activity'])
+
+	def test_split_records(self):
+		vocab.add_linked_art_boundary_check()
+		artist = model.Person(label="Artist")
+		artist.identified_by = vocab.PrimaryName(content="Artist")
+		coll = vocab.CollectionSet(label="Collection")
+		coll.identified_by = vocab.PrimaryName(content="Collection")
+		objs = []
+		for i in range(3):
+			what = vocab.Painting(label="Painting %s" % i)
+			prod = model.Production()
+			prod.carried_out_by = artist
+			what.produced_by = prod
+			what.member_of = coll
+			coll.referred_to_by = vocab.Description(content="Includes %s" % i)
+			objs.append(what)
+		nobody = model.Person(label="No data")
+		objs[0].current_owner = nobody
+		top = model.LinguisticObject(label="Catalogue")
+		for what in objs:
+			top.refers_to = what
+		# A cycle back to the top
+		artist.referred_to_by = top
+
+		found = factory.find_serializable(top)
+		self.assertEqual([id(x) for x in found], [id(objs[0]), id(artist), id(top), id(coll), id(objs[1]), id(objs[2])])
+		self.assertEqual([id(x) for x in factory.iter_serializable(top)], [id(x) for x in found])
+
+		docs = list(factory.split_records(top))
+		self.assertEqual([id(x[0]) for x in docs], [id(top), id(objs[0]), id(artist), id(coll), id(objs[1]), id(objs[2])])
+		self.assertEqual(docs[2][1], factory.toJSON(artist))
+		self.assertTrue('identified_by' in docs[2][1])
+		self.assertFalse('identified_by' in docs[1][1]['produced_by']['carried_out_by'][0])
+
+		factory.linked_art_boundaries = False
+		try:
+			self.assertRaises(model.ConfigurationError, factory.find_serializable, top)
+			self.assertRaises(model.ConfigurationError, next, factory.split_records(top))
+		finally:
+			factory.linked_art_boundaries = True
+
@@ -0,0 +1,71 @@
+# Time to write many records from a coroutine, and the longest the event loop
+# was blocked meanwhile, with toFile called directly on the loop and with
+# write_many_async at different concurrency limits
+#
+# python utils/benchmarks/async_write.py [--records 2000] [--concurrency 1,4,8] [--batch 10]
+
+import os
+import sys
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=2000)
+parser.add_argument('--concurrency', dest="concurrency", default="1,4,8")
+parser.add_argument('--batch', dest="batch", type=int, default=10)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		for d in [vocab.Height(value=i % 100), vocab.Width(value=i % 70)]:
+			d.unit = vocab.instances['inches']
+			what.dimension = d
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+async def ticker(state):
+	# How late a 1ms sleep wakes up is how long the loop was blocked
+	while state["running"]:
+		start = time.perf_counter()
+		await asyncio.sleep(0.001)
+		state["stall"] = max(state["stall"], time.perf_counter() - start - 0.001)
+
+async def run(records, concurrency):
+	state = {"running": True, "stall": 0}
+	tick = asyncio.ensure_future(ticker(state))
+	await asyncio.sleep(0)
+	start = time.perf_counter()
+	if concurrency:
+		await model.factory.write_many_async(records, concurrency=concurrency, batch_size=args.batch, compact=False)
+	else:
+		for what in records:
+			model.factory.toFile(what, compact=False)
+		await asyncio.sleep(0)
+	elapsed = time.perf_counter() - start
+	state["running"] = False
+	await tick
+	return (elapsed, state["stall"])
+
+if __name__ == "__main__":
+	records = build(args.records)
+	print("Writing %s records from a coroutine" % args.records)
+	for concurrency in [0] + [int(x) for x in args.concurrency.split(',')]:
+		tmpdir = tempfile.mkdtemp()
+		model.factory.base_dir = tmpdir
+		try:
+			(elapsed, stall) = asyncio.run(run(records, concurrency))
+		finally:
+			shutil.rmtree(tmpdir)
+		name = "concurrency %s" % concurrency if concurrency else "toFile on loop"
+		print("  %-16s %8.1f ms  longest stall %8.1f ms" % (name, elapsed * 1000, stall * 1000))
@@ -0,0 +1,75 @@
+# Time to look records up by id in a bundle mapped into memory, compared with
+# reading the file toFile wrote for each, and to read them into resources
+#
+# python utils/benchmarks/bundle.py [--records 20000] [--reads 5000]
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=20000)
+parser.add_argument('--reads', dest="reads", type=int, default=5000)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab, reader
+from cromulent.sinks import Bundle
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+records = build(args.records)
+ids = [r.id for r in random.Random(1).sample(records, min(args.reads, len(records)))]
+tmpdir = tempfile.mkdtemp()
+fac = model.factory
+fac.base_dir = os.path.join(tmpdir, "files")
+try:
+	fac.write_many(records)
+	fn = os.path.join(tmpdir, "records.bundle")
+	start = time.perf_counter()
+	fac.toBundle(records, fn)
+	print("toBundle of %s records: %.1f ms" % (args.records, (time.perf_counter() - start) * 1000))
+
+	print("Looking up %s records by id" % len(ids))
+	start = time.perf_counter()
+	for i in ids:
+		with open(fac.get_filename(i)) as fh:
+			fh.read()
+	print("  %-18s %8.1f ms" % ("read files", (time.perf_counter() - start) * 1000))
+	start = time.perf_counter()
+	bundle = Bundle(fn)
+	open_time = time.perf_counter() - start
+	start = time.perf_counter()
+	for i in ids:
+		bundle.get(i).release()
+	print("  %-18s %8.1f ms  (+ %.1f ms to open)" % ("Bundle.get", (time.perf_counter() - start) * 1000, open_time * 1000))
+	start = time.perf_counter()
+	for i in ids:
+		bundle.read(i)
+	print("  %-18s %8.1f ms" % ("Bundle.read", (time.perf_counter() - start) * 1000))
+
+	rdr = reader.Reader()
+	start = time.perf_counter()
+	for i in ids:
+		with open(fac.get_filename(i)) as fh:
+			rdr.read(fh.read())
+	print("  %-18s %8.1f ms" % ("files + Reader", (time.perf_counter() - start) * 1000))
+	start = time.perf_counter()
+	for i in ids:
+		rdr.read_bundle(bundle, i)
+	print("  %-18s %8.1f ms" % ("read_bundle", (time.perf_counter() - start) * 1000))
+	bundle.close()
+finally:
+	shutil.rmtree(tmpdir)
@@ -0,0 +1,47 @@
+# Time to write Elasticsearch _bulk NDJSON files for many records with
+# toBulkFiles, compared with a file per record from toFile
+#
+# python utils/benchmarks/es_bulk.py [--records 5000] [--count 500] [--bytes 5242880]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=5000)
+parser.add_argument('--count', dest="count", type=int, default=500)
+parser.add_argument('--bytes', dest="bytes", type=int, default=5242880)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+records = build(args.records)
+fac = model.factory
+fac.elasticsearch_compatible = True
+tmpdir = tempfile.mkdtemp()
+fac.base_dir = os.path.join(tmpdir, "files")
+print("Writing %s records with elasticsearch_compatible" % args.records)
+try:
+	start = time.perf_counter()
+	fac.write_many(records)
+	print("  %-12s %8.1f ms  %s files" % ("toFile", (time.perf_counter() - start) * 1000, len(records)))
+	start = time.perf_counter()
+	fns = fac.toBulkFiles(records, os.path.join(tmpdir, "bulk-%05d.ndjson"), index="objects",
+		max_count=args.count, max_bytes=args.bytes)
+	print("  %-12s %8.1f ms  %s files" % ("toBulkFiles", (time.perf_counter() - start) * 1000, len(fns)))
+finally:
+	shutil.rmtree(tmpdir)
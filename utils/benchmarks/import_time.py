@@ -0,0 +1,39 @@
+# Time to import cromulent.model, and to then import the RDF libraries,
+# which are only loaded when toRDF() first needs them
+#
+# python utils/benchmarks/import_time.py [--runs 20]
+
+import os
+import sys
+import argparse
+import subprocess
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--runs', dest="runs", type=int, default=20)
+args = parser.parse_args()
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+code = """
+import time
+start = time.perf_counter()
+import cromulent.model
+mid = time.perf_counter()
+import pyld
+import rdflib
+end = time.perf_counter()
+print(mid - start, end - mid)
+"""
+
+env = dict(os.environ)
+env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+model = []
+rdf = []
+for r in range(args.runs):
+	out = subprocess.check_output([sys.executable, '-c', code], env=env)
+	(m, l) = out.split()
+	model.append(float(m))
+	rdf.append(float(l))
+
+print("Import times (best of %s)" % args.runs)
+print("  cromulent.model        %7.1f ms" % (min(model) * 1000))
+print("  then pyld and rdflib   %7.1f ms" % (min(rdf) * 1000))
@@ -0,0 +1,69 @@
+# Time to re-serialize records after changing one resource in each,
+# with and without factory.cache_json
+#
+# python utils/benchmarks/json_cache.py [--records 2000] [--runs 5]
+
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=2000)
+parser.add_argument('--runs', dest="runs", type=int, default=5)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		for dim in [vocab.Height(value=i % 100), vocab.Width(value=i % 70)]:
+			dim.unit = vocab.instances['inches']
+			what.dimension = dim
+		prod = model.Production()
+		prod.carried_out_by = model.Person(ident="artist/%s" % (i % 50), label="Artist")
+		ts = model.TimeSpan()
+		ts.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		ts.end_of_the_end = "1850-12-31T23:59:59Z"
+		prod.timespan = ts
+		what.produced_by = prod
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		for p in range(5):
+			# a provenance history
+			acq = model.Acquisition(label="Acquisition %s" % p)
+			acq.transferred_title_of = what
+			acq.transferred_title_to = model.Group(ident="owner/%s" % p, label="Owner %s" % p)
+			ts = model.TimeSpan()
+			ts.begin_of_the_begin = "19%s0-01-01T00:00:00Z" % p
+			acq.timespan = ts
+			what.changed_ownership_through = acq
+		records.append(what)
+	return records
+
+def run(records, cache):
+	model.factory.cache_json = cache
+	times = []
+	for r in range(args.runs):
+		# patch one event in every record, then serialize them all again
+		for what in records:
+			what.changed_ownership_through[r % 5]._label = "Acquisition, run %s" % r
+		start = time.perf_counter()
+		out = [model.factory.toString(what) for what in records]
+		times.append(time.perf_counter() - start)
+	return min(times), out
+
+records = build(args.records)
+print("Re-serializing %s records with one changed event each (best of %s)" % (args.records, args.runs))
+for srlz in ["normal", "fast"]:
+	model.factory.json_serializer = srlz
+	model.factory.clear_json_cache()
+	plain, out1 = run(records, False)
+	run(records, True)
+	cached, out2 = run(records, True)
+	print("  %-7s no cache %8.1f ms   cache_json %8.1f ms%s" % (srlz, plain * 1000, cached * 1000,
+		"" if out1 == out2 else "  OUTPUT DIFFERS"))
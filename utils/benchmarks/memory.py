@@ -0,0 +1,68 @@
+# Memory used per node, with and without CROMULENT_COMPACT_STORAGE
+#
+# python utils/benchmarks/memory.py [--nodes 20000]
+
+import os
+import sys
+import gc
+import argparse
+import subprocess
+import tracemalloc
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--nodes', dest="nodes", type=int, default=20000)
+parser.add_argument('--child', dest="child", action="store_true")
+args = parser.parse_args()
+
+def build(n):
+	from cromulent import model, vocab
+	out = []
+	for i in range(n):
+		which = i % 4
+		if which == 0:
+			what = vocab.PrimaryName(content="Name %s" % i)
+		elif which == 1:
+			what = vocab.LocalNumber(content=str(i))
+		elif which == 2:
+			what = vocab.Height(value=i)
+			what.unit = vocab.instances['inches']
+		else:
+			what = model.TimeSpan()
+			what.begin_of_the_begin = "1800-01-01T00:00:00Z"
+			what.end_of_the_end = "1800-12-31T23:59:59Z"
+		out.append(what)
+	return out
+
+def child(n):
+	from cromulent import model, vocab
+	model.factory.auto_assign_id = False
+	build(100)
+	gc.collect()
+	tracemalloc.start()
+	start = tracemalloc.get_traced_memory()[0]
+	nodes = build(n)
+	built = tracemalloc.get_traced_memory()[0]
+	for what in nodes:
+		model.factory.toString(what)
+	gc.collect()
+	serialized = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	# subtract the list holding the nodes
+	per = 8.0
+	print("%.1f %.1f" % ((built - start) / n - per, (serialized - start) / n - per))
+
+if args.child:
+	child(args.nodes)
+else:
+	results = {}
+	root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+	for mode in ["0", "1"]:
+		env = dict(os.environ)
+		env['CROMULENT_COMPACT_STORAGE'] = mode
+		env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+		out = subprocess.check_output([sys.executable, os.path.abspath(__file__),
+			'--child', '--nodes', str(args.nodes)], env=env)
+		results[mode] = [float(x) for x in out.split()]
+	print("Bytes per node (%s nodes)     built   after toString" % args.nodes)
+	print("  __dict__ (default)       %8.1f %8.1f" % tuple(results["0"]))
+	print("  compact storage          %8.1f %8.1f" % tuple(results["1"]))
@@ -0,0 +1,67 @@
+# Time to write many records into a pairtree with toFile, making the directories
+# for every file as before, with the directory cache, in bulk_output mode and
+# with atomic writes
+#
+# python utils/benchmarks/pairtree_write.py [--records 5000] [--levels 3] [--runs 3]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=5000)
+parser.add_argument('--levels', dest="levels", type=int, default=3)
+parser.add_argument('--runs', dest="runs", type=int, default=3)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model
+
+fac = model.factory
+fac.pair_tree_levels = args.levels
+
+def build(n):
+	# Scattered hex names, so the records spread over the pairtree
+	records = []
+	for i in range(n):
+		name = "%08x" % (i * 2654435761 % 2**32)
+		records.append(model.HumanMadeObject(ident="object/%s" % name, label="Object %s" % i))
+	return records
+
+def uncached(records):
+	for what in records:
+		fac.clear_dir_cache()
+		fac.toFile(what)
+
+def cached(records):
+	for what in records:
+		fac.toFile(what)
+
+def bulk(records):
+	with fac.bulk_output():
+		for what in records:
+			fac.toFile(what)
+
+records = build(args.records)
+tests = [("no dir cache", False, uncached), ("dir cache", False, cached), ("bulk_output", False, bulk),
+	("atomic", True, cached), ("bulk + atomic", True, bulk)]
+print("Writing %s records into a pairtree of %s levels (best of %s)" % (args.records, args.levels, args.runs))
+for (name, atomic, fn) in tests:
+	fac.atomic_writes = atomic
+	times = []
+	for r in range(args.runs):
+		tmpdir = tempfile.mkdtemp()
+		fac.base_dir = tmpdir
+		fac.clear_dir_cache()
+		try:
+			# The second pass overwrites, with the directories all made
+			fn(records)
+			start = time.perf_counter()
+			fn(records)
+			times.append(time.perf_counter() - start)
+		finally:
+			shutil.rmtree(tmpdir)
+	print("  %-14s %8.1f ms" % (name, min(times) * 1000))
@@ -0,0 +1,83 @@
+# Time to write N-Quads with the native serializer and through JSON-LD and PyLD,
+# and to build an rdflib graph by parsing the N-Quads or with toGraph()
+#
+# python utils/benchmarks/rdf.py [--records 500] [--runs 3]
+
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=500)
+parser.add_argument('--runs', dest="runs", type=int, default=3)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+def build(n):
+	# A Set of objects with names, dimensions, blank node productions
+	# and artists shared between them. The objects don't refer back to
+	# the Set, as PyLD would then try to fetch the nested @context
+	catalogue = model.Set(ident="catalogue", label="Catalogue")
+	artists = [model.Person(ident="artist/%s" % i, label="Artist %s" % i) for i in range(50)]
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		h = vocab.Height(value=i % 100 + 0.5)
+		h.unit = vocab.instances['inches']
+		what.dimension = h
+		prod = model.Production(ident="")
+		prod.carried_out_by = artists[i % len(artists)]
+		ts = model.TimeSpan(ident="")
+		ts.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		ts.end_of_the_end = "1850-12-31T23:59:59Z"
+		prod.timespan = ts
+		what.produced_by = prod
+		catalogue.member = what
+	return catalogue
+
+catalogue = build(args.records)
+results = {}
+outputs = {}
+for srlz in ["pyld", "native"]:
+	model.factory.rdf_serializer = srlz
+	times = []
+	for r in range(args.runs):
+		start = time.perf_counter()
+		out = model.factory.toRDF(catalogue, format="nq")
+		times.append(time.perf_counter() - start)
+	results[srlz] = min(times)
+	outputs[srlz] = out
+
+print("toRDF of a Set of %s records, %s quads (best of %s)" % (args.records, outputs["native"].count("\n"), args.runs))
+for srlz in ["pyld", "native"]:
+	print("  %-10s %8.1f ms" % (srlz, results[srlz] * 1000))
+
+model.factory.rdf_serializer = "native"
+times = {"parse": [], "toGraph": []}
+for r in range(args.runs):
+	start = time.perf_counter()
+	g = model.factory._rdflibGraph()
+	g.parse(data=model.factory.toRDF(catalogue, format="nq"), format="nquads")
+	times["parse"].append(time.perf_counter() - start)
+	start = time.perf_counter()
+	g2 = model.factory.toGraph(catalogue)
+	times["toGraph"].append(time.perf_counter() - start)
+print("rdflib graph of %s triples" % len(g2))
+for k in ["parse", "toGraph"]:
+	print("  %-10s %8.1f ms" % (k, min(times[k]) * 1000))
+
+if args.records <= 500:
+	# isomorphic is slow with many blank nodes
+	from rdflib import Graph
+	from rdflib.compare import isomorphic
+	graphs = []
+	for srlz in ["pyld", "native"]:
+		g = Graph()
+		g.parse(data=outputs[srlz], format="nquads")
+		graphs.append(g)
+	if not isomorphic(*graphs):
+		print("native graph differs from pyld!")
@@ -0,0 +1,55 @@
+# Time to write an N-Quads dump of many records, with a toRDF call per record
+# (through PyLD with bnode_prefix, and natively) and with toRDFStream
+#
+# python utils/benchmarks/rdf_batch.py [--records 1000] [--runs 3] [--skip-pyld]
+
+import io
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=1000)
+parser.add_argument('--runs', dest="runs", type=int, default=3)
+parser.add_argument('--skip-pyld', dest="skip_pyld", action="store_true")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+def build(n):
+	# Separate records, each with blank node names and dimensions
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(ident="", content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(ident="", content="A.%s" % i)
+		h = vocab.Height(ident="", value=i % 100 + 0.5)
+		h.unit = vocab.instances['inches']
+		what.dimension = h
+		records.append(what)
+	return records
+
+def per_record():
+	return ''.join(model.factory.toRDF(r, bnode_prefix=str(i)) for (i, r) in enumerate(records))
+
+def stream():
+	out = io.StringIO()
+	model.factory.toRDFStream(records, out)
+	return out.getvalue()
+
+records = build(args.records)
+tests = [("toRDF native", "native", per_record), ("toRDFStream", "native", stream)]
+if not args.skip_pyld:
+	tests.insert(0, ("toRDF pyld", "pyld", per_record))
+print("N-Quads dump of %s records (best of %s)" % (args.records, args.runs))
+for (name, srlz, fn) in tests:
+	model.factory.rdf_serializer = srlz
+	times = []
+	for r in range(args.runs):
+		start = time.perf_counter()
+		out = fn()
+		times.append(time.perf_counter() - start)
+	print("  %-14s %8.1f ms  %s quads" % (name, min(times) * 1000, out.count("\n")))
+model.factory.rdf_serializer = "native"
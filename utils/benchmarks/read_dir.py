@@ -0,0 +1,65 @@
+# Time to read back a directory of records written by toFile, in this process
+# and with Reader.read_dir on different numbers of worker processes, ordered
+# and not, and optionally in trusted mode
+#
+# python utils/benchmarks/read_dir.py [--records 4000] [--workers 2,4] [--batch 50] [--trusted]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=4000)
+parser.add_argument('--workers', dest="workers", default="2,4")
+parser.add_argument('--batch', dest="batch", type=int, default=50)
+parser.add_argument('--trusted', dest="trusted", action="store_true")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab, reader
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		for d in [vocab.Height(value=i % 100), vocab.Width(value=i % 70)]:
+			d.unit = vocab.instances['inches']
+			what.dimension = d
+		prod = model.Production()
+		ts = model.TimeSpan()
+		ts.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		prod.timespan = ts
+		what.produced_by = prod
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+if __name__ == "__main__":
+	tmpdir = tempfile.mkdtemp()
+	model.factory.base_dir = tmpdir
+	model.factory.pair_tree_levels = 2
+	try:
+		model.factory.write_many(build(args.records))
+		print("Reading %s records on %s CPUs" % (args.records, os.cpu_count()))
+		rdr = reader.Reader(trusted=args.trusted)
+		expected = None
+		for workers in [0] + [int(x) for x in args.workers.split(',')]:
+			for ordered in ([True] if not workers else [True, False]):
+				start = time.perf_counter()
+				results = list(rdr.read_dir(workers=workers, batch_size=args.batch, ordered=ordered))
+				elapsed = time.perf_counter() - start
+				errors = sum(1 for r in results if r.error)
+				label = "%s workers%s" % (workers, "" if ordered else ", unordered") if workers else "in process"
+				print("  %-22s %8.1f ms  %s errors" % (label, elapsed * 1000, errors))
+				names = sorted(r.filename for r in results)
+				if expected is None:
+					expected = names
+				elif names != expected:
+					print("results differ!")
+	finally:
+		shutil.rmtree(tmpdir)
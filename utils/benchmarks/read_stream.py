@@ -0,0 +1,75 @@
+# Time and peak memory to read a dump of many records into resources, loading
+# the whole JSON array or file of lines first, and with Reader.read_stream
+#
+# python utils/benchmarks/read_stream.py [--records 5000]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=5000)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab, reader
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+def load_array(fn):
+	rdr = reader.Reader()
+	with open(fn, encoding='utf-8') as fh:
+		for js in model.factory.json_loads(fh.read()):
+			yield rdr.read(js)
+
+def load_lines(fn):
+	rdr = reader.Reader()
+	with open(fn, encoding='utf-8') as fh:
+		for l in fh.read().split("\n"):
+			if l:
+				yield rdr.read(l)
+
+def stream(fn):
+	return reader.Reader().read_stream(fn)
+
+def run(fn, load):
+	# Timed without tracing memory, which slows everything down
+	start = time.perf_counter()
+	for what in load(fn):
+		pass
+	elapsed = time.perf_counter() - start
+	tracemalloc.start()
+	for what in load(fn):
+		pass
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return (elapsed, peak)
+
+records = build(args.records)
+tmpdir = tempfile.mkdtemp()
+try:
+	jsonl = os.path.join(tmpdir, "dump.jsonl")
+	model.factory.toSink(records, jsonl)
+	array = os.path.join(tmpdir, "dump.json")
+	with open(array, 'w', encoding='utf-8') as fh:
+		fh.write("[\n" + ",\n".join(model.factory.toString(r, compact=False) for r in records) + "\n]\n")
+	del records
+	print("Reading %s records" % args.records)
+	for (name, fn, load) in [("load array", array, load_array), ("stream array", array, stream),
+			("load lines", jsonl, load_lines), ("stream lines", jsonl, stream)]:
+		(elapsed, peak) = run(fn, load)
+		print("  %-14s %8.1f ms  peak %8.1f MB" % (name, elapsed * 1000, peak / 1e6))
+finally:
+	shutil.rmtree(tmpdir)
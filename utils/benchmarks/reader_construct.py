@@ -0,0 +1,150 @@
+# Time for Reader.construct on deep, wide and flat documents, compared with the
+# previous recursive implementation, which can't read very deep ones
+#
+# python utils/benchmarks/reader_construct.py [--depth 5000] [--width 20000] [--runs 3]
+
+import gc
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--depth', dest="depth", type=int, default=5000)
+parser.add_argument('--width', dest="width", type=int, default=20000)
+parser.add_argument('--runs', dest="runs", type=int, default=3)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab, reader
+from cromulent.model import factory, DataError, OrderedDict, BaseResource, STR_TYPES
+
+class LegacyReader(reader.Reader):
+	# construct before it was made iterative
+	def construct(self, js):
+		if '@context' in js:
+			del js['@context']
+		ident = js.get('id', '')
+		typ = js.get('type', None)
+		if typ == None:
+			clx = BaseResource
+		else:
+			try:
+				clx = getattr(model, typ)
+			except AttributeError:
+				raise DataError("Resource %s has unknown class %s" % (ident, typ) )
+		trash = None
+		if 'classified_as' in js:
+			for c in js['classified_as']:
+				i = c.get('id', '')
+				clx2 = self.vocab_classes.get((typ, i), None)
+				if clx2 is not None:
+					clx = clx2
+					trash = c
+					break
+		what = clx(ident=ident)
+		what._validate_profile = self.validate_profile
+		self.uri_object_map[ident] = what
+		if self.validate_props:
+			propList = what.list_all_props()
+		itms = list(js.items())
+		itms.sort(key=lambda x: factory.key_order_hash.get(x[0], 10000))
+		for (prop, value) in itms:
+			if prop in ['id', 'type']:
+				continue
+			if self.validate_props and not prop in propList:
+				raise DataError("Unknown property %s on %s" % (prop, clx.__name__))
+			pinfo = what._property_table.get(prop, None)
+			rng = pinfo.range if pinfo is not None else None
+			if type(value) != list:
+				value = [value]
+			for subvalue in value:
+				if trash is not None and prop == 'classified_as' and subvalue == trash:
+					continue
+				if rng == str:
+					setattr(what, prop, subvalue)
+				elif type(subvalue) == dict or isinstance(subvalue, OrderedDict):
+					val = self.construct(subvalue)
+					setattr(what, prop, val)
+				elif type(subvalue) in STR_TYPES and prop in self.vocab_props:
+					setattr(what, prop, subvalue)
+				elif type(subvalue) in STR_TYPES:
+					if subvalue in self.uri_object_map:
+						setattr(what, prop, self.uri_object_map[subvalue])
+					elif rng in [model.Type, BaseResource]:
+						setattr(what, prop, rng(ident=subvalue))
+					else:
+						self.forward_refs.append([what, prop, subvalue])
+				else:
+					raise DataError("Value %r is not expected for %s" % (subvalue, prop))
+		return what
+
+def deep(n):
+	# A chain of texts, each part of the next, built as dicts as json.loads
+	# can't parse documents this deep either
+	js = {"id": "http://example.org/text/%s" % n, "type": "LinguisticObject", "_label": "Text %s" % n}
+	for i in range(n - 1, -1, -1):
+		js = {"id": "http://example.org/text/%s" % i, "type": "LinguisticObject", "_label": "Text %s" % i,
+			"part_of": [js]}
+	return js
+
+def wide(n):
+	# A set with n members, each named and referring back to the set
+	members = []
+	for i in range(n):
+		members.append({"id": "http://example.org/object/%s" % i, "type": "HumanMadeObject",
+			"_label": "Object %s" % i,
+			"classified_as": [{"id": "http://vocab.getty.edu/aat/300033618", "type": "Type", "_label": "Painting"}],
+			"identified_by": [{"type": "Name", "content": "Object %s" % i}],
+			"member_of": ["http://example.org/set"]})
+	return {"id": "http://example.org/set", "type": "Set", "_label": "Set", "member": members}
+
+def copy(js):
+	# construct changes the dicts, so each run needs a fresh copy
+	return factory.json_loads(factory.json_dumps(js))
+
+def flat(n):
+	# A set with n members, with only literal values and references
+	members = []
+	for i in range(n):
+		members.append({"id": "http://example.org/text/%s" % i, "type": "LinguisticObject",
+			"_label": "Text %s" % i, "content": "Text number %s" % i,
+			"member_of": ["http://example.org/set"]})
+	return {"id": "http://example.org/set", "type": "Set", "_label": "Set", "member": members}
+
+def run(cls, js, raw=False):
+	# Returns the time and the output of one run, without keeping the
+	# resources, so each implementation runs with the same heap
+	data = js() if raw else copy(js)
+	gc.collect()
+	start = time.perf_counter()
+	try:
+		what = cls().read(data)
+	except RecursionError:
+		return (None, None)
+	t = time.perf_counter() - start
+	out = None if raw else factory.toString(what)
+	del what
+	return (t, out)
+
+impls = [("recursive", LegacyReader), ("iterative", reader.Reader)]
+for (name, build, n) in [("deep", deep, args.depth), ("wide", wide, args.width), ("flat", flat, args.width)]:
+	raw = name == "deep"
+	js = (lambda: build(n)) if raw else build(n)
+	print("%s document, %s (best of %s)" % (name, n, args.runs))
+	# Alternate between the implementations, as later runs in the same
+	# process tend to be slower
+	times = dict((label, []) for (label, cls) in impls)
+	outputs = {}
+	for r in range(args.runs):
+		for (label, cls) in impls:
+			(t, outputs[label]) = run(cls, js, raw)
+			if t is not None:
+				times[label].append(t)
+	for (label, cls) in impls:
+		if not times[label]:
+			print("  %-10s RecursionError" % label)
+		else:
+			print("  %-10s %8.1f ms" % (label, min(times[label]) * 1000))
+	if outputs["recursive"] != outputs["iterative"]:
+		print("iterative results differ from recursive!")
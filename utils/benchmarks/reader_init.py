@@ -0,0 +1,47 @@
+# Time to make a Reader and read a small document with it, as a web service
+# does per request, with the shared vocab class index and with the previous
+# scan of the vocab module in every Reader
+#
+# python utils/benchmarks/reader_init.py [--requests 2000]
+
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--requests', dest="requests", type=int, default=2000)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab, reader
+
+class LegacyReader(reader.Reader):
+	# Reader.__init__ before the index was shared
+	def __init__(self, validate_props=True, validate_profile=True):
+		reader.Reader.__init__(self, validate_props, validate_profile)
+		self.vocab_classes = {}
+		for cx in dir(vocab):
+			what = getattr(vocab, cx)
+			try:
+				mytype = what._classhier[0].__name__
+			except AttributeError:
+				continue
+			if (cx[0].isupper() and not hasattr(model, cx) and type(what) == type):
+				self.vocab_classes[(mytype, what._classification[0].id)] = what
+
+what = vocab.Painting(ident="object/1", label="Painting", art=1)
+what.identified_by = vocab.PrimaryName(content="Painting")
+doc = model.factory.toString(what)
+
+print("%s requests of Reader() and read() of a %s byte document" % (args.requests, len(doc)))
+for (name, cls) in [("legacy", LegacyReader), ("shared index", reader.Reader)]:
+	start = time.perf_counter()
+	for i in range(args.requests):
+		cls()
+	init_time = time.perf_counter() - start
+	start = time.perf_counter()
+	for i in range(args.requests):
+		cls().read(doc)
+	total = time.perf_counter() - start
+	print("  %-14s Reader() %8.1f ms  with read() %8.1f ms" % (name, init_time * 1000, total * 1000))
@@ -0,0 +1,59 @@
+# Time to read records with the Reader validating properties, without, and
+# in trusted mode, and check they all give the same resources
+#
+# python utils/benchmarks/reader_trusted.py [--records 2000] [--runs 3]
+
+import gc
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=2000)
+parser.add_argument('--runs', dest="runs", type=int, default=3)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab, reader
+from cromulent.model import factory
+
+def build(n):
+	docs = []
+	artist = model.Person(ident="person/1", label="Artist")
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		for d in [vocab.Height(value=i % 100), vocab.Width(value=i % 70)]:
+			d.unit = vocab.instances['inches']
+			what.dimension = d
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		prod = model.Production(ident="object/%s/production" % i)
+		prod.carried_out_by = artist
+		prod.timespan = model.TimeSpan(begin_of_the_begin="1800-01-01T00:00:00Z")
+		what.produced_by = prod
+		what.member_of = model.Set(ident="set/1", label="Collection")
+		docs.append(factory.toString(what))
+	return docs
+
+def run(kw, docs):
+	# Returns the best time and the output, without keeping the resources
+	times = []
+	for r in range(args.runs):
+		gc.collect()
+		start = time.perf_counter()
+		for d in docs:
+			reader.Reader(**kw).read(d)
+		times.append(time.perf_counter() - start)
+	out = [factory.toString(reader.Reader(**kw).read(d)) for d in docs]
+	return (min(times), out)
+
+docs = build(args.records)
+print("Reading %s records (best of %s)" % (len(docs), args.runs))
+outputs = {}
+for (label, kw) in [("validate", {}), ("no validate", {"validate_props": False}), ("trusted", {"trusted": True})]:
+	(t, outputs[label]) = run(kw, docs)
+	print("  %-12s %8.1f ms" % (label, t * 1000))
+if outputs["trusted"] != outputs["validate"] or outputs["trusted"] != docs:
+	print("trusted results differ!")
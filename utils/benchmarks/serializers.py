@@ -0,0 +1,66 @@
+# Time to serialize a large synthetic graph with each json_serializer
+#
+# python utils/benchmarks/serializers.py [--records 2000] [--runs 5] [--indent] [--backend orjson]
+
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=2000)
+parser.add_argument('--runs', dest="runs", type=int, default=5)
+parser.add_argument('--indent', dest="indent", action="store_true")
+parser.add_argument('--backend', dest="backend", default="json")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+def build(n):
+	# A sale catalogue-like Set of objects, each with names, identifiers,
+	# dimensions and a production shared with others by the same artist
+	catalogue = model.Set(ident="catalogue", label="Catalogue")
+	artists = [model.Person(ident="artist/%s" % i, label="Artist %s" % i) for i in range(50)]
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		h = vocab.Height(value=i % 100)
+		h.unit = vocab.instances['inches']
+		what.dimension = h
+		w = vocab.Width(value=i % 70)
+		w.unit = vocab.instances['inches']
+		what.dimension = w
+		prod = model.Production()
+		prod.carried_out_by = artists[i % len(artists)]
+		ts = model.TimeSpan()
+		ts.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		ts.end_of_the_end = "1850-12-31T23:59:59Z"
+		prod.timespan = ts
+		what.produced_by = prod
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		what.member_of = catalogue
+		catalogue.member = what
+	return catalogue
+
+model.factory.json_backend = args.backend
+catalogue = build(args.records)
+compact = not args.indent
+results = {}
+outputs = {}
+for srlz in ["normal", "fast", "compiled"]:
+	model.factory.json_serializer = srlz
+	times = []
+	for r in range(args.runs):
+		start = time.perf_counter()
+		out = model.factory.toString(catalogue, compact=compact)
+		times.append(time.perf_counter() - start)
+	results[srlz] = min(times)
+	outputs[srlz] = out
+
+print("toString of a Set of %s records, %s characters, %s backend (best of %s)" % (args.records, len(outputs["fast"]), args.backend, args.runs))
+for srlz in ["normal", "fast", "compiled"]:
+	print("  %-10s %8.1f ms" % (srlz, results[srlz] * 1000))
+if outputs["fast"] != outputs["compiled"]:
+	print("compiled output differs from fast!")
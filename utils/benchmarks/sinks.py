@@ -0,0 +1,67 @@
+# Time to write many records as a file each with toFile and into one file with
+# each of the toSink formats, the size on disk, and the time to read records
+# back by id with the index
+#
+# python utils/benchmarks/sinks.py [--records 5000] [--reads 500]
+
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=5000)
+parser.add_argument('--reads', dest="reads", type=int, default=500)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+from cromulent.sinks import SinkIndex
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		for d in [vocab.Height(value=i % 100), vocab.Width(value=i % 70)]:
+			d.unit = vocab.instances['inches']
+			what.dimension = d
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+def du(path):
+	if os.path.isfile(path):
+		return os.path.getsize(path)
+	total = 0
+	for (d, dirs, files) in os.walk(path):
+		total += sum(os.path.getsize(os.path.join(d, f)) for f in files)
+	return total
+
+records = build(args.records)
+ids = [r.id for r in random.Random(1).sample(records, min(args.reads, len(records)))]
+tmpdir = tempfile.mkdtemp()
+model.factory.base_dir = os.path.join(tmpdir, "files")
+print("Writing %s records, reading %s by id" % (args.records, len(ids)))
+try:
+	start = time.perf_counter()
+	model.factory.write_many(records)
+	elapsed = time.perf_counter() - start
+	print("  %-10s %8.1f ms  %10s bytes" % ("toFile", elapsed * 1000, du(model.factory.base_dir)))
+	for ext in ["jsonl", "jsonl.gz", "jsonl.xz", "tar", "zip"]:
+		fn = os.path.join(tmpdir, "dump." + ext)
+		start = time.perf_counter()
+		model.factory.toSink(records, fn, index=True)
+		elapsed = time.perf_counter() - start
+		idx = SinkIndex(fn + ".idx")
+		start = time.perf_counter()
+		for i in ids:
+			idx.read(i)
+		read_time = time.perf_counter() - start
+		print("  %-10s %8.1f ms  %10s bytes  reads %8.1f ms" % (ext, elapsed * 1000, du(fn), read_time * 1000))
+finally:
+	shutil.rmtree(tmpdir)
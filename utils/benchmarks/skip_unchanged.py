@@ -0,0 +1,56 @@
+# Time to regenerate a directory of records where only some have changed,
+# rewriting every file, with skip_unchanged comparing with the existing files,
+# and with skip_unchanged and a WriteManifest
+#
+# python utils/benchmarks/skip_unchanged.py [--records 5000] [--changed 5]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=5000)
+parser.add_argument('--changed', dest="changed", type=int, default=5, help="percentage of records changed")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+fac = model.factory
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+def change(records):
+	step = max(100 // max(args.changed, 1), 1)
+	for what in records[::step]:
+		what._label = what._label + "!"
+
+tests = [("rewrite all", False, False), ("compare files", True, False), ("manifest", True, True)]
+print("Regenerating %s records, %s%% changed" % (args.records, args.changed))
+for (name, skip, manifest) in tests:
+	records = build(args.records)
+	tmpdir = tempfile.mkdtemp()
+	fac.base_dir = tmpdir
+	fac.skip_unchanged = skip
+	fac.write_manifest = model.WriteManifest() if manifest else None
+	try:
+		# The first run writes everything, the second is timed
+		fac.write_many(records)
+		change(records)
+		start = time.perf_counter()
+		result = fac.write_many(records)
+		elapsed = time.perf_counter() - start
+	finally:
+		shutil.rmtree(tmpdir)
+	print("  %-14s %8.1f ms  %s written, %s skipped" % (name, elapsed * 1000, result.written, result.skipped))
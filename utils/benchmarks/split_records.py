@@ -0,0 +1,112 @@
+# Time to find the linked art records in a large graph and split it into
+# documents, compared with the previous recursive find_serializable
+#
+# python utils/benchmarks/split_records.py [--records 12000] [--legacy 300]
+
+import os
+import sys
+import time
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=12000)
+parser.add_argument('--legacy', dest="legacy", type=int, default=300,
+	help="number of records to compare with the previous implementation, which is quadratic")
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+from cromulent.model import ExternalResource
+
+vocab.add_linked_art_boundary_check()
+fac = model.factory
+
+def legacy_find_serializable(what):
+	# find_serializable before it was made iterative and identity based
+	found = []
+	props = what.list_my_props()
+	for p in props:
+		if p in ['id', 'type', '_label', 'content', 'value', 'begin_of_the_begin', 'end_of_the_end']:
+			continue
+		val = getattr(what, p)
+		if isinstance(val, ExternalResource):
+			val = [val]
+		if type(val) is list:
+			for v in val:
+				if isinstance(v, ExternalResource):
+					if not v in found and v.id and not v._linked_art_boundary_okay(what, p, v) and set(v.list_my_props()).difference(set(["_label", "id"])):
+						found.append(v)
+					downstream = legacy_find_serializable(v)
+					for d in downstream:
+						if not d in found:
+							found.append(d)
+	return found
+
+def build(n):
+	# A catalogue text about n objects, each with names, identifiers,
+	# dimensions and a production by one of a set of shared artists,
+	# and owned by one of a set of shared groups. No cycles, as the
+	# legacy implementation can't handle them
+	count = [1]
+	def node(what):
+		count[0] += 1
+		return what
+	catalogue = model.LinguisticObject(ident="catalogue", label="Catalogue")
+	artists = []
+	for i in range(max(n // 20, 1)):
+		a = node(model.Person(ident="artist/%s" % i, label="Artist %s" % i))
+		a.identified_by = node(vocab.PrimaryName(content="Artist %s" % i))
+		b = node(model.Birth())
+		b.timespan = node(model.TimeSpan())
+		b.timespan.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		a.born = b
+		artists.append(a)
+	owners = []
+	for i in range(max(n // 50, 1)):
+		g = node(model.Group(ident="group/%s" % i, label="Group %s" % i))
+		g.identified_by = node(vocab.PrimaryName(content="Group %s" % i))
+		owners.append(g)
+	for i in range(n):
+		what = node(vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1))
+		what.identified_by = node(vocab.PrimaryName(content="Painting %s" % i))
+		what.identified_by = node(vocab.AccessionNumber(content="A.%s" % i))
+		for d in [vocab.Height(value=i % 100), vocab.Width(value=i % 70)]:
+			d.unit = vocab.instances['inches']
+			what.dimension = node(d)
+		prod = node(model.Production())
+		prod.carried_out_by = artists[i % len(artists)]
+		ts = node(model.TimeSpan())
+		ts.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		ts.end_of_the_end = "1850-12-31T23:59:59Z"
+		prod.timespan = ts
+		what.produced_by = prod
+		what.referred_to_by = node(vocab.Description(content="A painting, number %s" % i))
+		what.current_owner = owners[i % len(owners)]
+		catalogue.refers_to = what
+	return (catalogue, count[0])
+
+(small, n) = build(args.legacy)
+start = time.perf_counter()
+old = legacy_find_serializable(small)
+old_time = time.perf_counter() - start
+start = time.perf_counter()
+new = fac.find_serializable(small)
+new_time = time.perf_counter() - start
+print("find_serializable, %s records, %s nodes" % (args.legacy, n))
+print("  %-10s %8.1f ms" % ("legacy", old_time * 1000))
+print("  %-10s %8.1f ms" % ("iterative", new_time * 1000))
+if [id(x) for x in old] != [id(x) for x in new]:
+	print("iterative results differ from legacy!")
+
+(catalogue, n) = build(args.records)
+start = time.perf_counter()
+found = fac.find_serializable(catalogue)
+find_time = time.perf_counter() - start
+start = time.perf_counter()
+docs = 0
+for (what, js) in fac.split_records(catalogue):
+	docs += 1
+split_time = time.perf_counter() - start
+print("%s records, %s nodes" % (args.records, n))
+print("  %-16s %8.1f ms  %s found" % ("find_serializable", find_time * 1000, len(found)))
+print("  %-16s %8.1f ms  %s documents" % ("split_records", split_time * 1000, docs))
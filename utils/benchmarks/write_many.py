@@ -0,0 +1,56 @@
+# Time to write many records to files with toFile in a loop and with
+# write_many on different numbers of worker processes
+#
+# python utils/benchmarks/write_many.py [--records 4000] [--workers 2,4] [--batch 50]
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--records', dest="records", type=int, default=4000)
+parser.add_argument('--workers', dest="workers", default="2,4")
+parser.add_argument('--batch', dest="batch", type=int, default=50)
+args = parser.parse_args()
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from cromulent import model, vocab
+
+def build(n):
+	records = []
+	for i in range(n):
+		what = vocab.Painting(ident="object/%s" % i, label="Painting %s" % i, art=1)
+		what.identified_by = vocab.PrimaryName(content="Painting %s" % i)
+		what.identified_by = vocab.AccessionNumber(content="A.%s" % i)
+		for d in [vocab.Height(value=i % 100), vocab.Width(value=i % 70)]:
+			d.unit = vocab.instances['inches']
+			what.dimension = d
+		prod = model.Production()
+		ts = model.TimeSpan()
+		ts.begin_of_the_begin = "1800-01-01T00:00:00Z"
+		prod.timespan = ts
+		what.produced_by = prod
+		what.referred_to_by = vocab.Description(content="A painting, number %s" % i)
+		records.append(what)
+	return records
+
+if __name__ == "__main__":
+	records = build(args.records)
+	print("Writing %s records on %s CPUs" % (args.records, os.cpu_count()))
+	for workers in [0] + [int(x) for x in args.workers.split(',')]:
+		tmpdir = tempfile.mkdtemp()
+		model.factory.base_dir = tmpdir
+		try:
+			start = time.perf_counter()
+			if workers:
+				model.factory.write_many(records, workers=workers, batch_size=args.batch, compact=False)
+			else:
+				for what in records:
+					model.factory.toFile(what, compact=False)
+			elapsed = time.perf_counter() - start
+		finally:
+			shutil.rmtree(tmpdir)
+		print("  %-12s %8.1f ms" % ("%s workers" % workers if workers else "toFile loop", elapsed * 1000))